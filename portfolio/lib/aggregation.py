@@ -1,122 +1,170 @@
 # Aggregate loaded data
+from typing import Optional, Tuple
+
+import numpy as np
 import pandas as pd
 from pandas.tseries.offsets import BDay
-from django.db.models import F
+from django.db.models import F, Sum, Max, QuerySet, Window
 import datetime
 
+from portfolio.lib.cache import cached
 from portfolio.lib.utils import date_range_gen
-from portfolio.models import Cashflow, Depot, Asset
+from portfolio.models import Account, Cashflow, Depot, Asset, DailyValue
+
+# rows fetched per round trip when streaming query results
+CHUNK_SIZE = 2000
 
 
-def create_cumulative_cashflow() -> pd.Series:
+def _stream_daily(queryset: QuerySet, field: str) -> Tuple[Optional[datetime.date], Optional[np.ndarray]]:
+    """
+    Stream the (date, value) rows of a queryset with a server-side cursor into an array with one entry per day
+    since the first date. The array is allocated once from the last date, which is selected along with the
+    rows (MAX(date) OVER ()), so no intermediate records and no second query are needed.
+    :param queryset: queryset with unique dates
+    :param field: value field
+    :return: first date and array of values (NaN for days without a row), or (None, None) if there are no rows
+    """
+    rows = queryset.annotate(last_date=Window(Max('date'))).order_by('date')\
+        .values_list('date', field, 'last_date').iterator(chunk_size=CHUNK_SIZE)
+
+    start, values = None, None
+    for date, value, last_date in rows:
+        if values is None:
+            start = date
+            values = np.full((last_date - start).days + 1, np.nan)
+
+        values[(date - start).days] = value
+
+    return start, values
+
+
+def _date_index(start: datetime.date, length: int) -> pd.Index:
+    return pd.Index(list(date_range_gen(start, start + datetime.timedelta(days=length - 1))))
+
+
+def create_cumulative_cashflow(account: str = Account.DEFAULT, from_date: datetime.date = None) -> pd.Series:
     """
     Create a time series with the cumulative cashflows.
+    :param account: name of the account
+    :param from_date: only create the series from this date on (the cashflows before are summed up on the
+        previous day)
     :return: DataFrame containing the cumulative cashflows per date
     """
 
     # get cashflows from database
-    cashflows = list(Cashflow.objects.values('date', 'cashflow').order_by('date'))
+    queryset = Cashflow.objects.filter(account__name=account)
+    previous = None
 
-    # no cashflows
-    if not len(cashflows):
-        return pd.Series()
+    if from_date is not None:
+        queryset = queryset.filter(date__gte=from_date)
+        previous = Cashflow.objects.filter(account__name=account, date__lt=from_date)\
+            .aggregate(total=Sum('cashflow'))['total']
 
-    # create data frames
-    cashflows_frame = pd.DataFrame.from_records(cashflows, index='date')
-    cum_sum_frame = pd.DataFrame(index=date_range_gen(cashflows[0]['date'], cashflows[-1]['date']))
+    start, cashflows = _stream_daily(queryset, 'cashflow')
 
-    # merge to create full data frame across entire date range
-    cum_sum_frame = pd.merge(cum_sum_frame, cashflows_frame, how='left', left_index=True, right_index=True)
+    if previous is not None:
+        # prepend the cashflows before from_date on the previous day
+        day_before = from_date - datetime.timedelta(days=1)
+        gap = np.full((start - day_before).days if start is not None else 1, np.nan)
+        start, cashflows = day_before, np.concatenate([gap, cashflows if cashflows is not None else []])
+        cashflows[0] = previous
 
-    # aggregate
-    cum_sum_frame = cum_sum_frame.cumsum()
-    cum_sum_frame.ffill(inplace=True)
+    # no cashflows
+    if start is None:
+        return pd.Series()
 
-    return cum_sum_frame['cashflow']
+    # aggregate across the entire date range
+    return pd.Series(np.nancumsum(cashflows), index=_date_index(start, len(cashflows)), name='cashflow')
 
 
-def create_value_series() -> pd.Series:
+def create_value_series(account: str = Account.DEFAULT, from_date: datetime.date = None) -> pd.Series:
     """
     Create a data frame containing the portfolio value over time.
+    :param account: name of the account
+    :param from_date: only create the series from this date on
     :return: Dataframe containing the value.
     """
 
-    # get depot value per date
-    value_per_date = list(Depot.objects.value_per_date())
+    # get materialized depot value per date
+    queryset = DailyValue.objects.filter(account__name=account)
+    if from_date is not None:
+        queryset = queryset.filter(date__gte=from_date)
+
+    start, values = _stream_daily(queryset, 'total')
 
     # no depot entries
-    if not len(value_per_date):
+    if start is None:
         return pd.Series()
 
-    # create data frames
-    value_frame = pd.DataFrame.from_records(value_per_date, index='date')
-
     # forward fill entire data range to even out any gaps
-    filled_frame = pd.DataFrame(index=date_range_gen(value_per_date[0]['date'], value_per_date[-1]['date']))
-    filled_frame = pd.merge(filled_frame, value_frame, how='left', left_index=True, right_index=True)
+    return pd.Series(values, index=_date_index(start, len(values)), name='total').ffill()
 
-    filled_frame.ffill(inplace=True)
 
-    # return as series
-    return filled_frame['total']
+@cached('performance_series')
+def create_performance_series(account: str = Account.DEFAULT) -> pd.Series:
+    """
+    Create a data frame containing the indexed portfolio performance over time.
+    :param account: name of the account
+    :return: Dataframe containing the performance.
+    """
+    return compute_performance_series(account)
 
 
-def create_performance_series() -> pd.Series:
+def compute_performance_series(account: str = Account.DEFAULT, from_date: datetime.date = None) -> pd.Series:
     """
-    Create a data frame containing the indexed portfolio performance over time.
+    Compute the indexed portfolio performance over time (uncached).
+    :param account: name of the account
+    :param from_date: only compute the performance from this date on
     :return: Dataframe containing the performance.
     """
 
     # todo: cash position is neglected -> basically considered as loss -> FIX!
-    # todo: on last days, performance blows up if the ETL process is run twice on any given day.
-    #  The reason seems to be that that some entries in the Depot database are
-    #  duplicated for that time.. I suspect the reason is in the ETL process somewhere where I messed up the date and
-    #  accidentally reload some of the data.
 
-    cum_cashflow = create_cumulative_cashflow()
-    portfolio_value = create_value_series()
+    cum_cashflow = create_cumulative_cashflow(account, from_date)
+    portfolio_value = create_value_series(account, from_date)
 
     # no entries yet
     if cum_cashflow.empty or portfolio_value.empty:
         return pd.Series()
 
-    # merge frames and forward fill any gaps
-    performance = pd.merge(portfolio_value, cum_cashflow, how='left', left_index=True, right_index=True).ffill()
+    # carry the cumulative cashflows forward onto the dates of the values. The cashflows are forward filled on
+    # the union of both indexes first, so that cashflows on dates without a value (e.g. the sum prepended on the
+    # day before from_date) are not lost
+    cum_cashflow = cum_cashflow.reindex(cum_cashflow.index.union(portfolio_value.index)).ffill()\
+        .reindex(portfolio_value.index)
 
     # calculate performance
-    performance['return'] = performance['total'] / performance['cashflow']
-
-    return performance['return']
+    return (portfolio_value / cum_cashflow).rename('return')
 
 
-def create_portfolio() -> pd.DataFrame:
+@cached('portfolio')
+def create_portfolio(account: str = Account.DEFAULT) -> pd.DataFrame:
     """
     Create data frame of current allocation.
+    :param account: name of the account
     """
     previous_business_day = (datetime.date.today() - BDay(1)).date()
-    portfolio = list(Depot.objects.get_portfolio_at_date(previous_business_day)\
-        .annotate(
-            symbol=F('symbol_date__symbol'),
-            price=F('symbol_date__price__price'),
-            size=F('pieces'),
-            subtotal=F('pieces') * F('symbol_date__price__price'),
-        ).values('symbol', 'size', 'price', 'subtotal'))
+    portfolio = Depot.objects.get_portfolio_at_date(previous_business_day, account)\
+        .annotate(subtotal=F('pieces') * F('daily_price__price'))\
+        .values_list('symbol__symbol', 'pieces', 'daily_price__price', 'subtotal').iterator(chunk_size=CHUNK_SIZE)
+
+    portfolio_frame = pd.DataFrame.from_records(portfolio, columns=['symbol', 'size', 'price', 'subtotal'])
 
     # no portfolio existsL
-    if len(portfolio) == 0:
+    if portfolio_frame.empty:
         return pd.DataFrame()
 
-    portfolio_frame = pd.DataFrame(portfolio)
-
     total_value = portfolio_frame.subtotal.sum()
 
     portfolio_frame['allocation'] = portfolio_frame['subtotal'] / total_value
 
     # add product information
-    product_info = list(Asset.objects.filter(symbol__in=portfolio_frame.symbol.values)
-                        .values('isin', 'name', 'symbol').distinct())
+    product_info = Asset.objects.filter(symbol__in=portfolio_frame.symbol.values)\
+        .values_list('isin', 'name', 'symbol').distinct().iterator(chunk_size=CHUNK_SIZE)
+
+    product_frame = pd.DataFrame.from_records(product_info, columns=['isin', 'name', 'symbol'])
 
-    portfolio_frame = pd.merge(portfolio_frame, pd.DataFrame(product_info), on='symbol', how='left').round(2)
+    portfolio_frame = pd.merge(portfolio_frame, product_frame, on='symbol', how='left').round(2)
 
     return portfolio_frame
 
@@ -0,0 +1,152 @@
+import datetime
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+def synthetic_transactions(years: int, symbols: int, trades: int, seed: int = 0) -> List[Dict]:
+    """
+    Generate a reproducible list of transactions in the format of Transformation._transform_transactions.
+    :param years: number of years the transactions are spread over (ending today)
+    :param symbols: number of distinct products
+    :param trades: number of transactions
+    :param seed: random seed
+    """
+    rng = np.random.default_rng(seed)
+
+    to_date = datetime.date.today()
+    from_date = to_date - datetime.timedelta(days=365 * years)
+
+    days = np.sort(rng.integers(0, (to_date - from_date).days + 1, size=trades))
+    product_ids = rng.integers(0, symbols, size=trades)
+    quantities = rng.integers(1, 100, size=trades).astype(float)
+
+    # sell roughly a third of the time, never more than is held
+    held = np.zeros(symbols)
+    transactions = []
+    for i, (day, product, quantity) in enumerate(zip(days, product_ids, quantities)):
+        if rng.random() < 0.33 and held[product] > 0:
+            quantity = -min(quantity, held[product])
+        held[product] += quantity
+
+        transactions.append({
+            'id': str(i),
+            'productId': str(product),
+            'date': from_date + datetime.timedelta(days=int(day)),
+            'buysell': 'B' if quantity > 0 else 'S',
+            'price': 100.0,
+            'quantity': float(quantity),
+            'total': -100.0 * quantity,
+        })
+
+    return transactions
+
+
+def synthetic_product_info(symbols: int) -> Dict[str, Dict]:
+    """
+    Generate product info matching the product IDs of synthetic_transactions.
+    :param symbols: number of distinct products
+    """
+    return {str(i): {'productId': str(i), 'isin': f'XX{i:010d}', 'symbol': f'SYM{i}', 'name': f'Product {i}',
+                     'type': '1', 'currency': 'EUR'} for i in range(symbols)}
+
+
+def synthetic_prices(years: int, symbols: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate reproducible daily prices (geometric random walks) ending today, one column per symbol.
+    :param years: number of years of prices
+    :param symbols: number of symbols
+    :param seed: random seed
+    """
+    rng = np.random.default_rng(seed)
+
+    to_date = datetime.date.today()
+    dates = [to_date - datetime.timedelta(days=i) for i in range(365 * years, -1, -1)]
+
+    returns = rng.normal(0.0003, 0.015, size=(len(dates), symbols))
+    prices = 100 * np.cumprod(1 + returns, axis=0)
+
+    return pd.DataFrame(prices, index=dates, columns=[f'SYM{i}' for i in range(symbols)])
+
+
+def synthetic_cash_flows(years: int, movements: int, seed: int = 0) -> List[Dict]:
+    """
+    Generate reproducible account movements in the format of DegiroAPI.get_account_movements: deposits and
+    withdrawals, mixed with other movements that the transformation filters out.
+    :param years: number of years the movements are spread over (ending today)
+    :param movements: number of movements
+    :param seed: random seed
+    """
+    rng = np.random.default_rng(seed)
+
+    to_date = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    days = np.sort(rng.integers(0, 365 * years + 1, size=movements))
+
+    cash_flows = []
+    for day in days:
+        kind = rng.random()
+        amount = float(rng.integers(1, 50) * 100)
+
+        if kind < 0.8:
+            description, change = 'Einzahlung', amount
+        elif kind < 0.9:
+            description, change = 'Auszahlung', -amount
+        else:
+            description, change = 'Zinsen', amount / 100
+
+        cash_flows.append({
+            'date': to_date - datetime.timedelta(days=365 * years - int(day)),
+            'type': 'CASH_TRANSACTION',
+            'description': description,
+            'change': change,
+        })
+
+    return cash_flows
+
+
+def synthetic_extraction_data(years: int, symbols: int, trades: int, account: str, seed: int = 0) -> Dict:
+    """
+    Generate the output of the extraction step (see Extraction.data) for a synthetic portfolio, i.e. the raw
+    transactions, product info, cash flows and prices as returned by the APIs.
+    :param years: number of years of history (ending today)
+    :param symbols: number of distinct symbols
+    :param trades: number of transactions
+    :param account: name of the account
+    :param seed: random seed
+    """
+    from_date = datetime.date.today() - datetime.timedelta(days=365 * years)
+
+    transactions = [{**t, 'id': int(t['id']), 'date': t['date'].isoformat() + 'T00:00:00+01:00'}
+                    for t in synthetic_transactions(years, symbols, trades, seed)]
+
+    product_info = {product: {'id': info['productId'], 'isin': info['isin'], 'symbol': info['symbol'],
+                              'name': info['name'], 'productTypeId': info['type'], 'currency': info['currency']}
+                    for product, info in synthetic_product_info(symbols).items()}
+
+    return {
+        'account': account,
+        'transactions': transactions,
+        'product_info': product_info,
+        'price_data': synthetic_prices(years, symbols, seed),
+        'cash_flows': synthetic_cash_flows(years, max(1, trades // 20), seed),
+        'from_date': from_date,
+        'watermarks': {source: datetime.date.today() for source in ['transactions', 'cash_flows', 'prices']},
+    }
+
+
+def timeit(func: Callable, repeat: int = 5) -> Dict[str, float]:
+    """
+    Time a function call.
+    :param func: function without arguments to time
+    :param repeat: number of repetitions
+    :return: minimum, mean and maximum wall time in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return {'min': min(timings), 'mean': sum(timings) / len(timings), 'max': max(timings)}
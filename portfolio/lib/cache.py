@@ -0,0 +1,66 @@
+import datetime
+import inspect
+import uuid
+from functools import wraps
+
+from django.core.cache import cache
+
+from portfolio.models import EtlRun
+from project.settings import DASHBOARD_CACHE_TIMEOUT
+
+# cache key of the version of the loaded data, bumped by every ETL run
+VERSION_KEY = 'data_version'
+
+
+def data_version() -> str:
+    """
+    Return the version of the loaded data. Falls back to the ID of the latest successful ETL run if the
+    version is not cached (e.g. after the cache has been cleared).
+    """
+    version = cache.get(VERSION_KEY)
+
+    if version is None:
+        run_id = EtlRun.objects.filter(status=EtlRun.SUCCESS).order_by('-id').values_list('id', flat=True).first()
+        version = str(run_id or 0)
+        cache.set(VERSION_KEY, version, None)
+
+    return version
+
+
+def bump_data_version(run_id: int = None) -> None:
+    """
+    Bump the version of the loaded data, which invalidates all values cached with `cached`.
+    :param run_id: ID of the ETL run that loaded the data, a random version is used if not given
+    """
+    cache.set(VERSION_KEY, str(run_id) if run_id is not None else uuid.uuid4().hex, None)
+
+
+def cached(name: str):
+    """
+    Decorator that caches the result of a function until the loaded data changes (or the day changes, since
+    some aggregations depend on the current date). The arguments of the function (e.g. the account) are part of
+    the cache key after binding them to its signature, so that positional, keyword and default arguments share
+    the same entry. They must be strings.
+    :param name: name of the cached value
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args: str, **kwargs: str):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+
+            key = ':'.join([name, *arguments.arguments.values(), data_version(), datetime.date.today().isoformat()])
+
+            value = cache.get(key)
+            if value is None:
+                value = func(*arguments.args, **arguments.kwargs)
+                cache.set(key, value, DASHBOARD_CACHE_TIMEOUT)
+
+            return value
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,47 @@
+import gzip
+import os
+import pickle
+import shutil
+from typing import Any
+
+
+class Checkpoint:
+    """
+    Persisted outputs of the ETL stages of a run, stored as compressed pickles, so that a failed run can be
+    resumed without repeating its completed stages.
+    """
+
+    def __init__(self, directory: str, run_id: int):
+        """
+        :param directory: base directory of the checkpoints
+        :param run_id: ID of the ETL run
+        """
+        self._directory = os.path.join(directory, str(run_id))
+
+    def _path(self, stage: str) -> str:
+        return os.path.join(self._directory, f'{stage}.pkl.gz')
+
+    def save(self, stage: str, data: Any) -> None:
+        """
+        Persist the output of a stage.
+        """
+        os.makedirs(self._directory, exist_ok=True)
+
+        # write to a temporary file first so that an interrupted write never leaves a corrupt checkpoint
+        tmp_path = self._path(stage) + '.tmp'
+        with gzip.open(tmp_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._path(stage))
+
+    def load(self, stage: str) -> Any:
+        """
+        Load the persisted output of a stage.
+        """
+        with gzip.open(self._path(stage), 'rb') as f:
+            return pickle.load(f)
+
+    def clear(self) -> None:
+        """
+        Remove all persisted outputs of the run.
+        """
+        shutil.rmtree(self._directory, ignore_errors=True)
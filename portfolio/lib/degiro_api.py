@@ -1,9 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Union
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import getpass
 import datetime
+import threading
+import time
 
 from project.settings import DEGIRO
 
@@ -13,12 +18,81 @@ import traceback
 logger = logging.getLogger('db')
 
 
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces out calls to at most `rate` per second.
+    """
+
+    def __init__(self, rate: float):
+        self._interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """
+        Block until the next call is allowed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self._interval
+
+        if wait > 0:
+            time.sleep(wait)
+
+
 class DegiroAPI:
-    def __init__(self):
+    def __init__(self, username: str = None, password: str = None, max_workers: int = None):
+        """
+        :param username: username of the Degiro account, defaults to DEGIRO['USERNAME']
+        :param password: password of the Degiro account, defaults to DEGIRO['PASSWORD']
+        :param max_workers: number of concurrent requests. Requests are made serially if set to 1.
+            Defaults to DEGIRO['MAX_WORKERS'].
+        """
+        self._username = username if username is not None else DEGIRO['USERNAME']
+        self._password = password if password is not None else DEGIRO['PASSWORD']
+        self._max_workers = max_workers if max_workers is not None else DEGIRO['MAX_WORKERS']
         self.user = dict()
         self.data = None
         self.sess = None
         self.sess_id = None
+        self._limiters = dict()
+        self._limiters_lock = threading.Lock()
+
+    def _create_session(self) -> requests.Session:
+        """
+        Create a session with a connection pool large enough for concurrent requests, which retries failed
+        requests with exponential backoff.
+        """
+        retry = Retry(
+            total=DEGIRO['RETRIES'],
+            backoff_factor=DEGIRO['BACKOFF_FACTOR'],
+            status_forcelist=(429, 500, 502, 503, 504),
+            method_whitelist=frozenset(['GET', 'POST']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self._max_workers, 1), max_retries=retry)
+
+        sess = requests.Session()
+        sess.mount('https://', adapter)
+
+        return sess
+
+    def _request(self, endpoint: str, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Send a request through the session, respecting the rate limit of the endpoint.
+        :param endpoint: name of the endpoint the rate limit applies to
+        :param method: HTTP method
+        :param url: URL to request
+        """
+        with self._limiters_lock:
+            if endpoint not in self._limiters:
+                self._limiters[endpoint] = RateLimiter(DEGIRO['RATE_LIMIT'])
+            limiter = self._limiters[endpoint]
+
+        limiter.wait()
+
+        return self.sess.request(method, url, **kwargs)
 
     def login(self, twoFactorAuth: bool = False) -> None:
         """
@@ -27,13 +101,13 @@ class DegiroAPI:
         :raises: RequestException: if HTTP request fails
         """
 
-        self.sess = requests.Session()
+        self.sess = self._create_session()
 
         # Login
         url = 'https://trader.degiro.nl/login/secure/login'
         payload = {
-            'username': DEGIRO['USERNAME'],
-            'password': DEGIRO['PASSWORD'],
+            'username': self._username,
+            'password': self._password,
             'isPassCodeReset': False,
             'isRedirectToMobile': False
         }
@@ -45,7 +119,7 @@ class DegiroAPI:
             url += '/totp'
 
         try:
-            r = self.sess.post(url, headers=header, data=json.dumps(payload))
+            r = self._request('login', 'POST', url, headers=header, data=json.dumps(payload))
         except requests.exceptions.RequestException as e:
             logger.exception('RequestException: {} //////  Traceback: {}'.format(e, traceback.format_exc()))
             raise e
@@ -64,7 +138,7 @@ class DegiroAPI:
         url = f'https://trader.degiro.nl/trading/secure/logout;jsessionid={self.sess_id}'
 
         try:
-            self.sess.get(url)
+            self._request('logout', 'GET', url)
         except requests.exceptions.RequestException as e:
             logger.exception('RequestException: {} //////  Traceback: {}'.format(e, traceback.format_exc()))
             raise e
@@ -85,7 +159,7 @@ class DegiroAPI:
         payload = {'sessionId': self.sess_id}
 
         try:
-            r = self.sess.get(url, params=payload)
+            r = self._request('config', 'GET', url, params=payload)
         except requests.exceptions.RequestException as e:
             logger.exception('RequestException: {} //////  Traceback: {}'.format(e, traceback.format_exc()))
             raise e
@@ -137,7 +211,7 @@ class DegiroAPI:
         }
 
         try:
-            r = self.sess.get(url, params=payload)
+            r = self._request('data', 'GET', url, params=payload)
         except requests.exceptions.RequestException as e:
             logger.exception('RequestException: {} //////  Traceback: {}'.format(e, traceback.format_exc()))
             raise e
@@ -166,7 +240,7 @@ class DegiroAPI:
         }
 
         try:
-            r = self.sess.get(url, params=payload)
+            r = self._request('account_movements', 'GET', url, params=payload)
         except requests.exceptions.RequestException as e:
             logger.exception('RequestException: {} //////  Traceback: {}'.format(e, traceback.format_exc()))
             raise e
@@ -214,7 +288,7 @@ class DegiroAPI:
                    'sessionId': self.sess_id}
 
         try:
-            r = self.sess.get(url, params=payload)
+            r = self._request('transactions', 'GET', url, params=payload)
         except requests.exceptions.RequestException as e:
             logger.exception('RequestException: {} //////  Traceback: {}'.format(e, traceback.format_exc()))
             raise e
@@ -236,7 +310,8 @@ class DegiroAPI:
         params = {'intAccount': str(self.user['intAccount']), 'sessionId': self.sess_id}
 
         try:
-            r = self.sess.post(url, headers=header, params=params, data=json.dumps([str(_id) for _id in ids]))
+            r = self._request('product_info', 'POST', url, headers=header, params=params,
+                              data=json.dumps([str(_id) for _id in ids]))
         except requests.exceptions.RequestException as e:
             logger.exception('RequestException: {} //////  Traceback: {}'.format(e, traceback.format_exc()))
             raise e
@@ -253,6 +328,7 @@ class DegiroAPI:
     def get_products_by_id(self, product_ids) -> Dict:
         """
         Wrapper around self.get_product_by_id that allows batch requests of up to 10 products at a time.
+        The batches are requested concurrently, unless the API is configured to make requests serially.
         :param product_ids: Unique list of product_ids
         :returns: Product info
         """
@@ -261,8 +337,14 @@ class DegiroAPI:
 
         data_out = {}
 
-        for chunk in chunks:
-            data_out = {**data_out, **self.get_product_by_id(chunk)}
+        if self._max_workers <= 1:
+            for chunk in chunks:
+                data_out.update(self.get_product_by_id(chunk))
+
+        else:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+                for data in pool.map(self.get_product_by_id, chunks):
+                    data_out.update(data)
 
         return data_out
 
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+
+def lttb(values: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling of evenly spaced values. Keeps the first and last point and
+    from every bucket in between the point spanning the largest triangle with its neighbours.
+    :param values: values to downsample
+    :param threshold: number of points to keep
+    :return: positions of the kept points
+    """
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # bucket boundaries of the points between the first and the last one
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+
+        # average point of the next bucket (the last point for the last bucket)
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        next_x = (next_start + next_end - 1) / 2
+        next_y = np.nanmean(values[next_start:next_end])
+
+        prev_x, prev_y = selected[i], values[selected[i]]
+
+        x = np.arange(start, end)
+        areas = np.abs((prev_x - next_x) * (values[start:end] - prev_y) - (prev_x - x) * (next_y - prev_y))
+        selected[i + 1] = start + int(np.nanargmax(areas)) if not np.all(np.isnan(areas)) else start
+
+    return selected
+
+
+def minmax(values: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Min/max bucketing of values. Every bucket keeps its minimum and maximum (in their original order), so
+    extremes such as the troughs of drawdowns are always visible.
+    :param values: values to downsample
+    :param threshold: number of points to keep (approximately)
+    :return: positions of the kept points
+    """
+    n = len(values)
+    if threshold >= n or threshold < 4:
+        return np.arange(n)
+
+    buckets = np.array_split(np.arange(n), (threshold - 2) // 2)
+    filled = np.where(np.isnan(values), np.nanmean(values), values)
+
+    selected = {0, n - 1}
+    for bucket in buckets:
+        selected.add(bucket[np.argmin(filled[bucket])])
+        selected.add(bucket[np.argmax(filled[bucket])])
+
+    return np.array(sorted(selected))
+
+
+def downsample(series: pd.Series, threshold: int, method: str = 'minmax') -> pd.Series:
+    """
+    Downsample a series to about threshold points.
+    :param series: series to downsample
+    :param threshold: number of points to keep
+    :param method: 'minmax' or 'lttb'
+    """
+    select = {'minmax': minmax, 'lttb': lttb}[method]
+
+    return series.iloc[select(series.to_numpy(dtype=float), threshold)]
@@ -1,44 +1,115 @@
-import re
-from collections import Counter
-from typing import Dict, List, Any
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import wraps
+from typing import Dict, List, Tuple, Callable, Iterable, Set
 
+import django
 import pandas as pd
-from dateutil.relativedelta import relativedelta
-from django.db.models import Q
+from django.db import connections
+from django.db.transaction import atomic
+from django.utils import timezone
 import datetime
 
+from portfolio.lib.cache import bump_data_version
+from portfolio.lib.checkpoint import Checkpoint
 from portfolio.lib.degiro_api import DegiroAPI
+from portfolio.lib.frames import TRANSACTIONS, CASH_FLOWS, PRICES, PORTFOLIOS, typed_frame, category_ids
+from portfolio.lib.holdings import build_holdings
+from portfolio.lib.streaming_measures import update_metrics_state
+from portfolio.lib.symbol_index import SymbolIndex
 from portfolio.lib.yf_api import YF
-from portfolio.models import Depot, Transaction, Asset, Price, DimensionSymbolDate, Cashflow
-from django.db.models import F
+from project.settings import DEGIRO, ETL
+from portfolio.models import Account, Depot, Transaction, Asset, Price, Cashflow, DailyValue, EtlRun, Watermark
 
 import logging
-from project.logger import log
+from project.logger import log, profile_stage
 
 logger = logging.getLogger('db')
 
 
+def _close_connections_after(func):
+    """
+    Wrap a function run on a worker thread so that the thread's database connections are closed afterwards.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+    return wrapper
+
+
+def _extraction_dates(account: str) -> Tuple[datetime.date, Dict[str, datetime.date]]:
+    """
+    Return the date from which the portfolios of the account are rebuilt and the date from which each source is
+    extracted. Each source is only extracted from its own high-water mark on, prices are always extracted for the
+    portfolios that are rebuilt.
+    :param account: name of the account
+    """
+    from_date = Depot.objects.get_latest_date(account)
+    from_date = from_date if from_date else datetime.datetime(2020, 1, 1).date()
+
+    watermarks = Watermark.objects.get_dates(account)
+    from_dates = {
+        'transactions': watermarks.get('transactions', from_date),
+        'cash_flows': watermarks.get('cash_flows', from_date),
+        'prices': min(watermarks.get('prices', from_date), from_date),
+    }
+
+    return from_date, from_dates
+
+
+def _price_frame(price_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Transform downloaded prices (one column per symbol) into a typed frame of prices (see portfolio.lib.frames).
+    :param price_data: prices with one column per symbol, indexed by date
+    """
+    # forward fill non-business days etc.
+    price_data = YF.ffill_price_data(price_data).reset_index()
+
+    # convert into long format
+    molten = pd.melt(price_data, id_vars='index')
+    molten.columns = ['date', 'symbol', 'price']
+    molten.dropna(subset=['price'], inplace=True)
+
+    return typed_frame(PRICES, molten)
+
+
 class Extraction:
 
-    def __init__(self):
-        self._degiro = DegiroAPI()
+    def __init__(self, account: str = Account.DEFAULT, max_workers: int = None):
+        """
+        :param account: name of the account to extract, its credentials are read from DEGIRO['ACCOUNTS']
+        :param max_workers: number of concurrent extraction steps. Steps are run serially if set to 1.
+            Defaults to DEGIRO['MAX_WORKERS'].
+        """
+        credentials = DEGIRO['ACCOUNTS'][account]
+
+        self._account = account
+        self._max_workers = max_workers if max_workers is not None else DEGIRO['MAX_WORKERS']
+        self._degiro = DegiroAPI(credentials['USERNAME'], credentials['PASSWORD'], max_workers=self._max_workers)
         self._transactions = list()
         self._product_info = dict()
+        self._portfolio_prices = pd.DataFrame()
         self._prices = list()
         self._cash_flows = list()
 
-        from_date = Depot.objects.get_latest_date()
-        self._from_date = from_date if from_date else datetime.datetime(2020, 1, 1).date()
+        self._from_date, self._from_dates = _extraction_dates(account)
+        self._to_date = datetime.date.today()
 
     @property
     def data(self) -> Dict:
 
         return {
+            'account': self._account,
             'transactions': self._transactions,
             'product_info': self._product_info,
             'price_data': self._prices,
             'cash_flows': self._cash_flows,
-            'from_date': self._from_date
+            'from_date': self._from_date,
+            'watermarks': {source: self._to_date for source in self._from_dates.keys()}
         }
 
     @log()
@@ -61,12 +132,12 @@ class Extraction:
         """
         Extract the transactions from the degiro API.
         """
-        to_date = datetime.date.today()
-        transactions = self._degiro.get_transactions(self._from_date, to_date)
+        transactions = self._degiro.get_transactions(self._from_dates['transactions'], self._to_date)
 
         # exclude existing transactions (in case of small overlap)
-        self._transactions = [x for x in transactions if x['id'] not in
-                              Transaction.objects.filter(id__in=transactions).values('id')]
+        existing = set(Transaction.objects.filter(id__in=[str(x['id']) for x in transactions])
+                       .values_list('id', flat=True))
+        self._transactions = [x for x in transactions if str(x['id']) not in existing]
 
         logger.info(__name__ + 'successful')
 
@@ -86,7 +157,22 @@ class Extraction:
         """
         Extract cash flows.
         """
-        self._cash_flows = self._degiro.get_account_movements(self._from_date, datetime.date.today())
+        self._cash_flows = self._degiro.get_account_movements(self._from_dates['cash_flows'], self._to_date)
+
+        logger.info(__name__ + 'successful')
+
+    @log()
+    def _extract_portfolio_prices(self):
+        """
+        Extract the price data of the symbols in the last portfolio. Independent of the new transactions, so it
+        can run concurrently with their extraction.
+        """
+        portfolio_symbols = list(Depot.objects.get_portfolio_at_date(self._from_date, self._account)
+                                 .distinct('symbol__symbol').values_list('symbol__symbol', flat=True))
+
+        if len(portfolio_symbols) > 0:
+            self._portfolio_prices = YF.get_prices(portfolio_symbols, start=self._from_dates['prices'],
+                                                   end=self._to_date)
 
         logger.info(__name__ + 'successful')
 
@@ -95,29 +181,44 @@ class Extraction:
         """
         Extract the price data for the time frame of the new transactions.
         """
-        # symbols included in new transactions
-        transaction_symbols = list(set([x['symbol'] for x in self._product_info.values()]))
-
-        # symbols included in last portfolio
-        portfolio_symbols = list(Depot.objects.get_portfolio_at_date(self._from_date).filter(
-            ~Q(symbol_date__symbol__in=transaction_symbols)
-        ).distinct('symbol_date__symbol').values_list('symbol_date__symbol', flat=True))
+        # symbols included in new transactions which aren't covered by the last portfolio
+        portfolio_symbols = set(self._portfolio_prices.columns)
+        transaction_symbols = list(set([x['symbol'] for x in self._product_info.values()
+                                        if x['symbol'].upper() not in portfolio_symbols]))
 
-        # all symbols for which to get price data
-        symbols = [*portfolio_symbols, *transaction_symbols]
+        self._prices = self._portfolio_prices
 
-        self._prices = YF.get_prices(symbols, start=self._from_date, end=datetime.date.today())
+        if len(transaction_symbols) > 0:
+            transaction_prices = YF.get_prices(transaction_symbols, start=self._from_dates['prices'],
+                                               end=self._to_date)
+            self._prices = pd.concat([self._prices, transaction_prices], axis=1)
 
         logger.info(__name__ + 'successful')
 
     def run(self):
         """
-        Run the extraction process.
+        Run the extraction process. Unless configured to run serially, the cash flows and the prices of the
+        current portfolio are extracted concurrently with the transactions and their product info.
         """
         self._config()
-        self._extract_transactions()
-        self._extract_product_info()
-        self._extract_cash_flows()
+
+        if self._max_workers <= 1:
+            self._extract_transactions()
+            self._extract_product_info()
+            self._extract_cash_flows()
+            self._extract_portfolio_prices()
+
+        else:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+                futures = [pool.submit(_close_connections_after(self._extract_cash_flows)),
+                           pool.submit(_close_connections_after(self._extract_portfolio_prices))]
+
+                self._extract_transactions()
+                self._extract_product_info()
+
+                for future in futures:
+                    future.result()
+
         self._extract_price_data()
         self._exit()
 
@@ -127,37 +228,48 @@ class Transformation:
     def __init__(self, extraction_data: Dict):
         """
         :param extraction_data: data received from the extraction step. Must be a
-            dictionary with keys 'transactions', 'product_info', 'price_data', 'from_date'.
+            dictionary with keys 'account', 'transactions', 'product_info', 'price_data', 'from_date'.
         """
 
         try:
+            assert 'account' in extraction_data.keys()
             assert 'transactions' in extraction_data.keys()
             assert 'product_info' in extraction_data.keys()
             assert 'price_data' in extraction_data.keys()
             assert 'from_date' in extraction_data.keys()
             assert 'cash_flows' in extraction_data.keys()
+            assert 'watermarks' in extraction_data.keys()
         except AssertionError as ae:
             logger.error(__name__ + ': Invalid extraction_data received.')
             raise ae
 
         self._extracted = extraction_data
-        self._transactions = []
+        self._account = extraction_data['account']
+        self._transactions = typed_frame(TRANSACTIONS)
         self._product_info = {}
-        self._cash_flows = []
-        self._price_data = {}
-        self._portfolios = []
-        self._symbol_date_combs = []
+        self._cash_flows = typed_frame(CASH_FLOWS)
+        self._price_data = typed_frame(PRICES)
+        self._portfolios = typed_frame(PORTFOLIOS)
+        self._symbols = []
+        self._symbol_index = SymbolIndex()
 
     @property
     def data(self):
+        """
+        Output of the transformation. The transactions, cash flows, prices and portfolios are typed frames (see
+        portfolio.lib.frames).
+        """
 
         return {
+            'account': self._account,
             'transactions': self._transactions,
             'product_info': self._product_info,
             'cash_flows': self._cash_flows,
             'price_data': self._price_data,
             'portfolios': self._portfolios,
-            'symbol_date_combs': self._symbol_date_combs
+            'symbols': self._symbols,
+            'symbol_index': self._symbol_index,
+            'watermarks': self._extracted['watermarks']
         }
 
     @log()
@@ -166,25 +278,16 @@ class Transformation:
         Transform the extracted transactions.
         """
 
-        transactions = self._extracted['transactions']
+        transactions = pd.DataFrame.from_records(self._extracted['transactions'], columns=list(TRANSACTIONS))
 
-        transactions_clean = []
         # fix data types
-        for transaction in transactions:
-
-            regexed_date = re.compile(r'\d{4}-\d{2}-\d{2}').findall(transaction['date'])[0]
-
-            transactions_clean.append({
-                'id': str(transaction['id']),
-                'productId': str(transaction['productId']),
-                'date': datetime.datetime.strptime(regexed_date, '%Y-%m-%d').date(),
-                'buysell': transaction['buysell'],
-                'price': float(transaction['price']),
-                'quantity': float(transaction['quantity']),
-                'total': float(transaction['total']),
-            })
-
-        self._transactions = transactions_clean
+        self._transactions = typed_frame(TRANSACTIONS, {
+            **transactions,
+            'id': transactions['id'].astype(str),
+            'productId': transactions['productId'].astype(str),
+            'date': pd.to_datetime(transactions['date'].astype(str).str.extract(r'(\d{4}-\d{2}-\d{2})', expand=False),
+                                   format='%Y-%m-%d'),
+        })
 
         logger.info(__name__ + 'successful')
 
@@ -215,38 +318,19 @@ class Transformation:
     @log()
     def _transform_cash_flows(self):
 
-        cash_flows = self._extracted['cash_flows']
+        cash_flows = pd.DataFrame.from_records(self._extracted['cash_flows'],
+                                               columns=['date', 'type', 'description', 'change'])
 
         # filter correct transaction types and descriptions
-        cash_flows = [{'date': cf['date'].date(), 'cashflow': cf['change']} for cf in cash_flows
-                      if cf['type'] == 'CASH_TRANSACTION'
-                      and cf['description'] in ['Einzahlung', 'Auszahlung']]
-
-        # group by date
-        cash_flows_grouped = {}
-        for cf in cash_flows:
-            if cf['date'] in cash_flows_grouped:
-                cash_flows_grouped[cf['date']] += cf['cashflow']
-            else:
-                cash_flows_grouped[cf['date']] = cf['cashflow']
-
-        # get existing transactions on the same date
-        existing = Cashflow.objects.get_existing(cash_flows_grouped.keys())
-
-        # if none exist, we're done
-        if len(existing) == 0:
-            # convert dict to list of dicts
-            cash_flows_grouped = [{'date': cf[0], 'cashflow': cf[1]} for cf in list(cash_flows_grouped.items())]
-            self._cash_flows = cash_flows_grouped
-            return
+        cash_flows = cash_flows[(cash_flows['type'] == 'CASH_TRANSACTION')
+                                & cash_flows['description'].isin(['Einzahlung', 'Auszahlung'])]
 
-        # update the new cashflows on a date by the ones already existing on that date
-        for cf in existing:
-            cash_flows_grouped[cf['date']] += cf['cashflow']
+        # group by (local) date, the extraction covers entire days, so the grouped cash flows replace the ones
+        # loaded for the same date
+        grouped = cash_flows['change'].astype(float)\
+            .groupby(pd.to_datetime(cash_flows['date'].map(datetime.datetime.date))).sum()
 
-        # convert dict to list of dicts
-        cash_flows_grouped = [{'date': cf[0], 'cashflow': cf[1]} for cf in list(cash_flows_grouped.items())]
-        self._cash_flows = cash_flows_grouped
+        self._cash_flows = typed_frame(CASH_FLOWS, {'date': grouped.index, 'cashflow': grouped.values})
 
         logger.info(__name__ + 'successful')
 
@@ -257,93 +341,59 @@ class Transformation:
         positions based on the transactions.
         """
 
-        # store daily portfolios
-        portfolios = []
-
         # initialise values
         from_date = self._extracted['from_date']
-        date_iterator = from_date
-
-        latest_portfolio = Depot.objects.get_portfolio_at_date(from_date)\
-            .annotate(symbol=F('symbol_date__symbol'))\
-            .values('symbol', 'pieces')
-
-        portfolio_at_date = {x['symbol']: x['pieces'] for x in latest_portfolio}
-
-        same_day_start = date_iterator == datetime.date.today()
-
-        # Iteratively build the portfolio
-        while date_iterator <= datetime.date.today() and not same_day_start:
-
-            # Extract buy and sell transactions of current date
-            daily_transactions = [t for t in self._transactions
-                                  if t['buysell'] in ['S', 'B'] and t['date'] == date_iterator]
-
-            # On days without transactions, portfolio stays the same
-            if len(daily_transactions) == 0:
-                portfolios.append({'date': date_iterator, 'portfolio': portfolio_at_date})
-                date_iterator += relativedelta(days=1)
-                continue
-
-            # get quantities per symbol
-            daily_qtys = {}
-            for transaction in daily_transactions:
-                symbol = self._product_info[transaction['productId']]['symbol']
-                quantity = transaction['quantity']
-
-                # works for both buys and sells as for sells the quantity is negative
-                if symbol in daily_qtys.keys():
-
-                    # if no quantities left, don't include symbol
-                    if -daily_qtys[symbol] != quantity:
-                        daily_qtys[symbol] += quantity
-
-                else:
-                    daily_qtys[symbol] = quantity
-
-            # update the total quantities in the portfolio
-            portfolio_at_date = dict(Counter(portfolio_at_date) + Counter(daily_qtys))
-
-            # save portfolio of current date
-            portfolios.append({'date': date_iterator, 'portfolio': portfolio_at_date})
-
-            date_iterator += relativedelta(days=1)
-
-        # unnest portfolios and compile symbol date combinations
-        symbol_date_combs = []
-
-        unnested_portfolios: List[Dict[str, Any]] = []
-        for portfolio in portfolios:
-            for symbol in portfolio['portfolio'].keys():
-                unnested_portfolios.append({
-                    'date': portfolio['date'],
-                    'symbol': symbol,
-                    'pieces': portfolio['portfolio'][symbol]
-                })
-
-                # store the current symbol-date combination
-                symbol_date_combs.append((symbol, portfolio['date']))
+        to_date = datetime.date.today()
 
-        self._portfolios = unnested_portfolios
-        self._symbol_date_combs = list({*self._symbol_date_combs, *symbol_date_combs})
+        # the portfolios from from_date on are rebuilt from the portfolio of the previous day, so that reruns
+        # (e.g. twice on the same day) reproduce the same portfolios
+        latest_portfolio = Depot.objects\
+            .get_portfolio_at_date(from_date - datetime.timedelta(days=1), self._account)\
+            .values_list('symbol__symbol', 'pieces')
+
+        portfolio_at_date = dict(latest_portfolio)
+
+        # buy and sell transactions only (for sells the quantity is negative), including the ones of the
+        # rebuilt period that were already loaded by a previous run
+        columns = ['productId', 'date', 'quantity']
+        trades = self._transactions.loc[self._transactions['buysell'].isin(['S', 'B']), columns]
+        loaded_trades = pd.DataFrame.from_records(
+            Transaction.objects.filter(account__name=self._account, date__gte=from_date, buysell__in=['S', 'B'])
+            .values_list(*columns).iterator(),
+            columns=columns
+        )
+
+        symbols = {p['productId']: p['symbol'] for p in self._product_info.values()}
+        symbols.update(Asset.objects.filter(productId__in=set(loaded_trades['productId']))
+                       .values_list('productId', 'symbol'))
+
+        trades = pd.concat([trades, loaded_trades.astype({'date': 'datetime64[ns]'})], ignore_index=True)
+
+        holdings = build_holdings(
+            dates=trades['date'],
+            symbols=trades['productId'].map(symbols),
+            quantities=trades['quantity'],
+            start_portfolio=portfolio_at_date,
+            from_date=from_date,
+            to_date=to_date
+        )
+
+        self._portfolios = typed_frame(PORTFOLIOS, holdings)
+        self._symbols = list({*self._symbols, *self._portfolios['symbol'].cat.categories})
 
         logger.info(__name__ + 'successful')
 
     @log()
-    def _transform_symbol_date_combs(self):
+    def _transform_symbols(self):
         """
-        Transform the newly created symbol-date combinations.
+        Transform the symbols of the portfolios and prices.
         """
 
-        # dates only
-        dates = [x[1] for x in self._symbol_date_combs]
-
-        # get combinations already in the table
-        existing = DimensionSymbolDate.objects.filter(date__in=dates).values_list('symbol', 'date')
+        # index the IDs of the symbols already in the table
+        self._symbol_index.fetch(self._symbols)
 
-        # filter new combinations and format
-        self._symbol_date_combs = [{'symbol': comb[0], 'date': comb[1]} for comb in self._symbol_date_combs
-                                   if comb not in existing]
+        # filter new symbols
+        self._symbols = [symbol for symbol in self._symbols if symbol not in self._symbol_index]
 
         logger.info(__name__ + 'successful')
 
@@ -355,21 +405,13 @@ class Transformation:
 
         price_data = self._extracted['price_data']
 
-        # forward fill non-business days etc.
-        price_data = YF.ffill_price_data(price_data).reset_index()
-
-        # convert into long format
-        molten = pd.melt(price_data, id_vars='index')
-        molten.columns = ['date', 'symbol', 'price']
-        molten.dropna(subset=['price'], inplace=True)
-
-        # store price data in record format
-        self._price_data = molten.to_dict('records')
+        if len(price_data) == 0:
+            return
 
-        # add the symbol date combinations of the price data
-        combs = [tuple(x) for x in molten.loc[:, ['symbol', 'date']].to_dict('split')['data']]
+        self._price_data = _price_frame(price_data)
 
-        self._symbol_date_combs = list({*self._symbol_date_combs, *combs})
+        # add the symbols of the price data
+        self._symbols = list({*self._symbols, *self._price_data['symbol'].cat.categories})
 
         logger.info(__name__ + 'successful')
 
@@ -382,142 +424,411 @@ class Transformation:
         self._transform_cash_flows()
         self._build_portfolio()
         self._transform_price_data()
-        self._transform_symbol_date_combs()
+        self._transform_symbols()
 
 
 class Loading:
 
-    def __init__(self, transformation_data):
+    def __init__(self, transformation_data, run_id: int = None):
         """
         :param transformation_data: data received from the transformation step. Must be a
-            dictionary with keys 'transactions', 'product_info', 'price_data', 'portfolios'.
+            dictionary with keys 'account', 'transactions', 'product_info', 'cash_flows', 'price_data',
+            'portfolios', 'symbols', 'symbol_index', 'watermarks'.
+        :param run_id: ID of the ETL run, used as the new version of the cached dashboard data
         """
 
         try:
+            assert 'account' in transformation_data.keys()
             assert 'transactions' in transformation_data.keys()
             assert 'product_info' in transformation_data.keys()
             assert 'cash_flows' in transformation_data.keys()
             assert 'price_data' in transformation_data.keys()
             assert 'portfolios' in transformation_data.keys()
-            assert 'symbol_date_combs' in transformation_data.keys()
+            assert 'symbols' in transformation_data.keys()
+            assert 'symbol_index' in transformation_data.keys()
+            assert 'watermarks' in transformation_data.keys()
         except AssertionError as ae:
             print('Invalid transformation_data received.')
             logger.error(__name__ + ': Invalid transformation_data received.')
             raise ae
 
         self._transformation_data = transformation_data
+        self._run_id = run_id
+        self._account = transformation_data['account']
+        self._account_id = None
+        self._symbol_index = transformation_data['symbol_index']
+
+    @log()
+    def _load_account(self):
+        """
+        Load the account, creating it on its first run.
+        """
+        self._account_id = Account.objects.get_or_create(name=self._account)[0].id
+
+        logger.info(__name__ + 'successful')
 
     @log()
     def _load_transactions(self):
         """
-        Load the transactions into the Transaction table.
+        Load the transactions into the Transaction table, skipping already loaded ones.
         """
-        transaction_objects = [Transaction(**t) for t in self._transformation_data['transactions']]
-        Transaction.objects.bulk_create(transaction_objects)
+        transactions = self._transformation_data['transactions'].assign(account_id=self._account_id)
+
+        Transaction.objects.copy_upsert_frame(transactions, conflict_fields=['id'])
 
         logger.info(__name__ + 'successful')
 
     @log()
     def _load_product_info(self):
         """
-        Load the product info into the Asset table.
+        Load the product info into the Asset table, updating known products.
         """
-        asset_objects = [Asset(**info[1]) for info in self._transformation_data['product_info'].items()]
-        Asset.objects.bulk_create(asset_objects)
+        Asset.objects.bulk_upsert(
+            list(self._transformation_data['product_info'].values()),
+            conflict_fields=['productId'],
+            update_fields=['isin', 'symbol', 'name', 'type', 'currency']
+        )
 
         logger.info(__name__ + 'successful')
 
+    @log()
     def _load_cash_flows(self):
         """
-        Load the cash flows into the Cashflow table. Since some dates might already have cashflows in the
-        database, we call update_or_create on those. For the new ones, we use bulk_create for performance reasons.
+        Load the cash flows into the Cashflow table, replacing the cash flows of dates that were already loaded.
         """
+        cash_flows = self._transformation_data['cash_flows'].assign(account_id=self._account_id)
 
-        # split between existing ones and new ones
-        dates = [cf['date'] for cf in self._transformation_data['cash_flows']]
-        existing_dates = list(Cashflow.objects.get_existing(dates).values_list('date', flat=True))
-
-        new_cashflows = [cf for cf in self._transformation_data['cash_flows'] if cf['date'] not in existing_dates]
-        update_cashflows = [cf for cf in self._transformation_data['cash_flows'] if cf['date'] in existing_dates]
+        Cashflow.objects.copy_upsert_frame(cash_flows, conflict_fields=['account_id', 'date'],
+                                           update_fields=['cashflow'])
 
-        # create new cashflows
-        new_cashflow_objects = [Cashflow(**cf) for cf in new_cashflows]
-        Cashflow.objects.bulk_create(new_cashflow_objects)
+        logger.info(__name__ + 'successful')
 
-        # update existing cashflows
-        for cashflow in update_cashflows:
-            Cashflow.objects.update_or_create(date=cashflow['date'], defaults={'cashflow': cashflow['cashflow']})
+    @log()
+    def _load_symbols(self):
+        """
+        Load the new symbols into the Symbol table and index their IDs.
+        """
+        self._symbol_index.insert(self._transformation_data['symbols'])
 
         logger.info(__name__ + 'successful')
 
-    def _load_symbol_date_combs(self):
+    def _symbol_prep(self, data: pd.DataFrame, retained_column: str) -> pd.DataFrame:
         """
-        Load the symbol-date-combinations into the DimensionSymbolDate table.
+        Replace the symbols of the provided data by their IDs in order to make upload to Depot and Price model
+        possible (due to FK to Symbol). The IDs are resolved from the symbol index of the run, once per category.
+        :param data: the typed frame to add the IDs to (see portfolio.lib.frames)
+        :param retained_column: the other column to retain in the data set in addition to symbol_id and date
+        :return: frame with the columns symbol_id, date and the retained column
         """
-        symbol_date_objects = [DimensionSymbolDate(**comb) for comb in self._transformation_data['symbol_date_combs']]
-        DimensionSymbolDate.objects.bulk_create(symbol_date_objects)
+        return pd.DataFrame({
+            'symbol_id': category_ids(data['symbol'], self._symbol_index),
+            'date': data['date'].to_numpy(),
+            retained_column: data[retained_column].to_numpy(),
+        })
+
+    @log()
+    def _load_price_data(self):
+        """
+        Load the price data into the Price table, updating the prices of already loaded dates. The prices are
+        streamed into Postgres with COPY.
+        """
+
+        price_data = self._transformation_data['price_data']
+
+        Price.objects.ensure_partitions(set(price_data['date'].dt.year))
+
+        Price.objects.copy_upsert_frame(self._symbol_prep(price_data, 'price'), conflict_fields=['symbol_id', 'date'],
+                                        update_fields=['price'])
 
         logger.info(__name__ + 'successful')
 
-    @staticmethod
-    def _symbol_date_prep(data, retained_column):
+    @log()
+    def _load_portfolios(self):
         """
-        Add the appropriate symbol_date ID to the provided data in order to make upload to Depot and Price model
-        possible (due to FK to DimensionSymbolDate).
-        :param data: the data set to add the id to (should be in record form)
-        :param retained_column: the other column to retain in the data set in addition to symbol_date_id
+        Load the portfolios into the Depot table (streamed into Postgres with COPY). The portfolios replace the
+        ones of the same dates, including positions that no longer exist.
         """
 
-        if len(data) == 0:
-            return []
+        portfolios = self._transformation_data['portfolios']
+
+        if len(portfolios) == 0:
+            return
+
+        dates = portfolios['date']
 
-        dates = [x['date'] for x in data]
-        symbols = list(set([x['symbol'] for x in data]))
+        Depot.objects.ensure_partitions(set(dates.dt.year))
 
-        existing = pd.DataFrame(DimensionSymbolDate.objects.get_existing(dates, symbols),
-                                columns=['symbol_date', 'symbol', 'date'])
+        # remove the positions of the rebuilt dates, including the ones that have been closed in the meantime
+        Depot.objects.filter(account_id=self._account_id, date__gte=dates.min().date(),
+                             date__lte=dates.max().date()).delete()
+
+        records = self._symbol_prep(portfolios, 'pieces')
+        records.insert(0, 'account_id', self._account_id)
+
+        Depot.objects.copy_upsert_frame(records, conflict_fields=['account_id', 'symbol_id', 'date'],
+                                        update_fields=['pieces'])
+
+        logger.info(__name__ + 'successful')
 
-        data_df = pd.DataFrame(data)
+    def _loaded_dates(self, sources: Iterable[str] = ('portfolios', 'price_data')) -> List[datetime.date]:
+        """
+        First and last date of the newly loaded rows of the sources (empty if nothing was loaded).
+        :param sources: keys of the typed frames of the transformation data
+        """
+        dates = [self._transformation_data[x]['date'] for x in sources]
+        dates = [x for x in dates if len(x) > 0]
 
-        merged = pd.merge(data_df, existing, how='left')[[retained_column, 'symbol_date']]
-        merged.columns = [retained_column, 'symbol_date_id']
-        records = merged.to_dict('records')
+        if len(dates) == 0:
+            return []
 
-        return records
+        return [min(x.min() for x in dates).date(), max(x.max() for x in dates).date()]
 
     @log()
-    def _load_price_data(self):
+    def _load_daily_values(self):
         """
-        Load the price data into the Price table.
+        Refresh the materialized daily depot values for the date range of the newly loaded prices and portfolios.
         """
 
-        records = self._symbol_date_prep(self._transformation_data['price_data'], 'price')
+        dates = self._loaded_dates()
 
-        price_objects = [Price(**p) for p in records]
-        Price.objects.bulk_create(price_objects)
+        if len(dates) == 0:
+            return
+
+        DailyValue.objects.refresh(self._account, min(dates), max(dates))
 
         logger.info(__name__ + 'successful')
 
     @log()
-    def _load_portfolios(self):
+    def _load_metrics_state(self):
         """
-        Load the portfolios into the Depot table.
+        Update the running performance statistics with the newly loaded days. The performance also changes with
+        the cash flows, so their dates count as well.
         """
 
-        records = self._symbol_date_prep(self._transformation_data['portfolios'], 'pieces')
+        dates = self._loaded_dates(['portfolios', 'price_data', 'cash_flows'])
 
-        depot_objects = [Depot(**d) for d in records]
-        Depot.objects.bulk_create(depot_objects)
+        if len(dates) == 0:
+            return
+
+        update_metrics_state(min(dates), self._account)
+
+        logger.info(__name__ + 'successful')
+
+    @log()
+    def _load_watermarks(self):
+        """
+        Advance the high-water marks of the extracted sources.
+        """
+        Watermark.objects.advance(self._account, self._transformation_data['watermarks'])
 
         logger.info(__name__ + 'successful')
 
     def run(self):
         """
-        Run the loading process.
+        Run the loading process. All tables are written in a single database transaction, after which
+        the cached dashboard data is invalidated.
         """
+        with atomic():
+            self._run()
+
+        bump_data_version(self._run_id)
+
+    def _run(self):
+        self._load_account()
         self._load_transactions()
         self._load_product_info()
         self._load_cash_flows()
-        self._load_symbol_date_combs()
+        self._load_symbols()
         self._load_price_data()
         self._load_portfolios()
+        self._load_daily_values()
+        self._load_metrics_state()
+        self._load_watermarks()
+
+
+class Pipeline:
+
+    def __init__(self, account: str = Account.DEFAULT, resume: bool = False, max_workers: int = None):
+        """
+        :param account: name of the account to run the ETL process for
+        :param resume: resume the latest run of the account if it did not finish, skipping its completed stages
+        :param max_workers: number of concurrent extraction steps (see Extraction)
+        """
+        self._account = account
+        self._resume = resume
+        self._max_workers = max_workers
+
+    def _stage(self, run: EtlRun, checkpoint: Checkpoint, stage: str, func: Callable[[], Dict]) -> Dict:
+        """
+        Run a stage and persist its output, or load the persisted output if the stage was already completed.
+        """
+        if run.completed(stage):
+            logger.info(__name__ + f': resuming run {run.id} after stage {stage}')
+            return checkpoint.load(stage)
+
+        with profile_stage(f'{self._account}.{stage}'):
+            data = func()
+
+        checkpoint.save(stage, data)
+
+        run.stage = stage
+        run.save(update_fields=['stage'])
+
+        return data
+
+    def _extract(self) -> Dict:
+        extraction = Extraction(self._account, max_workers=self._max_workers)
+        extraction.run()
+        return extraction.data
+
+    @staticmethod
+    def _transform(extraction_data: Dict) -> Dict:
+        transformation = Transformation(extraction_data)
+        transformation.run()
+        return transformation.data
+
+    @staticmethod
+    def _load(transformation_data: Dict, run_id: int) -> Dict:
+        loading = Loading(transformation_data, run_id=run_id)
+        loading.run()
+        return {}
+
+    def run(self) -> EtlRun:
+        """
+        Run the ETL process, recording its progress in the run ledger.
+        """
+        run = EtlRun.objects.get_resumable(self._account) if self._resume else None
+        if run is None:
+            run = EtlRun.objects.create(account=Account.objects.get_or_create(name=self._account)[0])
+
+        checkpoint = Checkpoint(ETL['CHECKPOINT_DIR'], run.id)
+
+        try:
+            extraction_data = self._stage(run, checkpoint, 'extraction', self._extract)
+            transformation_data = self._stage(run, checkpoint, 'transformation',
+                                              lambda: self._transform(extraction_data))
+            self._stage(run, checkpoint, 'loading', lambda: self._load(transformation_data, run.id))
+
+        except BaseException as be:
+            run.status = EtlRun.FAILED
+            run.save(update_fields=['status'])
+            raise be
+
+        run.status = EtlRun.SUCCESS
+        run.finished = timezone.now()
+        run.save(update_fields=['status', 'finished'])
+
+        checkpoint.clear()
+
+        return run
+
+
+def _shared_symbols(accounts: Iterable[str]) -> Dict[datetime.date, Set[str]]:
+    """
+    Return the symbols of the current portfolios of the accounts, grouped by the date their prices are extracted
+    from.
+    :param accounts: names of the accounts
+    """
+    symbols_per_start = {}
+
+    for account in accounts:
+        from_date, from_dates = _extraction_dates(account)
+        symbols = Depot.objects.get_portfolio_at_date(from_date, account).values_list('symbol__symbol', flat=True)
+        symbols_per_start.setdefault(from_dates['prices'], set()).update(symbols)
+
+    return symbols_per_start
+
+
+@log()
+def _load_shared_prices(accounts: Iterable[str]) -> None:
+    """
+    Download and load the symbols and prices of the current portfolios of all accounts once, before the accounts
+    are run. Symbols held in several accounts are only downloaded once (through the price cache), and the account
+    runs find their rows unchanged and skip them (see BulkUpsertManager), instead of each upserting the shared rows
+    in its own long transaction. The partitions of the years to be loaded are created here as well, so that the
+    account processes don't race to create them.
+    :param accounts: names of the accounts
+    """
+    to_date = datetime.date.today()
+    symbols_per_start = _shared_symbols(accounts)
+
+    from_year = min([*symbols_per_start.keys(), *(_extraction_dates(x)[0] for x in accounts)]).year
+    Price.objects.ensure_partitions(range(from_year, to_date.year + 1))
+    Depot.objects.ensure_partitions(range(from_year, to_date.year + 1))
+
+    for start, symbols in symbols_per_start.items():
+        if len(symbols) == 0:
+            continue
+
+        price_data = YF.get_prices(sorted(symbols), start=start, end=to_date)
+        if len(price_data) == 0:
+            continue
+
+        prices = _price_frame(price_data)
+
+        symbol_index = SymbolIndex()
+        symbol_index.insert(sorted(prices['symbol'].cat.categories))
+
+        Price.objects.copy_upsert_frame(
+            pd.DataFrame({'symbol_id': category_ids(prices['symbol'], symbol_index),
+                          'date': prices['date'].to_numpy(),
+                          'price': prices['price'].to_numpy()}),
+            conflict_fields=['symbol_id', 'date'],
+            update_fields=['price']
+        )
+
+    logger.info(__name__ + 'successful')
+
+
+def _run_account(account: str, resume: bool, max_workers: int) -> int:
+    """
+    Run the ETL process of an account (in a worker process).
+    :return: ID of the run
+    """
+    return Pipeline(account, resume=resume, max_workers=max_workers).run().id
+
+
+@log()
+def run_accounts(accounts: List[str], processes: int = None, resume: bool = False,
+                 max_workers: int = None) -> Dict[str, BaseException]:
+    """
+    Run the ETL process of several accounts concurrently, one account per worker process. The prices shared by
+    the accounts are downloaded and loaded once beforehand.
+    :param accounts: names of the accounts
+    :param processes: number of worker processes, defaults to ETL['PROCESSES']. Accounts are run in this process
+        if set to 1.
+    :param resume: resume the latest unfinished run of each account (see Pipeline)
+    :param max_workers: number of concurrent extraction steps per account (see Extraction)
+    :return: exception per failed account
+    """
+    processes = processes if processes is not None else ETL['PROCESSES']
+    failures = {}
+
+    if len(accounts) > 1:
+        _load_shared_prices(accounts)
+
+    if processes <= 1 or len(accounts) <= 1:
+        for account in accounts:
+            try:
+                _run_account(account, resume, max_workers)
+            except Exception as e:
+                logger.exception(__name__ + f': run of account {account} failed')
+                failures[account] = e
+
+    else:
+        # the worker processes open their own database connections
+        connections.close_all()
+
+        with ProcessPoolExecutor(max_workers=min(processes, len(accounts)), initializer=django.setup) as pool:
+            futures = {account: pool.submit(_run_account, account, resume, max_workers) for account in accounts}
+
+            for account, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.exception(__name__ + f': run of account {account} failed')
+                    failures[account] = e
+
+    logger.info(__name__ + 'successful')
+
+    return failures
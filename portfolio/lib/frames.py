@@ -0,0 +1,65 @@
+from typing import Dict, Any
+
+import numpy as np
+import pandas as pd
+
+# Typed columnar representation of the time series handed over between the ETL stages: symbols are
+# categorical, dates datetime64 (pandas has no date-only dtype) and values float64. The columns are named after
+# the model fields, so that the frames can be loaded as they are.
+Schema = Dict[str, Any]
+
+TRANSACTIONS: Schema = {
+    'id': object,
+    'productId': object,
+    'date': 'datetime64[ns]',
+    'buysell': 'category',
+    'price': np.float64,
+    'quantity': np.float64,
+    'total': np.float64,
+}
+
+CASH_FLOWS: Schema = {
+    'date': 'datetime64[ns]',
+    'cashflow': np.float64,
+}
+
+PRICES: Schema = {
+    'symbol': 'category',
+    'date': 'datetime64[ns]',
+    'price': np.float64,
+}
+
+PORTFOLIOS: Schema = {
+    'symbol': 'category',
+    'date': 'datetime64[ns]',
+    'pieces': np.float64,
+}
+
+
+def typed_frame(schema: Schema, columns: Dict[str, Any] = None) -> pd.DataFrame:
+    """
+    Create a frame with the columns and dtypes of the schema.
+    :param schema: dtype per column
+    :param columns: values per column (array-like), an empty frame is created if not given
+    """
+    columns = columns if columns is not None else {name: [] for name in schema}
+
+    return pd.DataFrame({name: pd.Series(columns[name]).reset_index(drop=True).astype(dtype)
+                         for name, dtype in schema.items()})
+
+
+def category_ids(column: pd.Series, ids: Dict[str, int]) -> np.ndarray:
+    """
+    Map a categorical column to IDs, looking up each category once instead of each row.
+    :param column: categorical column
+    :param ids: ID per category
+    :return: ID per row
+    :raises: ValueError: if the column has missing values, which have no category
+    """
+    codes = column.cat.codes.to_numpy()
+
+    if (codes < 0).any():
+        raise ValueError('{} has {} missing values'.format(column.name, (codes < 0).sum()))
+
+    categories = np.array([ids[x] for x in column.cat.categories], dtype=np.int64)
+    return categories[codes]
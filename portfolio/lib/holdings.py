@@ -0,0 +1,56 @@
+import datetime
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+# positions below this size are considered closed (guards against float residue of the cumulative sum)
+MIN_PIECES = 1e-9
+
+
+def build_holdings(dates: Iterable[datetime.date], symbols: Iterable[str], quantities: Iterable[float],
+                   start_portfolio: Dict[str, float], from_date: datetime.date,
+                   to_date: datetime.date) -> Dict[str, np.ndarray]:
+    """
+    Build the daily holdings between from_date and to_date (inclusive) in a columnar fashion. The transactions
+    are pivoted into a date x symbol matrix of quantity changes over the full date index, which is then
+    cumulated on top of the start portfolio.
+    :param dates: transaction dates
+    :param symbols: transaction symbols
+    :param quantities: transaction quantities (negative for sells)
+    :param start_portfolio: pieces per symbol the holdings start from
+    :param from_date: first date of the holdings
+    :param to_date: last date of the holdings
+    :return: dictionary with the arrays 'date' (datetime64), 'symbol' and 'pieces', one entry per open position
+        and date
+    """
+    date_index = pd.date_range(from_date, to_date, freq='D')
+
+    trades = pd.DataFrame({
+        'date': pd.to_datetime(pd.Series(list(dates), dtype=object)),
+        'symbol': pd.Series(list(symbols), dtype=object),
+        'quantity': pd.Series(list(quantities), dtype=float),
+    })
+    trades = trades[(trades['date'] >= date_index[0]) & (trades['date'] <= date_index[-1])] \
+        if len(date_index) else trades.iloc[0:0]
+
+    start = pd.Series(start_portfolio, dtype=float)
+
+    # quantity changes per date and symbol
+    flows = trades.pivot_table(index='date', columns='symbol', values='quantity', aggfunc='sum') \
+        if len(trades) else pd.DataFrame(index=pd.DatetimeIndex([]), dtype=float)
+
+    columns = flows.columns.union(start.index)
+    flows = flows.reindex(index=date_index, columns=columns).fillna(0)
+
+    # cumulate on top of the start portfolio, which carries positions forward across the full date index
+    holdings = flows.to_numpy().cumsum(axis=0) + start.reindex(columns).fillna(0).to_numpy()
+
+    # unnest open positions in order of date and symbol
+    date_idx, symbol_idx = np.nonzero(holdings > MIN_PIECES)
+
+    return {
+        'date': date_index.values[date_idx],
+        'symbol': np.asarray(columns, dtype=object)[symbol_idx],
+        'pieces': holdings[date_idx, symbol_idx],
+    }
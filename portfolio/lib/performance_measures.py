@@ -1,8 +1,22 @@
+import datetime
+import math
+from typing import Dict
+
 import pandas as pd
 import numpy as np
 from scipy.stats import norm
 
 
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """
+    Forward fill NaN values along the first axis.
+    """
+    index = np.where(np.isnan(values), 0, np.arange(values.shape[0]).reshape(-1, *([1] * (values.ndim - 1))))
+    np.maximum.accumulate(index, axis=0, out=index)
+
+    return np.take_along_axis(values, index, axis=0)
+
+
 class PerformanceMeasures:
 
     HELP_TEXT = {
@@ -27,73 +41,221 @@ class PerformanceMeasures:
                " investiert hätte."
         }
 
+    # measures shown on the dashboard
+    MEASURES = ['returns', 'annualized_returns', 'std', 'sharpe', 'var', 'max_drawdown']
+
     @staticmethod
     def measure_loop(performance: pd.Series) -> dict:
         """
-        Loop through performance measure calculations and return the result of all.
+        Calculate all dashboard performance measures in a single pass.
         :param performance: Time series the calculations should be based on
         """
-        switcher = {
-            1: PerformanceMeasures.returns,
-            2: PerformanceMeasures.annualized_returns,
-            3: PerformanceMeasures.std,
-            4: PerformanceMeasures.sharpe,
-            5: PerformanceMeasures.var,
-            6: PerformanceMeasures.max_drawdown,
+        measures = PerformanceMeasures.measure_matrix(performance.to_numpy(dtype=float))
+
+        return {key: float(measures[key]) for key in PerformanceMeasures.MEASURES}
+
+    @staticmethod
+    def measure_matrix(values: np.ndarray) -> dict:
+        """
+        Calculate all performance measures (including the CVaR) from the values of one or many series. The
+        daily returns are computed once and every measure is derived from them.
+        :param values: values of a series, or of many series of equal length as the columns of a 2-D array
+        :return: dictionary of the measures, scalars for a single series and arrays with one entry per column
+            for many series
+        """
+        values = np.asarray(values, dtype=float)
+        n = values.shape[0]
+
+        # daily returns of the forward filled values (like pd.Series.pct_change)
+        filled = _ffill(values)
+        daily_returns = filled[1:] / filled[:-1] - 1
+
+        growth = values[-1] / values[0]
+        annualized_returns = growth ** (252 / n) - 1
+
+        mean = np.nanmean(daily_returns, axis=0)
+        std = np.nanstd(daily_returns, axis=0, ddof=1) * np.sqrt(252)
+        population_sd = np.nanstd(daily_returns, axis=0)
+
+        # drawdown from the running maximum
+        drawdown = values / np.fmax.accumulate(values, axis=0) - 1
+
+        return {
+            'returns': growth - 1,
+            'annualized_returns': annualized_returns,
+            'std': std,
+            'sharpe': annualized_returns / std,
+            'var': mean + population_sd * norm.ppf(0.01),
+            'cvar': mean - 0.01 ** (-1) * population_sd * norm.pdf(norm.ppf(0.01)),
+            'max_drawdown': np.nanmin(drawdown, axis=0),
         }
 
-        data = dict()
-        for key in switcher.keys():
-            measure = switcher.get(key)
-            data = {**data, **measure(performance)}
 
-        return data
+class RollingMeasures:
+    """
+    Rolling-window and multi-horizon risk measures of a series. The window sums of the daily returns and their
+    squares are differences of prefix sums, so every window costs O(1) and a full rolling series O(n).
+    """
 
-    @staticmethod
-    def date_range(series: pd.Series) -> dict:
-        return {"start_date": series.index[0].date(), "end_date": series.index[-1].date()}
+    # window lengths in observations (the performance series has one value per calendar day)
+    WINDOWS = {'30d': 30, '90d': 90, '1y': 365}
 
-    @staticmethod
-    def returns(series: pd.Series) -> dict:
-        return {PerformanceMeasures.returns.__name__: (series[-1] / series[0]) - 1}
+    def __init__(self, series: pd.Series):
+        """
+        :param series: Time series the calculations should be based on
+        """
+        self._index = series.index
+        self._values = _ffill(series.to_numpy(dtype=float))
 
-    @staticmethod
-    def annualized_returns(series: pd.Series) -> dict:
-        return {PerformanceMeasures.annualized_returns.__name__: (series[-1] / series[0]) ** (252 / len(series)) - 1}
+        daily_returns = np.full(len(self._values), np.nan)
+        daily_returns[1:] = self._values[1:] / self._values[:-1] - 1
 
-    @staticmethod
-    def std(series: pd.Series) -> dict:
-        return {PerformanceMeasures.std.__name__: np.std(series.pct_change(), ddof=1) * np.sqrt(252)}
+        valid = ~np.isnan(daily_returns)
+        daily_returns = np.where(valid, daily_returns, 0)
 
-    @staticmethod
-    def sharpe(series: pd.Series) -> dict:
-        mean = PerformanceMeasures.annualized_returns(series)["annualized_returns"]
-        sd = PerformanceMeasures.std(series)["std"]
-        ex_return = mean
-        return {PerformanceMeasures.sharpe.__name__: ex_return / sd}
+        # prefix sums, element i covers the returns before position i
+        self._count = np.concatenate([[0], np.cumsum(valid)])
+        self._sum = np.concatenate([[0], np.cumsum(daily_returns)])
+        self._sum_sq = np.concatenate([[0], np.cumsum(daily_returns ** 2)])
 
-    @staticmethod
-    def var(series: pd.Series) -> dict:
-        series = series.pct_change().dropna()
-        mean = np.mean(series)
-        sd = np.std(series)
+    def _window(self, start: np.ndarray, end: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Measures of the windows from start to end (inclusive positions of the values).
+        """
+        # the returns of a window are the ones after its first value
+        count = self._count[end + 1] - self._count[start + 1]
+        total = self._sum[end + 1] - self._sum[start + 1]
+        total_sq = self._sum_sq[end + 1] - self._sum_sq[start + 1]
 
-        return {PerformanceMeasures.var.__name__: norm.ppf(0.01, loc=mean, scale=sd)}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = total / count
+            population_var = np.maximum(total_sq / count - mean ** 2, 0)
+            std = np.sqrt(population_var * count / (count - 1)) * np.sqrt(252)
 
-    @staticmethod
-    def cvar(series: pd.Series) -> dict:
-        series = series.pct_change()
-        mean = np.mean(series)
-        sd = np.std(series)
+            growth = self._values[end] / self._values[start]
+            annualized_returns = growth ** (252 / (end - start + 1)) - 1
 
-        return {PerformanceMeasures.cvar.__name__: mean - 0.01 ** (-1) * sd * norm.pdf(norm.ppf(0.01))}
+            return {
+                'returns': growth - 1,
+                'annualized_returns': annualized_returns,
+                'std': std,
+                'sharpe': annualized_returns / std,
+                'var': mean + np.sqrt(population_var) * norm.ppf(0.01),
+            }
 
-    @staticmethod
-    def max_drawdown(series: pd.Series) -> dict:
-        window = len(series)
-        roll_max = series.rolling(window, min_periods=1).max()
-        daily_drawdown = series / roll_max - 1
-        max_daily_drawdown = daily_drawdown.rolling(window, min_periods=1).min()
+    def rolling(self, window: int) -> pd.DataFrame:
+        """
+        Calculate the measures over a rolling window, together with the drawdown from the peak of the window.
+        :param window: window length in observations
+        :return: one row of measures per date
+        """
+        end = np.arange(len(self._values))
+        start = np.maximum(end - window + 1, 0)
 
-        return {PerformanceMeasures.max_drawdown.__name__: min(max_daily_drawdown)}
+        measures = self._window(start, end)
 
+        peak = pd.Series(self._values).rolling(window, min_periods=1).max().to_numpy()
+        measures['drawdown'] = self._values / peak - 1
+
+        return pd.DataFrame(measures, index=self._index)
+
+    def horizons(self, today: datetime.date = None) -> Dict[str, dict]:
+        """
+        Calculate the measures over the trailing windows, year to date and since inception.
+        :param today: reference date of the year to date horizon, defaults to today
+        :return: dictionary of measures per horizon, horizons without data are omitted
+        """
+        today = today or datetime.date.today()
+
+        n = len(self._values)
+        starts = {name: max(n - window, 0) for name, window in self.WINDOWS.items()}
+        starts['ytd'] = int(pd.DatetimeIndex(self._index).searchsorted(pd.Timestamp(today.year, 1, 1)))
+        starts['inception'] = 0
+
+        horizons = {}
+        for name, start in starts.items():
+            if start >= n:
+                continue
+
+            measures = self._window(np.array([start]), np.array([n - 1]))
+            horizons[name] = {key: float(value[0]) for key, value in measures.items()}
+
+            values = self._values[start:]
+            horizons[name]['max_drawdown'] = float(np.nanmin(values / np.fmax.accumulate(values) - 1))
+
+        return horizons
+
+
+class OnlineMeasures:
+    """
+    Running statistics of a series, updated value by value as the series grows, from which the performance
+    measures are derived in O(1). NaN values are forward filled, like in PerformanceMeasures.measure_matrix.
+    """
+
+    FIELDS = ['count', 'first_value', 'last_value', 'return_count', 'return_sum', 'return_sum_sq', 'peak',
+              'max_drawdown']
+
+    def __init__(self, count: int = 0, first_value: float = None, last_value: float = None, return_count: int = 0,
+                 return_sum: float = 0.0, return_sum_sq: float = 0.0, peak: float = None, max_drawdown: float = 0.0):
+        self.count = count
+        self.first_value = first_value
+        self.last_value = last_value
+        self.return_count = return_count
+        self.return_sum = return_sum
+        self.return_sum_sq = return_sum_sq
+        self.peak = peak
+        self.max_drawdown = max_drawdown
+
+    @property
+    def state(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def copy(self) -> 'OnlineMeasures':
+        return OnlineMeasures(**self.state)
+
+    def push(self, value: float) -> None:
+        """
+        Add the next value of the series.
+        """
+        self.count += 1
+
+        if value is None or math.isnan(value):
+            if self.last_value is None:
+                return
+            value = self.last_value
+
+        if self.first_value is None:
+            self.first_value = value
+        else:
+            daily_return = value / self.last_value - 1
+            self.return_count += 1
+            self.return_sum += daily_return
+            self.return_sum_sq += daily_return ** 2
+
+        self.last_value = value
+        self.peak = value if self.peak is None else max(self.peak, value)
+        self.max_drawdown = min(self.max_drawdown, value / self.peak - 1)
+
+    def measures(self) -> dict:
+        """
+        Derive the performance measures (including the CVaR) from the running statistics.
+        """
+        if self.return_count < 2:
+            return {key: float('nan') for key in [*PerformanceMeasures.MEASURES, 'cvar']}
+
+        growth = self.last_value / self.first_value
+        annualized_returns = growth ** (252 / self.count) - 1
+
+        mean = self.return_sum / self.return_count
+        population_sd = math.sqrt(max(self.return_sum_sq / self.return_count - mean ** 2, 0))
+        std = population_sd * math.sqrt(self.return_count / (self.return_count - 1)) * math.sqrt(252)
+
+        return {
+            'returns': growth - 1,
+            'annualized_returns': annualized_returns,
+            'std': std,
+            'sharpe': annualized_returns / std if std else float('nan'),
+            'var': float(mean + population_sd * norm.ppf(0.01)),
+            'cvar': float(mean - 0.01 ** (-1) * population_sd * norm.pdf(norm.ppf(0.01))),
+            'max_drawdown': self.max_drawdown,
+        }
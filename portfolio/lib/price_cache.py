@@ -0,0 +1,146 @@
+import contextlib
+import datetime
+import os
+import sqlite3
+from typing import List, Tuple, Dict
+
+import pandas as pd
+
+DateRange = Tuple[datetime.date, datetime.date]
+
+
+class PriceCache:
+    """
+    Persistent on-disk cache of daily prices keyed by symbol and date. Besides the prices, the cache keeps track
+    of the date ranges that were already downloaded per symbol, so that days without prices (weekends, holidays)
+    don't cause repeated downloads. All date ranges are half-open [start, end), like the yfinance API.
+    """
+
+    def __init__(self, path: str, settle_days: int = 3):
+        """
+        :param path: path of the SQLite file
+        :param settle_days: number of most recent days that are never considered covered, since their prices
+            may still change
+        """
+        self._path = path
+        self._settle_days = settle_days
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        with self._connect() as conn:
+            # the cache is shared by the ETL processes of all accounts, WAL lets readers and a writer coexist
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS price '
+                         '(symbol TEXT, date TEXT, price REAL, PRIMARY KEY (symbol, date)) WITHOUT ROWID')
+            conn.execute('CREATE TABLE IF NOT EXISTS coverage (symbol TEXT, start TEXT, end TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS coverage_symbol ON coverage (symbol)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        """
+        Open a connection that commits on success and is always closed.
+        """
+        conn = sqlite3.connect(self._path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _coverage(self, conn: sqlite3.Connection, symbol: str) -> List[DateRange]:
+        rows = conn.execute('SELECT start, end FROM coverage WHERE symbol = ? ORDER BY start', (symbol,))
+        return [(datetime.date.fromisoformat(s), datetime.date.fromisoformat(e)) for s, e in rows]
+
+    def missing_ranges(self, symbol: str, start: datetime.date, end: datetime.date) -> List[DateRange]:
+        """
+        Return the parts of [start, end) that have not been downloaded yet for the symbol.
+        :param symbol: stock market symbol
+        :param start: start date
+        :param end: end date (exclusive)
+        """
+        with self._connect() as conn:
+            coverage = self._coverage(conn, symbol)
+
+        gaps = []
+        cursor = start
+        for covered_start, covered_end in coverage:
+            if covered_end <= cursor:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start))
+            cursor = max(cursor, covered_end)
+
+        if cursor < end:
+            gaps.append((cursor, end))
+
+        return gaps
+
+    def store(self, symbol: str, start: datetime.date, end: datetime.date, prices: pd.Series) -> None:
+        """
+        Store downloaded prices and mark [start, end) as covered for the symbol. A download without prices is
+        only considered covered if the range has no business days, otherwise it is retried the next time (the
+        symbol may have been delisted temporarily or the download failed).
+        :param symbol: stock market symbol
+        :param start: start date of the download
+        :param end: end date of the download (exclusive)
+        :param prices: prices indexed by date
+        """
+        prices = prices.dropna()
+        settled = min(end, datetime.date.today() - datetime.timedelta(days=self._settle_days))
+
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO price (symbol, date, price) VALUES (?, ?, ?)',
+                             [(symbol, date.isoformat(), float(price)) for date, price in prices.items()])
+
+            if start >= settled:
+                return
+
+            if prices.empty and len(pd.bdate_range(start, settled - datetime.timedelta(days=1))) > 0:
+                return
+
+            # merge the new range with the overlapping or adjacent ones
+            merged = []
+            for covered in sorted([*self._coverage(conn, symbol), (start, settled)]):
+                if merged and covered[0] <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], covered[1]))
+                else:
+                    merged.append(covered)
+
+            conn.execute('DELETE FROM coverage WHERE symbol = ?', (symbol,))
+            conn.executemany('INSERT INTO coverage (symbol, start, end) VALUES (?, ?, ?)',
+                             [(symbol, s.isoformat(), e.isoformat()) for s, e in merged])
+
+    def load(self, symbols: List[str], start: datetime.date, end: datetime.date) -> pd.DataFrame:
+        """
+        Load the cached prices of the symbols in [start, end).
+        :return: prices with one column per symbol, indexed by date
+        """
+        if len(symbols) == 0:
+            return pd.DataFrame()
+
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT symbol, date, price FROM price WHERE symbol IN ({}) AND date >= ? AND date < ?'.format(
+                    ', '.join('?' * len(symbols))),
+                (*symbols, start.isoformat(), end.isoformat())
+            ).fetchall()
+
+        prices = pd.DataFrame(rows, columns=['symbol', 'date', 'price'])
+        prices['date'] = [datetime.date.fromisoformat(x) for x in prices['date']]
+
+        return prices.pivot(index='date', columns='symbol', values='price').reindex(columns=symbols).sort_index()
+
+    def group_missing(self, symbols: List[str], start: datetime.date,
+                      end: datetime.date) -> Dict[DateRange, List[str]]:
+        """
+        Group the symbols by their missing date ranges, so that symbols with the same gap can be downloaded
+        together.
+        """
+        groups = {}
+        for symbol in symbols:
+            for gap in self.missing_ranges(symbol, start, end):
+                groups.setdefault(gap, []).append(symbol)
+
+        return groups
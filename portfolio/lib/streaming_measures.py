@@ -0,0 +1,60 @@
+import datetime
+from typing import Optional
+
+from portfolio.lib.aggregation import compute_performance_series
+from portfolio.lib.performance_measures import OnlineMeasures
+from portfolio.models import Account, MetricsState
+
+
+def update_metrics_state(changed_from: datetime.date, account: str = Account.DEFAULT) -> None:
+    """
+    Fold the performance values appended since the last update into the persisted running statistics. The last
+    value is kept as provisional tail, since the next ETL run reloads its date. If the changed dates reach back
+    into the already folded values, the statistics are rebuilt from scratch.
+    :param changed_from: first date whose values have been (re)loaded
+    :param account: name of the account the statistics belong to
+    """
+    state = MetricsState.objects.filter(account__name=account).first() \
+        or MetricsState(account=Account.objects.get(name=account))
+
+    if state.sealed_date is None or changed_from <= state.sealed_date:
+        online = OnlineMeasures()
+        performance = compute_performance_series(account)
+        state.sealed_date = None
+
+    else:
+        online = OnlineMeasures(**{field: getattr(state, field) for field in OnlineMeasures.FIELDS})
+        performance = compute_performance_series(account, state.sealed_date + datetime.timedelta(days=1))
+
+    if performance.empty:
+        return
+
+    for value in performance.values[:-1]:
+        online.push(float(value))
+
+    for field, value in online.state.items():
+        setattr(state, field, value)
+
+    if len(performance) > 1:
+        state.sealed_date = performance.index[-2]
+    state.tail_date = performance.index[-1]
+    state.tail_value = float(performance.values[-1])
+
+    state.save()
+
+
+def get_metrics(account: str = Account.DEFAULT) -> Optional[dict]:
+    """
+    Return the performance measures of the account from its running statistics in O(1), or None if no
+    statistics exist yet.
+    :param account: name of the account the statistics belong to
+    """
+    state = MetricsState.objects.filter(account__name=account).first()
+
+    if state is None or state.tail_date is None:
+        return None
+
+    online = OnlineMeasures(**{field: getattr(state, field) for field in OnlineMeasures.FIELDS})
+    online.push(state.tail_value)
+
+    return online.measures()
@@ -0,0 +1,53 @@
+from typing import Dict, Iterable, Tuple
+
+from portfolio.models import Symbol
+
+
+class SymbolIndex:
+    """
+    In-memory index of symbol -> Symbol ID. It is built once per ETL run from the symbols that already exist and
+    the IDs returned when inserting the new ones, so that loading prices and portfolios is a dictionary lookup
+    instead of a query and merge against the symbol table.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = dict()
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._ids
+
+    def __getitem__(self, symbol: str) -> int:
+        return self._ids[symbol]
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, rows: Iterable[Tuple[int, str]]) -> None:
+        """
+        Add (id, symbol) rows to the index.
+        """
+        for _id, symbol in rows:
+            self._ids[symbol] = _id
+
+    def fetch(self, symbols: Iterable[str]) -> None:
+        """
+        Add the IDs of the given symbols that already exist in the database, using a single query.
+        """
+        self.add(Symbol.objects.get_existing(symbols))
+
+    def insert(self, symbols: Iterable[str]) -> None:
+        """
+        Insert the given symbols into the database and add their IDs to the index. Symbols that turn out to
+        exist already (and are therefore not returned by the insert) are fetched afterwards.
+        """
+        symbols = list(symbols)
+
+        self.add(Symbol.objects.bulk_upsert(
+            [{'symbol': symbol} for symbol in symbols],
+            conflict_fields=['symbol'],
+            returning=['id', 'symbol']
+        ))
+
+        missing = [symbol for symbol in symbols if symbol not in self]
+        if len(missing) > 0:
+            self.fetch(missing)
@@ -0,0 +1,163 @@
+import datetime
+import glob
+import os
+from itertools import groupby, islice
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from portfolio.lib.symbol_index import SymbolIndex
+from portfolio.managers import PartitionedManager
+from portfolio.models import Account, Price, Depot, Cashflow
+
+# exportable time series: model, value field, whether the rows are keyed by symbol and whether they belong to
+# an account
+TABLES = {
+    'price': (Price, 'price', True, False),
+    'depot': (Depot, 'pieces', True, True),
+    'cashflow': (Cashflow, 'cashflow', False, True),
+}
+
+DateRange = Tuple[Optional[datetime.date], Optional[datetime.date]]
+
+
+def _schema(table: str):
+    """
+    Arrow schema of a time series: dictionary encoded accounts and symbols, date32 dates and float64 values.
+    """
+    _, value, keyed, per_account = TABLES[table]
+
+    fields = [pa.field('account', pa.dictionary(pa.int32(), pa.string()))] if per_account else []
+    fields += [pa.field('symbol', pa.dictionary(pa.int32(), pa.string()))] if keyed else []
+    fields += [pa.field('date', pa.date32()), pa.field(value, pa.float64())]
+
+    return pa.schema(fields)
+
+
+def _chunks(rows: Iterable[Sequence], size: int) -> Iterator[List[Sequence]]:
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _dictionary_ids(column, resolve) -> List[int]:
+    """
+    Map a (dictionary encoded) string column to IDs, resolving the IDs once per dictionary entry instead of once
+    per row.
+    :param column: string or dictionary column
+    :param resolve: function mapping the list of distinct values to their IDs
+    """
+    if not isinstance(column.type, pa.DictionaryType):
+        column = column.dictionary_encode()
+
+    ids = np.array(resolve(column.dictionary.to_pylist()), dtype=np.int64)
+
+    return ids[column.indices.to_numpy(zero_copy_only=False)].tolist()
+
+
+def export_table(table: str, directory: str, chunk_size: int = 50000) -> int:
+    """
+    Export a time series as Parquet, partitioned by year (<directory>/<table>/year=<year>/part-0.parquet). The
+    rows are streamed from a server-side cursor in order of date, so memory usage is bounded by the chunk size.
+    :param table: name of the time series (see TABLES)
+    :param directory: root directory of the export
+    :param chunk_size: number of rows fetched and written at once
+    :return: number of exported rows
+    """
+    model, value, keyed, per_account = TABLES[table]
+    schema = _schema(table)
+
+    columns = (['account__name'] if per_account else []) + (['symbol__symbol'] if keyed else []) + ['date', value]
+    date_position = columns.index('date')
+
+    rows = model.objects.order_by('date').values_list(*columns).iterator(chunk_size=chunk_size)
+
+    writer, year, count = None, None, 0
+
+    try:
+        for chunk in _chunks(rows, chunk_size):
+
+            # split the chunk at the year boundaries
+            for chunk_year, year_rows in groupby(chunk, key=lambda row: row[date_position].year):
+                if chunk_year != year:
+                    if writer is not None:
+                        writer.close()
+
+                    year = chunk_year
+                    path = os.path.join(directory, table, f'year={year}', 'part-0.parquet')
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    writer = pq.ParquetWriter(path, schema)
+
+                arrays = [pa.array(x, type=pa.string()).dictionary_encode() if pa.types.is_dictionary(field.type)
+                          else pa.array(x, type=field.type) for field, x in zip(schema, zip(*year_rows))]
+
+                batch = pa.Table.from_arrays(arrays, schema=schema)
+                writer.write_table(batch)
+                count += batch.num_rows
+
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return count
+
+
+def _symbol_ids(symbol_index: SymbolIndex, symbols: List[str]) -> List[int]:
+    symbol_index.insert([x for x in symbols if x not in symbol_index])
+    return [symbol_index[x] for x in symbols]
+
+
+def _account_ids(accounts: List[str]) -> List[int]:
+    return [Account.objects.get_or_create(name=x)[0].id for x in accounts]
+
+
+def import_table(table: str, directory: str, batch_size: int = 50000) -> Tuple[int, DateRange]:
+    """
+    Import a time series exported with export_table, upserting the rows batch by batch with COPY. Symbols that
+    and accounts that do not exist yet are created, partitions of new years as well.
+    :param table: name of the time series (see TABLES)
+    :param directory: root directory of the export
+    :param batch_size: number of rows read and loaded at once
+    :return: number of imported rows and the range of their dates
+    """
+    model, value, keyed, per_account = TABLES[table]
+
+    fields = (['account_id'] if per_account else []) + (['symbol_id'] if keyed else []) + ['date', value]
+    conflict_fields = fields[:-1]
+
+    symbol_index = SymbolIndex()
+    count, first, last = 0, None, None
+
+    for path in sorted(glob.glob(os.path.join(directory, table, 'year=*', '*.parquet'))):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            if batch.num_rows == 0:
+                continue
+
+            dates = batch.column(batch.schema.get_field_index('date')).to_pylist()
+            values = batch.column(batch.schema.get_field_index(value)).to_numpy(zero_copy_only=False).tolist()
+            columns = [dates, values]
+
+            if keyed:
+                columns.insert(0, _dictionary_ids(batch.column(batch.schema.get_field_index('symbol')),
+                                                  lambda x: _symbol_ids(symbol_index, x)))
+
+            if per_account:
+                columns.insert(0, _dictionary_ids(batch.column(batch.schema.get_field_index('account')),
+                                                  _account_ids))
+
+            if isinstance(model.objects, PartitionedManager):
+                model.objects.ensure_partitions({x.year for x in dates})
+
+            model.objects.copy_upsert(zip(*columns), fields=fields, conflict_fields=conflict_fields,
+                                      update_fields=[value])
+
+            count += batch.num_rows
+            first = min(first or datetime.date.max, min(dates))
+            last = max(last or datetime.date.min, max(dates))
+
+    return count, (first, last)
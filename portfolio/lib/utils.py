@@ -1,4 +1,7 @@
+import csv
 import datetime
+import io
+from typing import Iterable, Iterator, Sequence
 
 
 def date_range_gen(start_date: datetime.date, end_date: datetime.date):
@@ -9,3 +12,67 @@ def date_range_gen(start_date: datetime.date, end_date: datetime.date):
     """
     for n in range(int((end_date - start_date).days + 1)):
         yield start_date + datetime.timedelta(n)
+
+
+def csv_lines(rows: Iterable[Sequence]) -> Iterator[str]:
+    """
+    Generator of CSV formatted lines. None values are written as empty fields.
+    :param rows: rows of values
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class IteratorFile(io.TextIOBase):
+    """
+    Read-only file-like object over an iterator of strings, so that generated data can be streamed
+    (e.g. into COPY FROM STDIN) without materializing it first.
+    """
+
+    def __init__(self, lines: Iterator[str]):
+        self._lines = lines
+        self._buffer = ''
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+
+        while size < 0 or length < size:
+            try:
+                line = next(self._lines)
+            except StopIteration:
+                break
+            chunks.append(line)
+            length += len(line)
+
+        data = ''.join(chunks)
+
+        if size < 0:
+            self._buffer = ''
+            return data
+
+        self._buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size: int = -1) -> str:
+        while '\n' not in self._buffer:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+
+        end = self._buffer.find('\n') + 1 or len(self._buffer)
+        if 0 <= size < end:
+            end = size
+
+        line, self._buffer = self._buffer[:end], self._buffer[end:]
+        return line
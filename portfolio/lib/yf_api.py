@@ -5,6 +5,9 @@ import pandas as pd
 import datetime
 from dateutil.relativedelta import relativedelta
 
+from portfolio.lib.price_cache import PriceCache
+from project.settings import PRICE_CACHE
+
 
 class YF:
 
@@ -24,28 +27,57 @@ class YF:
                 raise ve
 
     @staticmethod
-    def get_prices(tickers: list, start: Union[str, datetime.datetime, datetime.date],
-                   end: Union[str, datetime.datetime, datetime.date]) -> pd.DatetimeIndex:
+    def _download(tickers: list, start: str, end: str) -> pd.DataFrame:
         """
-        Get prices for a list of tickers in a time range.
+        Download prices for a list of tickers in a time range from Yahoo finance.
         :param tickers: tickers to get
         :param start: start date
-        :param end: end date
-        :returns: prices of the tickers in the time range
+        :param end: end date (exclusive)
+        :returns: prices with one column per (upper case) ticker
         """
-        start = YF._get_date_string(start)
-        end = YF._get_date_string(end)
-
         tickers = [t.lower() for t in tickers]
         prices = yf.download(tickers=tickers, start=start, end=end, progress=False).loc[:, 'Adj Close']
         prices.index = [x.date() for x in prices.index.to_list()]
 
         # Handle format when only one ticker is fetched
         if len(tickers) == 1:
-            prices.name = tickers[0].upper()
+            prices = prices.to_frame(name=tickers[0].upper())
 
         return prices
 
+    @staticmethod
+    def get_prices(tickers: list, start: Union[str, datetime.datetime, datetime.date],
+                   end: Union[str, datetime.datetime, datetime.date]) -> pd.DataFrame:
+        """
+        Get prices for a list of tickers in a time range. Prices are served from the local price cache, only
+        the (ticker, date range) gaps of the cache are downloaded.
+        :param tickers: tickers to get
+        :param start: start date
+        :param end: end date (exclusive)
+        :returns: prices of the tickers in the time range, one column per ticker
+        """
+        start = YF._get_date_string(start)
+        end = YF._get_date_string(end)
+
+        if not PRICE_CACHE['ENABLED']:
+            return YF._download(tickers, start, end)
+
+        cache = PriceCache(PRICE_CACHE['PATH'], settle_days=PRICE_CACHE['SETTLE_DAYS'])
+
+        tickers = list(dict.fromkeys(t.upper() for t in tickers))
+        start_date = datetime.datetime.strptime(start, "%Y-%m-%d").date()
+        end_date = datetime.datetime.strptime(end, "%Y-%m-%d").date()
+
+        # download the missing ranges, batching tickers with the same gap
+        for (gap_start, gap_end), gap_tickers in cache.group_missing(tickers, start_date, end_date).items():
+            prices = YF._download(gap_tickers, YF._get_date_string(gap_start), YF._get_date_string(gap_end))
+
+            for ticker in gap_tickers:
+                ticker_prices = prices[ticker] if ticker in prices.columns else pd.Series(dtype=float)
+                cache.store(ticker, gap_start, gap_end, ticker_prices)
+
+        return cache.load(tickers, start_date, end_date)
+
     @staticmethod
     def ffill_price_data(df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -0,0 +1,238 @@
+import datetime
+import json
+import subprocess
+
+import numpy as np
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from scipy.stats import norm
+
+from portfolio.lib.aggregation import create_value_series, create_performance_series
+from portfolio.lib.benchmark import synthetic_transactions, synthetic_product_info, synthetic_prices, \
+    synthetic_extraction_data, timeit
+from portfolio.lib.etl import Transformation, Loading
+from portfolio.lib.holdings import build_holdings
+from portfolio.lib.performance_measures import PerformanceMeasures
+from portfolio.models import Account
+from portfolio.views import IndexView
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def _legacy_measure_loop(performance: pd.Series) -> dict:
+    """
+    Baseline of PerformanceMeasures.measure_loop: the former implementation, which calculates every measure
+    separately from the series.
+    """
+    daily_returns = performance.pct_change()
+
+    returns = performance.iloc[-1] / performance.iloc[0] - 1
+    annualized_returns = (performance.iloc[-1] / performance.iloc[0]) ** (252 / len(performance)) - 1
+    std = np.std(daily_returns, ddof=1) * np.sqrt(252)
+
+    var_returns = daily_returns.dropna()
+    var = norm.ppf(0.01, loc=np.mean(var_returns), scale=np.std(var_returns))
+
+    window = len(performance)
+    daily_drawdown = performance / performance.rolling(window, min_periods=1).max() - 1
+    max_drawdown = min(daily_drawdown.rolling(window, min_periods=1).min())
+
+    return {
+        'returns': returns,
+        'annualized_returns': annualized_returns,
+        'std': std,
+        'sharpe': annualized_returns / std,
+        'var': var,
+        'max_drawdown': max_drawdown,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the ETL and dashboard hot paths on a synthetic portfolio. The database benchmarks run ' \
+           'against a throwaway test database.'
+
+    BENCHMARKS = ['holdings', 'measures', 'transformation', 'loading', 'aggregation', 'dashboard']
+
+    # benchmarks that need the (test) database, in the order they depend on each other
+    DATABASE_BENCHMARKS = ['transformation', 'loading', 'aggregation', 'dashboard']
+
+    # steps of the loading stage, in the order of Loading._run
+    LOADING_STEPS = ['_load_account', '_load_transactions', '_load_product_info', '_load_cash_flows',
+                     '_load_symbols', '_load_price_data', '_load_portfolios', '_load_daily_values',
+                     '_load_metrics_state', '_load_watermarks']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._results = {}
+        self._transformation_data = None
+        self._loaded = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=5, help='Years of history')
+        parser.add_argument('--symbols', type=int, default=50, help='Number of distinct symbols')
+        parser.add_argument('--trades', type=int, default=5000, help='Number of transactions')
+        parser.add_argument('--repeat', type=int, default=5, help='Repetitions per benchmark')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the generator')
+        parser.add_argument('--only', nargs='+', choices=self.BENCHMARKS, default=self.BENCHMARKS,
+                            help='Benchmarks to run')
+        parser.add_argument('--output', help='Save the results as JSON to this file, e.g. to compare commits')
+
+    def _report(self, name: str, timing: dict):
+        self._results[name] = timing
+        self.stdout.write('{}: min {min:.4f}s, mean {mean:.4f}s, max {max:.4f}s'.format(name, **timing))
+
+    def _transformation(self, options: dict) -> Transformation:
+        extraction_data = synthetic_extraction_data(options['years'], options['symbols'], options['trades'],
+                                                    Account.DEFAULT, options['seed'])
+        return Transformation(extraction_data)
+
+    def _load(self, options: dict):
+        """
+        Load the synthetic portfolio into the test database, unless the loading benchmark already did.
+        """
+        if self._loaded:
+            return
+
+        if self._transformation_data is None:
+            transformation = self._transformation(options)
+            transformation.run()
+            self._transformation_data = transformation.data
+
+        Loading(self._transformation_data).run()
+        self._loaded = True
+
+    def _benchmark_holdings(self, options: dict):
+        transactions = synthetic_transactions(options['years'], options['symbols'], options['trades'], options['seed'])
+        product_info = synthetic_product_info(options['symbols'])
+
+        from_date = datetime.date.today() - datetime.timedelta(days=365 * options['years'])
+        to_date = datetime.date.today()
+
+        def holdings():
+            build_holdings(
+                dates=[t['date'] for t in transactions],
+                symbols=[product_info[t['productId']]['symbol'] for t in transactions],
+                quantities=[t['quantity'] for t in transactions],
+                start_portfolio={},
+                from_date=from_date,
+                to_date=to_date
+            )
+
+        self._report('build_holdings', timeit(holdings, repeat=options['repeat']))
+
+    def _benchmark_measures(self, options: dict):
+        prices = synthetic_prices(options['years'], options['symbols'], options['seed'])
+        prices.index = pd.to_datetime(prices.index)
+        series = prices.iloc[:, 0]
+
+        legacy = _legacy_measure_loop(series)
+        current = PerformanceMeasures.measure_loop(series)
+        assert all(np.isclose(legacy[key], current[key]) for key in PerformanceMeasures.MEASURES)
+
+        self._report('measure_loop (legacy)', timeit(lambda: _legacy_measure_loop(series), repeat=options['repeat']))
+        self._report('measure_loop', timeit(lambda: PerformanceMeasures.measure_loop(series),
+                                            repeat=options['repeat']))
+
+        # all symbols at once
+        self._report(f'measure_loop (legacy) x {prices.shape[1]}',
+                     timeit(lambda: [_legacy_measure_loop(prices[c]) for c in prices.columns],
+                            repeat=options['repeat']))
+        self._report(f'measure_matrix x {prices.shape[1]}',
+                     timeit(lambda: PerformanceMeasures.measure_matrix(prices.to_numpy()), repeat=options['repeat']))
+
+    def _benchmark_transformation(self, options: dict):
+        transformation = self._transformation(options)
+        transformation._transform_transactions()
+        transformation._transform_product_info()
+        transformation._transform_cash_flows()
+
+        self._report('Transformation._build_portfolio', timeit(transformation._build_portfolio,
+                                                               repeat=options['repeat']))
+        self._report('Transformation._transform_price_data', timeit(transformation._transform_price_data,
+                                                                    repeat=options['repeat']))
+
+        transformation._transform_symbols()
+        self._transformation_data = transformation.data
+
+    def _benchmark_loading(self, options: dict):
+        if self._transformation_data is None:
+            transformation = self._transformation(options)
+            transformation.run()
+            self._transformation_data = transformation.data
+
+        # the first repetition loads into empty tables, the others replace the loaded rows like a rerun
+        loading = Loading(self._transformation_data)
+        for step in self.LOADING_STEPS:
+            self._report(f'Loading.{step}', timeit(getattr(loading, step), repeat=options['repeat']))
+
+        self._loaded = True
+
+    def _benchmark_aggregation(self, options: dict):
+        self._load(options)
+
+        def performance_series():
+            cache.clear()
+            create_performance_series(Account.DEFAULT)
+
+        self._report('create_value_series', timeit(lambda: create_value_series(Account.DEFAULT),
+                                                   repeat=options['repeat']))
+        self._report('create_performance_series', timeit(performance_series, repeat=options['repeat']))
+
+    def _benchmark_dashboard(self, options: dict):
+        self._load(options)
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_user('benchmark')
+        view = IndexView.as_view()
+
+        def render():
+            cache.clear()
+            view(request)
+
+        self._report('IndexView', timeit(render, repeat=options['repeat']))
+        self._report('IndexView (cached)', timeit(lambda: view(request), repeat=options['repeat']))
+
+    @staticmethod
+    def _commit():
+        """
+        Return the current git commit, if available.
+        """
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def handle(self, *args, **options):
+        for name in options['only']:
+            if name not in self.DATABASE_BENCHMARKS:
+                getattr(self, f'_benchmark_{name}')(options)
+
+        database_benchmarks = [x for x in self.DATABASE_BENCHMARKS if x in options['only']]
+
+        if database_benchmarks:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+            try:
+                with override_settings(CACHES=LOCMEM_CACHE):
+                    for name in database_benchmarks:
+                        getattr(self, f'_benchmark_{name}')(options)
+
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'commit': self._commit(),
+                    'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'options': {key: options[key] for key in ['years', 'symbols', 'trades', 'repeat', 'seed']},
+                    'results': self._results,
+                }, f, indent=2)
+
+            self.stdout.write(f'Results saved to {options["output"]}')
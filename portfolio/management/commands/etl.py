@@ -1,19 +1,46 @@
-from django.core.management.base import BaseCommand
-from portfolio.lib.etl import Extraction, Transformation, Loading
+from django.core.management.base import BaseCommand, CommandError
+from portfolio.lib.etl import run_accounts
+from project.logger import profile_steps
+from project.settings import DEGIRO
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument('--account', action='append', dest='accounts', choices=list(DEGIRO['ACCOUNTS']),
+                            help='Account to run the ETL process for (repeatable, defaults to all configured '
+                                 'accounts)')
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Number of accounts run concurrently in separate processes')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of concurrent extraction steps (1 extracts serially)')
+        parser.add_argument('--resume', action='store_true',
+                            help='Resume the latest unfinished run, skipping its completed stages')
+        parser.add_argument('--profile', action='store_true',
+                            help='Print wall time, CPU time, peak memory, SQL queries and HTTP requests per step. '
+                                 'Accounts are run in this process and extracted serially unless --workers is '
+                                 'given.')
+        parser.add_argument('--profile-dir', default=None,
+                            help='Dump the cProfile statistics of every stage to this directory (implies '
+                                 '--profile)')
+
     def handle(self, *args, **kwargs):
 
-        extraction = Extraction()
-        extraction.run()
-        extraction_data = extraction.data
+        accounts = kwargs['accounts'] or list(DEGIRO['ACCOUNTS'])
+
+        if not (kwargs['profile'] or kwargs['profile_dir']):
+            failures = run_accounts(accounts, processes=kwargs['processes'], resume=kwargs['resume'],
+                                    max_workers=kwargs['workers'])
 
-        transformation = Transformation(extraction_data)
-        transformation.run()
-        transformation_data = transformation.data
+        else:
+            # steps are only profiled in this process, and concurrent steps would distort each other's figures
+            workers = kwargs['workers'] if kwargs['workers'] is not None else 1
 
-        loading = Loading(transformation_data)
-        loading.run()
+            with profile_steps(kwargs['profile_dir']) as profiler:
+                try:
+                    failures = run_accounts(accounts, processes=1, resume=kwargs['resume'], max_workers=workers)
+                finally:
+                    self.stdout.write(profiler.summary())
 
+        if failures:
+            raise CommandError('ETL failed for accounts: ' + ', '.join(sorted(failures)))
@@ -0,0 +1,31 @@
+import os
+import shutil
+
+from django.core.management.base import BaseCommand, CommandError
+
+from portfolio.lib.timeseries_io import TABLES, export_table
+
+
+class Command(BaseCommand):
+    help = 'Export the price, holdings (depot) and cashflow history as Parquet, partitioned by year'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Root directory of the export')
+        parser.add_argument('--tables', nargs='+', choices=list(TABLES), default=list(TABLES),
+                            help='Time series to export')
+        parser.add_argument('--chunk-size', type=int, default=50000,
+                            help='Number of rows fetched from the database and written at once')
+        parser.add_argument('--overwrite', action='store_true', help='Replace existing exports of the tables')
+
+    def handle(self, *args, **kwargs):
+
+        for table in kwargs['tables']:
+            path = os.path.join(kwargs['directory'], table)
+
+            if os.path.exists(path):
+                if not kwargs['overwrite']:
+                    raise CommandError(f'{path} already exists, use --overwrite to replace it.')
+                shutil.rmtree(path)
+
+            count = export_table(table, kwargs['directory'], chunk_size=kwargs['chunk_size'])
+            self.stdout.write(f'{table}: {count} rows exported')
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic
+
+from portfolio.lib.cache import bump_data_version
+from portfolio.lib.streaming_measures import update_metrics_state
+from portfolio.lib.timeseries_io import TABLES, import_table
+from portfolio.models import Account, DailyValue
+
+
+class Command(BaseCommand):
+    help = 'Import price, holdings (depot) and cashflow history exported with export_timeseries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Root directory of the export')
+        parser.add_argument('--tables', nargs='+', choices=list(TABLES), default=list(TABLES),
+                            help='Time series to import')
+        parser.add_argument('--batch-size', type=int, default=50000,
+                            help='Number of rows read and loaded at once')
+
+    def handle(self, *args, **kwargs):
+
+        with atomic():
+            date_ranges = {}
+            for table in kwargs['tables']:
+                count, date_ranges[table] = import_table(table, kwargs['directory'], batch_size=kwargs['batch_size'])
+                self.stdout.write(f'{table}: {count} rows imported')
+
+            # refresh the data derived from the imported rows, like the loading stage of the ETL
+            # of every account, since imported prices affect all of them
+            values = [date_ranges[x] for x in ['price', 'depot'] if x in date_ranges and date_ranges[x][0]]
+            first_dates = [x[0] for x in date_ranges.values() if x[0] is not None]
+
+            for account in Account.objects.values_list('name', flat=True):
+                if values:
+                    DailyValue.objects.refresh(account, min(x[0] for x in values), max(x[1] for x in values))
+
+                if first_dates:
+                    update_metrics_state(min(first_dates), account)
+
+        bump_data_version()
@@ -0,0 +1,80 @@
+import datetime
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+FACTS = ['portfolio_depot', 'portfolio_price']
+
+# migration that adds the (nullable) symbol foreign keys to the facts
+SYMBOL_MIGRATION = ('portfolio', '0008_symbol')
+
+
+class Command(BaseCommand):
+    help = 'Migrate the facts from DimensionSymbolDate to Symbol, backfilling the symbols in batches per ' \
+           'partition instead of a single statement per table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-days', type=int, default=31,
+                            help='Number of days backfilled per statement (and transaction)')
+
+    def handle(self, *args, **kwargs):
+
+        if not self._pending(SYMBOL_MIGRATION) and not self._pending(('portfolio', '0009_drop_symbol_date')):
+            self.stdout.write('The symbol dimension has already been migrated.')
+            return
+
+        call_command('migrate', *SYMBOL_MIGRATION)
+
+        for table in FACTS:
+            for partition in self._partitions(table):
+                self._backfill(partition, datetime.timedelta(days=kwargs['batch_days']))
+
+        call_command('migrate', 'portfolio')
+
+    @staticmethod
+    def _pending(migration) -> bool:
+        """
+        Return whether the migration has not been applied yet.
+        """
+        executor = MigrationExecutor(connection)
+        return migration not in executor.loader.applied_migrations
+
+    @staticmethod
+    def _partitions(table: str):
+        """
+        Return the partitions of a table in order of name (and therefore year).
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT child.relname FROM pg_inherits '
+                           'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                           'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                           'WHERE parent.relname = %s ORDER BY child.relname', [table])
+            return [row[0] for row in cursor.fetchall()]
+
+    def _backfill(self, partition: str, batch: datetime.timedelta) -> None:
+        """
+        Backfill the symbol foreign keys of a partition, one date range at a time. Every batch is committed on
+        its own, so the backfill can be interrupted and restarted.
+        """
+        qn = connection.ops.quote_name
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT MIN(date), MAX(date) FROM {qn(partition)} WHERE symbol_id IS NULL')
+            start, end = cursor.fetchone()
+
+            if start is None:
+                return
+
+            while start <= end:
+                cursor.execute(
+                    f'UPDATE {qn(partition)} fact SET symbol_id = s.id '
+                    f'FROM portfolio_dimensionsymboldate d JOIN portfolio_symbol s ON s.symbol = d.symbol '
+                    f'WHERE fact.symbol_date_id = d.id AND fact.symbol_id IS NULL '
+                    f'AND fact.date >= %s AND fact.date < %s',
+                    [start, start + batch]
+                )
+                self.stdout.write(f'{partition}: {cursor.rowcount} rows from {start} backfilled')
+
+                start += batch
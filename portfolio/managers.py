@@ -1,76 +1,311 @@
 import datetime
-from typing import Union
+import io
+from collections import defaultdict
+from typing import Union, Tuple, List, Dict, Any, Iterable, Sequence
 
-from django.db import models
-from django.db.models import QuerySet, F, Sum
+import pandas as pd
+from django.apps import apps
+from django.db import models, transaction, connection
+from django.db.models import QuerySet, F, Sum, Max, Subquery
 
+from portfolio.lib.utils import csv_lines, IteratorFile
 
-class DepotManager(models.Manager):
 
-    def get_latest_portfolio(self) -> QuerySet:
+class BulkUpsertManager(models.Manager):
+
+    # number of rows sent per INSERT statement
+    UPSERT_PAGE_SIZE = 5000
+
+    def _columns(self, fields: Iterable[str]) -> List[str]:
+        """
+        Return the quoted column names of the fields.
+        """
+        return [connection.ops.quote_name(self.model._meta.get_field(f).column) for f in fields]
+
+    def _upsert_clauses(self, fields: Iterable[str], conflict_fields: Iterable[str],
+                        update_fields: Iterable[str]) -> Tuple[str, str, List[str], str]:
+        """
+        Build the parts of an INSERT ... ON CONFLICT statement.
+        :param fields: inserted fields
+        :param conflict_fields: fields of the unique constraint that identifies a row
+        :param update_fields: fields to overwrite on conflict
+        :return: column list, conflict target, quoted update columns and conflict action
+        """
+        updates = self._columns(update_fields)
+
+        if updates:
+            action = 'DO UPDATE SET ' + ', '.join(f'{c} = EXCLUDED.{c}' for c in updates)
+        else:
+            action = 'DO NOTHING'
+
+        return ', '.join(self._columns(fields)), ', '.join(self._columns(conflict_fields)), updates, action
+
+    def bulk_upsert(self, rows: List[Dict[str, Any]], conflict_fields: Iterable[str],
+                    update_fields: Iterable[str] = (), returning: Iterable[str] = ()) -> List[Tuple]:
         """
-        Return the latest portfolio.
+        Insert the rows, updating update_fields of rows that conflict with existing ones on conflict_fields
+        (INSERT ... ON CONFLICT DO UPDATE). Without update_fields, conflicting rows are skipped.
+        :param rows: records keyed by field (attribute) name, all with the same keys
+        :param conflict_fields: fields of the unique constraint that identifies a row
+        :param update_fields: fields to overwrite on conflict
+        :param returning: fields to return for the inserted or updated rows
+        :return: values of the returning fields
         """
-        if not self.exists():
-            return self.none()
+        if len(rows) == 0:
+            return []
 
-        return self.filter(symbol_date__date=self.latest('symbol_date__date').symbol_date.date)
+        opts = self.model._meta
+        qn = connection.ops.quote_name
 
-    def get_portfolio_at_date(self, date: datetime.date) -> QuerySet:
+        fields = [opts.get_field(f) for f in rows[0].keys()]
+        columns, conflict, _, action = self._upsert_clauses(rows[0].keys(), conflict_fields, update_fields)
+
+        if returning:
+            action += ' RETURNING ' + ', '.join(self._columns(returning))
+
+        placeholder = '(' + ', '.join(['%s'] * len(fields)) + ')'
+
+        # rows are locked in the order of the constraint, so that concurrent upserts of the same rows can't deadlock
+        keys = [opts.get_field(f).attname for f in conflict_fields]
+        rows = sorted(rows, key=lambda row: tuple(row[k] for k in keys))
+
+        returned = []
+        with connection.cursor() as cursor:
+            for i in range(0, len(rows), self.UPSERT_PAGE_SIZE):
+                page = rows[i:i + self.UPSERT_PAGE_SIZE]
+                cursor.execute(
+                    f'INSERT INTO {qn(opts.db_table)} ({columns}) VALUES {", ".join([placeholder] * len(page))} '
+                    f'ON CONFLICT ({conflict}) {action}',
+                    [f.get_db_prep_save(row[f.attname], connection) for row in page for f in fields]
+                )
+                if returning:
+                    returned.extend(cursor.fetchall())
+
+        return returned
+
+    def copy_upsert(self, rows: Iterable[Sequence], fields: List[str], conflict_fields: Iterable[str],
+                    update_fields: Iterable[str] = ()) -> None:
         """
-        Return the portfolio on a given date.
+        Fast path of bulk_upsert for large loads: the rows are streamed into a temporary staging table with
+        COPY FROM STDIN and merged into the table from there with a single INSERT ... ON CONFLICT.
+        :param rows: rows of values in the order of fields (may be a generator)
+        :param fields: field (attribute) names of the values
+        :param conflict_fields: fields of the unique constraint that identifies a row
+        :param update_fields: fields to overwrite on conflict
         """
-        if not self.exists():
-            return self.none()
+        model_fields = [self.model._meta.get_field(f) for f in fields]
+        values = ([f.get_db_prep_save(v, connection) for f, v in zip(model_fields, row)] for row in rows)
 
-        return self.filter(symbol_date__date=date).distinct().order_by('symbol_date__symbol')
+        self._copy_merge(IteratorFile(csv_lines(values)), fields, conflict_fields, update_fields)
 
-    def get_latest_date(self) -> Union[datetime.date, None]:
+    def copy_upsert_frame(self, frame: pd.DataFrame, conflict_fields: Iterable[str],
+                          update_fields: Iterable[str] = ()) -> None:
         """
-        Return the date of the latest portfolio.
+        Variant of copy_upsert for typed frames (see portfolio.lib.frames): the frame is written as CSV column by
+        column by pandas instead of preparing every value separately. Dates are written as ISO dates, missing
+        values as NULL.
+        :param frame: frame whose columns are named after the fields (attribute names)
+        :param conflict_fields: fields of the unique constraint that identifies a row
+        :param update_fields: fields to overwrite on conflict
         """
-        if not self.exists():
-            return None
-        return self.latest('symbol_date__date').symbol_date.date
+        if len(frame) == 0:
+            return
+
+        buffer = io.StringIO()
+        frame.to_csv(buffer, header=False, index=False, date_format='%Y-%m-%d')
+        buffer.seek(0)
+
+        self._copy_merge(buffer, list(frame.columns), conflict_fields, update_fields)
+
+    def _copy_merge(self, csv_file, fields: List[str], conflict_fields: Iterable[str],
+                    update_fields: Iterable[str]) -> None:
+        """
+        COPY the CSV rows into a temporary staging table and merge them into the table. Rows equal to the existing
+        ones are skipped, so they are not locked, and the others are merged in the order of the constraint, so that
+        concurrent merges of the same rows can't deadlock.
+        """
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+
+        columns, conflict, updates, action = self._upsert_clauses(fields, conflict_fields, update_fields)
+
+        table = qn(opts.db_table)
+        staging = qn(opts.db_table + '_staging')
+
+        unchanged = ' AND '.join(
+            [f't.{c} = s.{c}' for c in self._columns(conflict_fields)]
+            + [f't.{c} IS NOT DISTINCT FROM s.{c}' for c in updates]
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {staging}')
+            cursor.execute(f'CREATE TEMPORARY TABLE {staging} AS SELECT {columns} FROM {table} WITH NO DATA')
+
+            cursor.cursor.copy_expert(f'COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)', csv_file)
+
+            cursor.execute(f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} AS s '
+                           f'WHERE NOT EXISTS (SELECT FROM {table} AS t WHERE {unchanged}) '
+                           f'ORDER BY {conflict} ON CONFLICT ({conflict}) {action}')
+            cursor.execute(f'DROP TABLE {staging}')
+
+
+class PartitionedManager(BulkUpsertManager):
+    """
+    Manager of a fact table that is range partitioned by year on its (denormalised) date column. There is no
+    default partition, so the partitions have to be created with ensure_partitions before rows of a new year
+    are inserted.
+    """
+
+    def partition_name(self, year: int) -> str:
+        """
+        Return the name of the partition holding the rows of the year.
+        """
+        return f'{self.model._meta.db_table}_y{year}'
+
+    def ensure_partitions(self, years: Iterable[int]) -> None:
+        """
+        Create the partitions of the given years if they do not exist yet. Existing partitions are looked up
+        first, so that no DDL is run (and no lock on the table is taken) if all of them exist.
+        :param years: years of the rows about to be inserted
+        """
+        qn = connection.ops.quote_name
+
+        with connection.cursor() as cursor:
+            for year in sorted(set(years)):
+                cursor.execute('SELECT to_regclass(%s)', [self.partition_name(year)])
+                if cursor.fetchone()[0] is not None:
+                    continue
+
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {qn(self.partition_name(year))} '
+                    f'PARTITION OF {qn(self.model._meta.db_table)} FOR VALUES FROM (%s) TO (%s)',
+                    [datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)]
+                )
+
+    def detach_partition(self, year: int) -> None:
+        """
+        Detach the partition of the year. Its rows are no longer visible through the model, while the detached
+        table is kept, so that it can be archived (or dropped) independently.
+        :param year: year of the partition
+        """
+        qn = connection.ops.quote_name
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {qn(self.model._meta.db_table)} '
+                           f'DETACH PARTITION {qn(self.partition_name(year))}')
+
+
+class DepotManager(PartitionedManager):
+
+    def get_latest_portfolio(self, account: str) -> QuerySet:
+        """
+        Return the latest portfolio of the account. The latest date is resolved in a subquery, so this is a single
+        statement.
+        """
+        latest_date = self.filter(account__name=account).order_by('-date').values('date')[:1]
+
+        return self.filter(account__name=account, date=Subquery(latest_date))
+
+    def get_portfolio_at_date(self, date: datetime.date, account: str) -> QuerySet:
+        """
+        Return the portfolio of the account on a given date.
+        """
+        return self.filter(account__name=account, date=date).order_by('symbol__symbol')
 
-    def with_prices(self) -> QuerySet:
+    def get_latest_date(self, account: str) -> Union[datetime.date, None]:
         """
-        Return the Depot objects with prices.
+        Return the date of the latest portfolio of the account.
         """
-        if not self.exists():
-            return self.none()
+        return self.filter(account__name=account).aggregate(latest=Max('date'))['latest']
 
-        return self.annotate(symbol=F('symbol_date__symbol'),
-                             date=F('symbol_date__date'),
-                             price=F('symbol_date__price__price')).values('symbol', 'date', 'pieces', 'price')
+    def with_prices(self, account: str) -> QuerySet:
+        """
+        Return the Depot objects of the account annotated with the price of their symbol on their date.
+        """
+        return self.filter(account__name=account).annotate(price=F('daily_price__price'))
 
-    def value_per_date(self) -> QuerySet:
+    def value_per_date(self, account: str) -> QuerySet:
         """
-        Return the Depot value per date in order of date.
+        Return the Depot value of the account per date in order of date.
         """
-        if not self.exists():
-            return self.none()
+        return self.with_prices(account).values('date').annotate(total=Sum(F('pieces') * F('price')))\
+            .order_by('date')
+
 
-        return self.with_prices().annotate(subtotal=F('pieces') * F('price')).values('date')\
-            .annotate(total=Sum('subtotal')).order_by('date')
+class SymbolManager(BulkUpsertManager):
 
+    def get_existing(self, symbols):
+        return self.filter(symbol__in=set(symbols)).values_list('id', 'symbol')
 
-class DimensionSymbolDateManager(models.Manager):
-    def get_existing(self, dates, symbols):
-        if not self.exists() or len(dates) == 0 or len(symbols) == 0:
-            return self.none()
 
-        return self.filter(
-            date__gte=min(dates),
-            date__lte=max(dates),
-            symbol__in=symbols
-        ).values_list('id', 'symbol', 'date')
+class DailyValueManager(models.Manager):
 
+    def value_per_date(self, account: str) -> QuerySet:
+        """
+        Return the materialized Depot value of the account per date in order of date.
+        """
+        return self.filter(account__name=account).values('date', 'total').order_by('date')
+
+    def refresh(self, account: str, from_date: datetime.date, to_date: datetime.date) -> None:
+        """
+        Recompute the daily values of the account between from_date and to_date (inclusive) from the Depot and
+        Price tables. Only the given date range is aggregated, so the ETL only pays for the newly loaded days.
+        :param account: name of the account
+        :param from_date: first date to recompute
+        :param to_date: last date to recompute
+        """
+        Account = apps.get_model('portfolio', 'Account')
+        Depot = apps.get_model('portfolio', 'Depot')
 
-class CashflowManager(models.Manager):
+        account_id = Account.objects.values_list('id', flat=True).get(name=account)
 
-    def get_existing(self, dates):
-        if not self.exists():
-            return self.none()
+        rows = Depot.objects.with_prices(account).filter(date__gte=from_date, date__lte=to_date)\
+            .annotate(subtotal=F('pieces') * F('price')).values_list('date', 'symbol__symbol', 'subtotal')
+
+        # group contributions by date
+        contributions = defaultdict(dict)
+        for date, symbol, subtotal in rows:
+            if subtotal is not None:
+                contributions[date][symbol] = contributions[date].get(symbol, 0) + subtotal
+
+        daily_values = [self.model(account_id=account_id, date=date, total=sum(values.values()), contributions=values)
+                        for date, values in contributions.items()]
+
+        with transaction.atomic():
+            self.filter(account_id=account_id, date__gte=from_date, date__lte=to_date).delete()
+            self.bulk_create(daily_values)
+
+
+class EtlRunManager(models.Manager):
+
+    def get_resumable(self, account: str):
+        """
+        Return the latest run of the account if it did not finish successfully, else None.
+        """
+        run = self.filter(account__name=account).order_by('-started').first()
+
+        if run is None or run.status == run.SUCCESS:
+            return None
+
+        return run
+
+
+class WatermarkManager(BulkUpsertManager):
+
+    def get_dates(self, account: str) -> Dict[str, datetime.date]:
+        """
+        Return the high-water mark date per source of the account.
+        """
+        return dict(self.filter(account__name=account).values_list('source', 'date'))
+
+    def advance(self, account: str, dates: Dict[str, datetime.date]) -> None:
+        """
+        Set the high-water marks of the given sources of the account.
+        :param account: name of the account
+        :param dates: date per source
+        """
+        Account = apps.get_model('portfolio', 'Account')
+        account_id = Account.objects.values_list('id', flat=True).get(name=account)
 
-        return self.filter(date__in=dates).values('date', 'cashflow')
+        self.bulk_upsert([{'account_id': account_id, 'source': source, 'date': date} for source, date in dates.items()],
+                         conflict_fields=['account', 'source'], update_fields=['date'])
@@ -0,0 +1,48 @@
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_daily_values(apps, schema_editor):
+    """
+    Materialize the daily values for the already loaded Depot history.
+    """
+    Depot = apps.get_model('portfolio', 'Depot')
+    DailyValue = apps.get_model('portfolio', 'DailyValue')
+
+    rows = Depot.objects.annotate(
+        date=F('symbol_date__date'),
+        symbol=F('symbol_date__symbol'),
+        subtotal=F('pieces') * F('symbol_date__price__price')
+    ).values_list('date', 'symbol', 'subtotal')
+
+    contributions = defaultdict(dict)
+    for date, symbol, subtotal in rows:
+        if subtotal is not None:
+            contributions[date][symbol] = contributions[date].get(symbol, 0) + subtotal
+
+    DailyValue.objects.bulk_create([
+        DailyValue(date=date, total=sum(values.values()), contributions=values)
+        for date, values in contributions.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyValue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='Date')),
+                ('total', models.FloatField(verbose_name='Total value of the depot on the date')),
+                ('contributions', models.JSONField(default=dict, verbose_name='Value per symbol on the date')),
+            ],
+        ),
+        migrations.RunPython(backfill_daily_values, migrations.RunPython.noop),
+    ]
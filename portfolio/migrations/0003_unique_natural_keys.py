@@ -0,0 +1,54 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0002_dailyvalue'),
+    ]
+
+    operations = [
+        # remove duplicates of earlier reruns, keeping the most recently loaded row
+        migrations.RunSQL(
+            'DELETE FROM portfolio_depot a USING portfolio_depot b '
+            'WHERE a.symbol_date_id = b.symbol_date_id AND a.id < b.id',
+            migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(
+            'DELETE FROM portfolio_price a USING portfolio_price b '
+            'WHERE a.symbol_date_id = b.symbol_date_id AND a.id < b.id',
+            migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(
+            'DELETE FROM portfolio_asset a USING portfolio_asset b '
+            'WHERE a."productId" = b."productId" AND a.id < b.id',
+            migrations.RunSQL.noop
+        ),
+        migrations.AddConstraint(
+            model_name='depot',
+            constraint=models.UniqueConstraint(fields=('symbol_date',), name='unique_depot_symbol_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='price',
+            constraint=models.UniqueConstraint(fields=('symbol_date',), name='unique_price_symbol_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='asset',
+            constraint=models.UniqueConstraint(fields=('productId',), name='unique_asset_product'),
+        ),
+        # rematerialize the daily values without the duplicates
+        migrations.RunSQL(
+            [
+                'DELETE FROM portfolio_dailyvalue',
+                'INSERT INTO portfolio_dailyvalue (date, total, contributions) '
+                'SELECT date, SUM(subtotal), json_object_agg(symbol, subtotal)::jsonb FROM ('
+                '    SELECT d.date, d.symbol, SUM(depot.pieces * price.price) AS subtotal '
+                '    FROM portfolio_depot depot '
+                '    JOIN portfolio_dimensionsymboldate d ON depot.symbol_date_id = d.id '
+                '    JOIN portfolio_price price ON price.symbol_date_id = d.id '
+                '    GROUP BY d.date, d.symbol'
+                ') subtotals GROUP BY date',
+            ],
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0003_unique_natural_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EtlRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(auto_now_add=True, verbose_name='Start of the run')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='End of the run')),
+                ('stage', models.CharField(blank=True, default='', max_length=32, verbose_name='Last completed stage')),
+                ('status', models.CharField(choices=[('running', 'Running'), ('failed', 'Failed'), ('success', 'Success')], default='running', max_length=16, verbose_name='Status')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=32, unique=True, verbose_name='Extracted data source')),
+                ('date', models.DateField(verbose_name='Date up to which the source has been loaded')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0004_etlrun_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricsState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('portfolio', models.CharField(default='default', max_length=32, unique=True, verbose_name='Portfolio')),
+                ('sealed_date', models.DateField(blank=True, null=True, verbose_name='Last date included in the statistics')),
+                ('count', models.IntegerField(default=0, verbose_name='Number of values')),
+                ('first_value', models.FloatField(blank=True, null=True, verbose_name='First value')),
+                ('last_value', models.FloatField(blank=True, null=True, verbose_name='Last value')),
+                ('return_count', models.IntegerField(default=0, verbose_name='Number of daily returns')),
+                ('return_sum', models.FloatField(default=0, verbose_name='Sum of the daily returns')),
+                ('return_sum_sq', models.FloatField(default=0, verbose_name='Sum of the squared daily returns')),
+                ('peak', models.FloatField(blank=True, null=True, verbose_name='Running maximum')),
+                ('max_drawdown', models.FloatField(default=0, verbose_name='Running maximum drawdown')),
+                ('tail_date', models.DateField(blank=True, null=True, verbose_name='Date of the provisional last value')),
+                ('tail_value', models.FloatField(blank=True, null=True, verbose_name='Provisional last value')),
+            ],
+        ),
+    ]
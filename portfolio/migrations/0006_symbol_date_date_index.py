@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0005_metricsstate'),
+    ]
+
+    operations = [
+        # lookups by date (latest portfolio, portfolio at date, date ranges); the unique constraint on
+        # (symbol, date) only serves lookups by symbol, the Depot lookups by symbol_date are served by the
+        # unique constraint on Depot.symbol_date
+        migrations.AddIndex(
+            model_name='dimensionsymboldate',
+            index=models.Index(fields=['date', 'symbol'], name='symbol_date_date_symbol'),
+        ),
+    ]
@@ -0,0 +1,136 @@
+from django.db import migrations, models
+
+FACTS = [
+    # table, value column, unique constraint
+    ('portfolio_depot', 'pieces', 'unique_depot_symbol_date'),
+    ('portfolio_price', 'price', 'unique_price_symbol_date'),
+]
+
+
+def _create_table(table, value_column, unique, partitioned):
+    """
+    Create the fact table, either range partitioned by year on date (date then has to be part of the primary
+    key and of the unique constraint) or as a plain table.
+    """
+    if partitioned:
+        keys = f'PRIMARY KEY (id, date), CONSTRAINT {unique} UNIQUE (symbol_date_id, date)'
+        partitioning = ' PARTITION BY RANGE (date)'
+    else:
+        keys = f'PRIMARY KEY (id), CONSTRAINT {unique} UNIQUE (symbol_date_id)'
+        partitioning = ''
+
+    return (
+        f'CREATE TABLE {table} ('
+        f'    id integer NOT NULL DEFAULT nextval(\'{table}_id_seq\'::regclass), '
+        f'    {value_column} double precision NOT NULL, '
+        f'    symbol_date_id integer NOT NULL, '
+        f'    date date NOT NULL, '
+        f'    {keys}, '
+        f'    CONSTRAINT {table}_symbol_date_id_fk FOREIGN KEY (symbol_date_id) '
+        f'        REFERENCES portfolio_dimensionsymboldate (id) DEFERRABLE INITIALLY DEFERRED'
+        f'){partitioning}'
+    )
+
+
+def _swap_table(table, value_column, unique, partitioned):
+    """
+    Replace the fact table by a (non-)partitioned copy. The ID sequence is handed over to the new table.
+    """
+    old = f'{table}_old'
+    columns = f'id, {value_column}, symbol_date_id, date'
+
+    statements = [
+        f'ALTER TABLE {table} RENAME TO {old}',
+        f'ALTER INDEX {table}_pkey RENAME TO {old}_pkey',
+        f'ALTER TABLE {old} DROP CONSTRAINT {unique}',
+        _create_table(table, value_column, unique, partitioned),
+        f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id',
+    ]
+
+    if partitioned:
+        # one partition per year of the existing rows, later years are created by the ETL
+        statements.append(
+            f'DO $$ DECLARE y integer; BEGIN '
+            f'FOR y IN SELECT DISTINCT extract(year FROM date)::integer FROM {old} LOOP '
+            f'    EXECUTE format(\'CREATE TABLE %I PARTITION OF {table} FOR VALUES FROM (%L) TO (%L)\', '
+            f'        \'{table}_y\' || y, make_date(y, 1, 1), make_date(y + 1, 1, 1)); '
+            f'END LOOP; END $$'
+        )
+
+    statements += [
+        f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}',
+        f'DROP TABLE {old}',
+    ]
+
+    return statements
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0006_symbol_date_date_index'),
+    ]
+
+    operations = [
+        # denormalise the date onto the facts
+        migrations.AddField(
+            model_name='depot',
+            name='date',
+            field=models.DateField(null=True, verbose_name='Date of the symbol_date (partition key)'),
+        ),
+        migrations.AddField(
+            model_name='price',
+            name='date',
+            field=models.DateField(null=True, verbose_name='Date of the symbol_date (partition key)'),
+        ),
+        migrations.RunSQL(
+            [
+                f'UPDATE {table} fact SET date = d.date FROM portfolio_dimensionsymboldate d '
+                f'WHERE fact.symbol_date_id = d.id'
+                for table, _, _ in FACTS
+            ],
+            migrations.RunSQL.noop
+        ),
+        # range partition the facts by year
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='depot',
+                    name='date',
+                    field=models.DateField(verbose_name='Date of the symbol_date (partition key)'),
+                ),
+                migrations.AlterField(
+                    model_name='price',
+                    name='date',
+                    field=models.DateField(verbose_name='Date of the symbol_date (partition key)'),
+                ),
+                migrations.RemoveConstraint(
+                    model_name='depot',
+                    name='unique_depot_symbol_date',
+                ),
+                migrations.RemoveConstraint(
+                    model_name='price',
+                    name='unique_price_symbol_date',
+                ),
+                migrations.AddConstraint(
+                    model_name='depot',
+                    constraint=models.UniqueConstraint(fields=('symbol_date', 'date'),
+                                                       name='unique_depot_symbol_date'),
+                ),
+                migrations.AddConstraint(
+                    model_name='price',
+                    constraint=models.UniqueConstraint(fields=('symbol_date', 'date'),
+                                                       name='unique_price_symbol_date'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(_swap_table(table, value_column, unique, partitioned=True),
+                                  _swap_table(table, value_column, unique, partitioned=False))
+                for table, value_column, unique in FACTS
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='depot',
+            index=models.Index(fields=['date', 'symbol_date'], name='depot_date_symbol_date'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    """
+    First step of the migration from DimensionSymbolDate to Symbol: create the symbols and a nullable symbol
+    foreign key on the facts. The foreign keys are backfilled by migrate_symbol_dimension in batches (or by
+    0009 in a single statement).
+    """
+
+    dependencies = [
+        ('portfolio', '0007_partition_facts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Symbol',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(max_length=100, unique=True, verbose_name='Stock market symbol')),
+            ],
+        ),
+        migrations.RunSQL(
+            'INSERT INTO portfolio_symbol (symbol) SELECT DISTINCT symbol FROM portfolio_dimensionsymboldate '
+            'ON CONFLICT (symbol) DO NOTHING',
+            migrations.RunSQL.noop
+        ),
+        migrations.AddField(
+            model_name='depot',
+            name='symbol',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    to='portfolio.symbol'),
+        ),
+        migrations.AddField(
+            model_name='price',
+            name='symbol',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    to='portfolio.symbol'),
+        ),
+    ]
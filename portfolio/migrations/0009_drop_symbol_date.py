@@ -0,0 +1,121 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+FACTS = ['portfolio_depot', 'portfolio_price']
+
+
+class Migration(migrations.Migration):
+    """
+    Second step of the migration from DimensionSymbolDate to Symbol: key the facts by (symbol, date) and drop
+    the dimension.
+    """
+
+    dependencies = [
+        ('portfolio', '0008_symbol'),
+    ]
+
+    operations = [
+        # backfill the symbols of the facts that have not been backfilled by migrate_symbol_dimension yet
+        migrations.RunSQL(
+            [
+                f'UPDATE {table} fact SET symbol_id = s.id '
+                f'FROM portfolio_dimensionsymboldate d JOIN portfolio_symbol s ON s.symbol = d.symbol '
+                f'WHERE fact.symbol_date_id = d.id AND fact.symbol_id IS NULL'
+                for table in FACTS
+            ],
+            migrations.RunSQL.noop
+        ),
+        migrations.RemoveConstraint(
+            model_name='depot',
+            name='unique_depot_symbol_date',
+        ),
+        migrations.RemoveConstraint(
+            model_name='price',
+            name='unique_price_symbol_date',
+        ),
+        migrations.RemoveIndex(
+            model_name='depot',
+            name='depot_date_symbol_date',
+        ),
+        migrations.AlterField(
+            model_name='depot',
+            name='symbol_date',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    to='portfolio.dimensionsymboldate'),
+        ),
+        migrations.AlterField(
+            model_name='price',
+            name='symbol_date',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE,
+                                    to='portfolio.dimensionsymboldate'),
+        ),
+        # when migrating backwards, restore the dimension rows and the foreign keys to them
+        migrations.RunSQL(
+            migrations.RunSQL.noop,
+            [
+                'INSERT INTO portfolio_dimensionsymboldate (symbol, date) '
+                'SELECT s.symbol, fact.date FROM portfolio_depot fact JOIN portfolio_symbol s ON s.id = fact.symbol_id '
+                'UNION '
+                'SELECT s.symbol, fact.date FROM portfolio_price fact JOIN portfolio_symbol s ON s.id = fact.symbol_id '
+                'ON CONFLICT (symbol, date) DO NOTHING',
+                *[
+                    f'UPDATE {table} fact SET symbol_date_id = d.id '
+                    f'FROM portfolio_dimensionsymboldate d JOIN portfolio_symbol s ON s.symbol = d.symbol '
+                    f'WHERE fact.symbol_id = s.id AND fact.date = d.date'
+                    for table in FACTS
+                ],
+            ]
+        ),
+        migrations.RemoveField(
+            model_name='depot',
+            name='symbol_date',
+        ),
+        migrations.RemoveField(
+            model_name='price',
+            name='symbol_date',
+        ),
+        migrations.DeleteModel(
+            name='DimensionSymbolDate',
+        ),
+        migrations.AlterField(
+            model_name='depot',
+            name='symbol',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE,
+                                    to='portfolio.symbol'),
+        ),
+        migrations.AlterField(
+            model_name='price',
+            name='symbol',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE,
+                                    to='portfolio.symbol'),
+        ),
+        migrations.AlterField(
+            model_name='depot',
+            name='date',
+            field=models.DateField(verbose_name='Date (partition key)'),
+        ),
+        migrations.AlterField(
+            model_name='price',
+            name='date',
+            field=models.DateField(verbose_name='Date (partition key)'),
+        ),
+        migrations.AddConstraint(
+            model_name='depot',
+            constraint=models.UniqueConstraint(fields=('symbol', 'date'), name='unique_depot_symbol_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='price',
+            constraint=models.UniqueConstraint(fields=('symbol', 'date'), name='unique_price_symbol_date'),
+        ),
+        migrations.AddIndex(
+            model_name='depot',
+            index=models.Index(fields=['date', 'symbol'], name='depot_date_symbol'),
+        ),
+        migrations.AddField(
+            model_name='depot',
+            name='daily_price',
+            field=models.ForeignObject(from_fields=('symbol', 'date'), null=True,
+                                       on_delete=django.db.models.deletion.DO_NOTHING, related_name='+',
+                                       to='portfolio.price', to_fields=('symbol', 'date')),
+        ),
+    ]
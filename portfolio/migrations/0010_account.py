@@ -0,0 +1,129 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+# account scoped tables and whether their account foreign key is indexed on its own
+SCOPED = [
+    ('depot', False),
+    ('transaction', True),
+    ('cashflow', False),
+    ('dailyvalue', False),
+    ('etlrun', True),
+    ('watermark', False),
+]
+
+
+def _account_field(model_name, db_index, null):
+    return migrations.AddField(
+        model_name=model_name,
+        name='account',
+        field=models.ForeignKey(db_index=db_index, null=null, on_delete=django.db.models.deletion.CASCADE,
+                                to='portfolio.account'),
+    ) if null else migrations.AlterField(
+        model_name=model_name,
+        name='account',
+        field=models.ForeignKey(db_index=db_index, on_delete=django.db.models.deletion.CASCADE,
+                                to='portfolio.account'),
+    )
+
+
+class Migration(migrations.Migration):
+    """
+    Scope the portfolio data by account. The existing data is assigned to the default account.
+    """
+
+    dependencies = [
+        ('portfolio', '0009_drop_symbol_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Account',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True,
+                                          verbose_name='Account name (key of DEGIRO ACCOUNTS)')),
+            ],
+        ),
+        migrations.RunSQL(
+            "INSERT INTO portfolio_account (name) VALUES ('default')",
+            migrations.RunSQL.noop
+        ),
+        *[_account_field(model_name, db_index, null=True) for model_name, db_index in SCOPED],
+        migrations.RunSQL(
+            [
+                f"UPDATE portfolio_{model_name} SET account_id = "
+                f"(SELECT id FROM portfolio_account WHERE name = 'default')"
+                for model_name, _ in SCOPED
+            ],
+            migrations.RunSQL.noop
+        ),
+        *[_account_field(model_name, db_index, null=False) for model_name, db_index in SCOPED],
+        migrations.AddField(
+            model_name='metricsstate',
+            name='account',
+            field=models.OneToOneField(null=True, on_delete=django.db.models.deletion.CASCADE,
+                                       to='portfolio.account'),
+        ),
+        migrations.RunSQL(
+            [
+                "UPDATE portfolio_metricsstate AS m SET account_id = a.id "
+                "FROM portfolio_account AS a WHERE a.name = m.portfolio",
+                # statistics of unknown accounts are rebuilt by their next ETL run
+                "DELETE FROM portfolio_metricsstate WHERE account_id IS NULL",
+            ],
+            migrations.RunSQL.noop
+        ),
+        migrations.AlterField(
+            model_name='metricsstate',
+            name='account',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='portfolio.account'),
+        ),
+        migrations.RemoveField(
+            model_name='metricsstate',
+            name='portfolio',
+        ),
+        migrations.RemoveConstraint(
+            model_name='depot',
+            name='unique_depot_symbol_date',
+        ),
+        migrations.RemoveIndex(
+            model_name='depot',
+            name='depot_date_symbol',
+        ),
+        migrations.AddConstraint(
+            model_name='depot',
+            constraint=models.UniqueConstraint(fields=('account', 'symbol', 'date'),
+                                               name='unique_depot_account_symbol_date'),
+        ),
+        migrations.AddIndex(
+            model_name='depot',
+            index=models.Index(fields=['account', 'date', 'symbol'], name='depot_account_date_symbol'),
+        ),
+        migrations.AlterField(
+            model_name='cashflow',
+            name='date',
+            field=models.DateField(verbose_name='Date'),
+        ),
+        migrations.AddConstraint(
+            model_name='cashflow',
+            constraint=models.UniqueConstraint(fields=('account', 'date'), name='unique_cashflow_account_date'),
+        ),
+        migrations.AlterField(
+            model_name='dailyvalue',
+            name='date',
+            field=models.DateField(verbose_name='Date'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyvalue',
+            constraint=models.UniqueConstraint(fields=('account', 'date'), name='unique_dailyvalue_account_date'),
+        ),
+        migrations.AlterField(
+            model_name='watermark',
+            name='source',
+            field=models.CharField(max_length=32, verbose_name='Extracted data source'),
+        ),
+        migrations.AddConstraint(
+            model_name='watermark',
+            constraint=models.UniqueConstraint(fields=('account', 'source'), name='unique_watermark_account_source'),
+        ),
+    ]
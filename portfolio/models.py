@@ -1,26 +1,42 @@
 from django.db import models
 
-from portfolio.managers import DepotManager, DimensionSymbolDateManager, CashflowManager
+from portfolio.managers import DepotManager, SymbolManager, DailyValueManager, \
+    BulkUpsertManager, PartitionedManager, EtlRunManager, WatermarkManager
 
 
-class DimensionSymbolDate(models.Model):
-    symbol = models.CharField(max_length=100, verbose_name='Stock market symbol')
-    date = models.DateField(verbose_name='Date')
+class Account(models.Model):
+    DEFAULT = 'default'
 
-    objects = DimensionSymbolDateManager()
+    name = models.CharField(max_length=64, unique=True, verbose_name='Account name (key of DEGIRO ACCOUNTS)')
 
-    class Meta:
-        constraints = [
-            models.UniqueConstraint(fields=['symbol', 'date'], name='unique_symbol_date')
-        ]
+
+class Symbol(models.Model):
+    symbol = models.CharField(max_length=100, unique=True, verbose_name='Stock market symbol')
+
+    objects = SymbolManager()
 
 
 class Depot(models.Model):
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, db_index=False)
     pieces = models.FloatField(verbose_name='Number of pieces of the symbol')
-    symbol_date = models.ForeignKey(DimensionSymbolDate, on_delete=models.CASCADE)
+    symbol = models.ForeignKey(Symbol, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField(verbose_name='Date (partition key)')
+
+    # price of the symbol on the date, joined on (symbol, date) without a column of its own
+    daily_price = models.ForeignObject('Price', on_delete=models.DO_NOTHING, from_fields=['symbol', 'date'],
+                                       to_fields=['symbol', 'date'], null=True, related_name='+')
 
     objects = DepotManager()
 
+    class Meta:
+        # partitioned by year on date, which therefore has to be part of all unique constraints
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'symbol', 'date'], name='unique_depot_account_symbol_date')
+        ]
+        indexes = [
+            models.Index(fields=['account', 'date', 'symbol'], name='depot_account_date_symbol')
+        ]
+
 
 class Asset(models.Model):
     isin = models.CharField(max_length=12, verbose_name='ISIN')
@@ -30,14 +46,31 @@ class Asset(models.Model):
     currency = models.CharField(max_length=3, verbose_name='Asset currency')
     productId = models.CharField(max_length=32, verbose_name='Degiro product ID')
 
+    objects = BulkUpsertManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['productId'], name='unique_asset_product')
+        ]
+
 
 class Price(models.Model):
     price = models.FloatField(default=0, verbose_name='Price of the asset on the date')
-    symbol_date = models.ForeignKey(DimensionSymbolDate, on_delete=models.CASCADE)
+    symbol = models.ForeignKey(Symbol, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField(verbose_name='Date (partition key)')
+
+    objects = PartitionedManager()
+
+    class Meta:
+        # partitioned by year on date, which therefore has to be part of all unique constraints
+        constraints = [
+            models.UniqueConstraint(fields=['symbol', 'date'], name='unique_price_symbol_date')
+        ]
 
 
 class Transaction(models.Model):
     id = models.CharField(max_length=64, primary_key=True, verbose_name='Transaction ID')
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
     productId = models.CharField(max_length=32, verbose_name='Degiro product ID of associated product')
     date = models.DateField(verbose_name='Date')
     buysell = models.CharField(max_length=1, verbose_name='Buy or Sell transaction')
@@ -45,9 +78,83 @@ class Transaction(models.Model):
     quantity = models.FloatField(default=None, blank=True, null=True, verbose_name='Quantity of the underlying asset')
     total = models.FloatField(default=None, blank=True, null=True, verbose_name='Total value of the transaction')
 
+    objects = BulkUpsertManager()
+
 
 class Cashflow(models.Model):
-    date = models.DateField(unique=True, verbose_name='Date')
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField(verbose_name='Date')
     cashflow = models.FloatField(verbose_name='Value of the Cashflow')
 
-    objects = CashflowManager()
\ No newline at end of file
+    objects = BulkUpsertManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'date'], name='unique_cashflow_account_date')
+        ]
+
+
+class DailyValue(models.Model):
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, db_index=False)
+    date = models.DateField(verbose_name='Date')
+    total = models.FloatField(verbose_name='Total value of the depot on the date')
+    contributions = models.JSONField(default=dict, verbose_name='Value per symbol on the date')
+
+    objects = DailyValueManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'date'], name='unique_dailyvalue_account_date')
+        ]
+
+
+class EtlRun(models.Model):
+    STAGES = ['extraction', 'transformation', 'loading']
+
+    RUNNING = 'running'
+    FAILED = 'failed'
+    SUCCESS = 'success'
+    STATUS_CHOICES = [(RUNNING, 'Running'), (FAILED, 'Failed'), (SUCCESS, 'Success')]
+
+    started = models.DateTimeField(auto_now_add=True, verbose_name='Start of the run')
+    finished = models.DateTimeField(null=True, blank=True, verbose_name='End of the run')
+    stage = models.CharField(max_length=32, blank=True, default='', verbose_name='Last completed stage')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=RUNNING, verbose_name='Status')
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+
+    objects = EtlRunManager()
+
+    def completed(self, stage: str) -> bool:
+        """
+        Return whether the given stage has been completed in this run.
+        """
+        return self.stage != '' and self.STAGES.index(self.stage) >= self.STAGES.index(stage)
+
+
+class Watermark(models.Model):
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, db_index=False)
+    source = models.CharField(max_length=32, verbose_name='Extracted data source')
+    date = models.DateField(verbose_name='Date up to which the source has been loaded')
+
+    objects = WatermarkManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'source'], name='unique_watermark_account_source')
+        ]
+
+
+class MetricsState(models.Model):
+    # the statistics are kept per account
+    account = models.OneToOneField(Account, on_delete=models.CASCADE)
+    sealed_date = models.DateField(null=True, blank=True, verbose_name='Last date included in the statistics')
+    count = models.IntegerField(default=0, verbose_name='Number of values')
+    first_value = models.FloatField(null=True, blank=True, verbose_name='First value')
+    last_value = models.FloatField(null=True, blank=True, verbose_name='Last value')
+    return_count = models.IntegerField(default=0, verbose_name='Number of daily returns')
+    return_sum = models.FloatField(default=0, verbose_name='Sum of the daily returns')
+    return_sum_sq = models.FloatField(default=0, verbose_name='Sum of the squared daily returns')
+    peak = models.FloatField(null=True, blank=True, verbose_name='Running maximum')
+    max_drawdown = models.FloatField(default=0, verbose_name='Running maximum drawdown')
+    tail_date = models.DateField(null=True, blank=True, verbose_name='Date of the provisional last value')
+    tail_value = models.FloatField(null=True, blank=True, verbose_name='Provisional last value')
@@ -1,16 +1,19 @@
 $(document).ready(() => {
+    // downsampled series per zoom level, the chart starts with the full history
+    const performanceZoom = JSON.parse(document.getElementById('performance-zoom').textContent);
+
     const config = {
         type: 'line',
         data: {
             datasets: [{
-                data: performanceData,
+                data: performanceZoom['all'].data,
                     fill: false,
                     borderColor: 'rgb(75, 192, 192)',
                     tension: 0.1,
                     borderWidth: 4,
                     pointRadius: 0,
             }],
-            labels: performanceLabels
+            labels: performanceZoom['all'].labels
         },
         options: {
             responsive: true,
@@ -28,4 +31,16 @@ $(document).ready(() => {
 
     const ctx = document.getElementById('performance-chart').getContext('2d');
     window.performanceChart = new Chart(ctx, config);
+
+    // switch between the downsampled series of the zoom levels
+    $('.performance-zoom').click(function () {
+        const zoom = performanceZoom[$(this).data('zoom')];
+
+        $('.performance-zoom').removeClass('active');
+        $(this).addClass('active');
+
+        window.performanceChart.data.labels = zoom.labels;
+        window.performanceChart.data.datasets[0].data = zoom.data;
+        window.performanceChart.update();
+    });
 });
\ No newline at end of file
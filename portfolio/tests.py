@@ -1,3 +1,971 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from pandas.tseries.offsets import BDay
+from rest_framework.test import APIClient
+from scipy.stats import norm
+
+from portfolio.lib.aggregation import compute_performance_series
+from portfolio.lib.cache import bump_data_version
+from portfolio.lib.checkpoint import Checkpoint
+from portfolio.lib.degiro_api import DegiroAPI, RateLimiter
+from portfolio.lib.downsampling import lttb, minmax, downsample
+from portfolio.lib.etl import Pipeline, Transformation, Loading
+from portfolio.lib.frames import PRICES, typed_frame, category_ids
+from portfolio.lib.holdings import build_holdings
+from portfolio.lib.price_cache import PriceCache
+from portfolio.lib.utils import IteratorFile, csv_lines
+from portfolio.lib.performance_measures import PerformanceMeasures, OnlineMeasures, RollingMeasures
+from portfolio.lib.streaming_measures import update_metrics_state, get_metrics
+from portfolio.lib.timeseries_io import export_table, import_table
+
+from portfolio.models import Account, Symbol, Depot, Price, Asset, Cashflow, DailyValue, MetricsState, EtlRun, \
+    Transaction, Watermark
+from portfolio.views import IndexView
+from project.logger import BatchingDatabaseListener, BatchingDatabaseLogHandler
+from project.settings import ETL
+
+LOCMEM_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def extraction_data(from_date: datetime.date, account: str = Account.DEFAULT) -> dict:
+    """
+    Output of the extraction stage from from_date until today: AAPL is bought on from_date and sold the next
+    day, MSFT is bought the next day, and 500 are deposited on from_date.
+    """
+    today = datetime.date.today()
+    days = [from_date + datetime.timedelta(days=i) for i in range((today - from_date).days + 1)]
+
+    return {
+        'account': account,
+        'transactions': [
+            {'id': 1, 'productId': 331868, 'date': f'{days[0]}T10:00:00+01:00', 'buysell': 'B', 'price': 120.0,
+             'quantity': 2, 'total': -240.0},
+            {'id': 2, 'productId': 331868, 'date': f'{days[1]}T10:00:00+01:00', 'buysell': 'S', 'price': 121.0,
+             'quantity': -2, 'total': 242.0},
+            {'id': 3, 'productId': 332111, 'date': f'{days[1]}T11:00:00+01:00', 'buysell': 'B', 'price': 230.0,
+             'quantity': 1, 'total': -230.0},
+        ],
+        'product_info': {
+            '331868': {'id': '331868', 'isin': 'US0378331005', 'symbol': 'AAPL', 'name': 'Apple Inc.',
+                       'productTypeId': 1, 'currency': 'USD'},
+            '332111': {'id': '332111', 'isin': 'US5949181045', 'symbol': 'MSFT', 'name': 'Microsoft Corp.',
+                       'productTypeId': 1, 'currency': 'USD'},
+        },
+        'price_data': pd.DataFrame({'AAPL': 120.0, 'MSFT': 230.0}, index=days),
+        'cash_flows': [{'date': datetime.datetime.combine(days[0], datetime.time(9)), 'type': 'CASH_TRANSACTION',
+                        'description': 'Einzahlung', 'change': 500.0}],
+        'from_date': from_date,
+        'watermarks': {source: today for source in ['transactions', 'cash_flows', 'prices']},
+    }
+
+
+class DepotQueryTestCase(TestCase):
+    """
+    Round-trip budget of the Depot query layer: every query is answered by a single statement.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.latest_date = datetime.date(2021, 3, 2)
+        cls.dates = [datetime.date(2021, 3, 1), cls.latest_date]
+
+        Depot.objects.ensure_partitions([2021])
+        Price.objects.ensure_partitions([2021])
+
+        # created by the migrations
+        account = Account.objects.get(name=Account.DEFAULT)
+        other = Account.objects.create(name='other')
+
+        for symbol, pieces, price in [('AAPL', 2, 120.0), ('MSFT', 1, 230.0)]:
+            symbol = Symbol.objects.create(symbol=symbol)
+            for date in cls.dates:
+                Depot.objects.create(account=account, symbol=symbol, date=date, pieces=pieces)
+                Price.objects.create(symbol=symbol, date=date, price=price)
+
+        # a later portfolio of another account, which must not leak into the default account
+        Depot.objects.create(account=other, symbol=symbol, date=datetime.date(2021, 3, 3), pieces=5)
+
+    def test_get_latest_date(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(Depot.objects.get_latest_date(Account.DEFAULT), self.latest_date)
+
+    def test_get_latest_portfolio(self):
+        with self.assertNumQueries(1):
+            portfolio = list(Depot.objects.get_latest_portfolio(Account.DEFAULT).values_list('date', flat=True))
+
+        self.assertEqual(portfolio, [self.latest_date] * 2)
+
+    def test_get_portfolio_at_date(self):
+        with self.assertNumQueries(1):
+            portfolio = list(Depot.objects.get_portfolio_at_date(self.dates[0], Account.DEFAULT)
+                             .values_list('symbol__symbol', flat=True))
+
+        self.assertEqual(portfolio, ['AAPL', 'MSFT'])
+
+    def test_with_prices(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(Depot.objects.with_prices(Account.DEFAULT))), 4)
+
+    def test_value_per_date(self):
+        with self.assertNumQueries(1):
+            values = list(Depot.objects.value_per_date(Account.DEFAULT))
+
+        self.assertEqual([x['date'] for x in values], self.dates)
+        self.assertEqual([x['total'] for x in values], [470.0, 470.0])
+
+    def test_empty(self):
+        Depot.objects.all().delete()
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(Depot.objects.get_latest_date(Account.DEFAULT))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Depot.objects.get_latest_portfolio(Account.DEFAULT)), [])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(list(Depot.objects.value_per_date(Account.DEFAULT)), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class DashboardQueryTestCase(TestCase):
+    """
+    Round-trip budget of a dashboard request.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        latest_date = (datetime.date.today() - BDay(1)).date()
+        dates = [latest_date - datetime.timedelta(days=1), latest_date]
+
+        Depot.objects.ensure_partitions({x.year for x in dates})
+        Price.objects.ensure_partitions({x.year for x in dates})
+
+        Asset.objects.create(isin='US0378331005', symbol='AAPL', name='Apple Inc.', type='STOCK', currency='USD',
+                             productId='331868')
+
+        account = Account.objects.get(name=Account.DEFAULT)
+        symbol = Symbol.objects.create(symbol='AAPL')
+
+        for date in dates:
+            Depot.objects.create(account=account, symbol=symbol, date=date, pieces=2)
+            Price.objects.create(symbol=symbol, date=date, price=120.0)
+            DailyValue.objects.create(account=account, date=date, total=240.0, contributions={'AAPL': 240.0})
+
+        Cashflow.objects.create(account=account, date=dates[0], cashflow=200.0)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_dashboard_context(self):
+        # data version, portfolio, asset info, cashflows, daily values, metrics state
+        with self.assertNumQueries(6):
+            context = IndexView.get_dashboard_context()
+
+        self.assertEqual(context['portfolio_value'], 240.0)
+        self.assertEqual(len(context['performance_zoom']['all']['data']), 2)
+
+    def test_dashboard_context_cached(self):
+        IndexView.get_dashboard_context()
+
+        with self.assertNumQueries(0):
+            IndexView.get_dashboard_context()
+
+        # the default, positional and keyword account share the cache entry
+        with self.assertNumQueries(0):
+            IndexView.get_dashboard_context(Account.DEFAULT)
+            IndexView.get_dashboard_context(account=Account.DEFAULT)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class ApiTestCase(TestCase):
+    """
+    JSON API of the dashboard data.
+    """
+
+    DAYS = 40
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('user', password='secret')
+
+        account = Account.objects.get(name=Account.DEFAULT)
+        cls.dates = [datetime.date(2021, 1, 4) + datetime.timedelta(days=i) for i in range(cls.DAYS)]
+        totals = 100 + np.random.default_rng(3).normal(0, 2, size=cls.DAYS).cumsum()
+
+        for date, total in zip(cls.dates, totals):
+            DailyValue.objects.create(account=account, date=date, total=float(total), contributions={})
+
+        Cashflow.objects.create(account=account, date=cls.dates[0], cashflow=100.0)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_rolling_measures(self):
+        response = self.client.get(reverse('portfolio:api-measures'), {'rolling': '30d'})
+
+        self.assertEqual(response.status_code, 200)
+        rolling = response.json()['rolling']
+
+        expected = RollingMeasures(compute_performance_series(Account.DEFAULT)).rolling(30)
+        self.assertEqual(rolling['window'], '30d')
+        self.assertEqual(rolling['dates'], [x.isoformat() for x in self.dates])
+        np.testing.assert_allclose(rolling['returns'], expected['returns'])
+
+    def test_no_rolling_measures(self):
+        response = self.client.get(reverse('portfolio:api-measures'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['rolling'])
+
+    def test_unknown_rolling_window(self):
+        response = self.client.get(reverse('portfolio:api-measures'), {'rolling': '7d'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('rolling', response.json())
+
+    def test_not_modified(self):
+        response = self.client.get(reverse('portfolio:api-performance'))
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+
+        response = self.client.get(reverse('portfolio:api-performance'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # a new ETL run changes the ETag
+        bump_data_version(1)
+
+        response = self.client.get(reverse('portfolio:api-performance'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_performance_since(self):
+        response = self.client.get(reverse('portfolio:api-performance'), {'since': self.dates[29].isoformat()})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+
+        self.assertEqual(data['since'], self.dates[29].isoformat())
+        self.assertEqual(data['dates'], [x.isoformat() for x in self.dates[30:]])
+        self.assertEqual(len(data['values']), self.DAYS - 30)
+
+    def test_performance_invalid_since(self):
+        response = self.client.get(reverse('portfolio:api-performance'), {'since': '01.02.2021'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('since', response.json())
+
+    def test_login_required(self):
+        response = APIClient().get(reverse('portfolio:api-performance'))
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_account(self):
+        for name in ['portfolio:api-allocation', 'portfolio:api-performance', 'portfolio:api-measures']:
+            response = self.client.get(reverse(name), {'account': 'unknown'})
+            self.assertEqual(response.status_code, 404, msg=name)
+
+    def test_dashboard_account(self):
+        self.client.force_login(self.user)
+
+        self.assertEqual(self.client.get(reverse('portfolio:index')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('portfolio:index'), {'account': 'unknown'}).status_code, 404)
+
+
+class OnlineMeasuresTestCase(SimpleTestCase):
+    """
+    The running statistics agree with the batch measures.
+    """
+
+    def test_matches_measure_loop(self):
+        values = 1 + np.random.default_rng(0).normal(0, 0.02, size=200).cumsum()
+        values[[10, 11, 50]] = np.nan
+
+        online = OnlineMeasures()
+        for value in values:
+            online.push(float(value))
+
+        measures = online.measures()
+        expected = PerformanceMeasures.measure_loop(pd.Series(values))
+
+        for key in PerformanceMeasures.MEASURES:
+            self.assertAlmostEqual(measures[key], expected[key], places=10, msg=key)
+
+    def test_too_few_values(self):
+        online = OnlineMeasures()
+        online.push(1.0)
+        online.push(1.1)
+
+        self.assertTrue(all(math.isnan(x) for x in online.measures().values()))
+
+
+class MetricsStateTestCase(TestCase):
+    """
+    Folding the performance day by day gives the same measures as a full rebuild and as measure_loop.
+    """
+
+    DAYS = 40
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.account = Account.objects.get(name=Account.DEFAULT)
+        cls.dates = [datetime.date(2021, 1, 4) + datetime.timedelta(days=i) for i in range(cls.DAYS)]
+        cls.totals = 100 + np.random.default_rng(1).normal(0, 2, size=cls.DAYS).cumsum()
+
+        # a cashflow before and one within the folded period
+        Cashflow.objects.create(account=cls.account, date=cls.dates[0], cashflow=100.0)
+        Cashflow.objects.create(account=cls.account, date=cls.dates[5], cashflow=20.0)
+
+    def _assert_measures_equal(self, measures: dict, expected: dict):
+        for key in PerformanceMeasures.MEASURES:
+            self.assertFalse(math.isnan(measures[key]), msg=key)
+            self.assertAlmostEqual(measures[key], expected[key], places=10, msg=key)
+
+    def test_incremental_update(self):
+        for date, total in zip(self.dates, self.totals):
+            DailyValue.objects.create(account=self.account, date=date, total=float(total), contributions={})
+            update_metrics_state(date, Account.DEFAULT)
+
+        incremental = get_metrics(Account.DEFAULT)
+
+        performance = compute_performance_series(Account.DEFAULT)
+        self.assertEqual(len(performance), self.DAYS)
+        self.assertFalse(performance.isna().any())
+
+        self._assert_measures_equal(incremental, PerformanceMeasures.measure_loop(performance))
+
+        # rebuild from scratch
+        update_metrics_state(self.dates[0], Account.DEFAULT)
+        self._assert_measures_equal(get_metrics(Account.DEFAULT), incremental)
+
+    def test_partial_performance_series(self):
+        for date, total in zip(self.dates, self.totals):
+            DailyValue.objects.create(account=self.account, date=date, total=float(total), contributions={})
+
+        full = compute_performance_series(Account.DEFAULT)
+        partial = compute_performance_series(Account.DEFAULT, self.dates[20])
+
+        np.testing.assert_allclose(partial.to_numpy(), full.iloc[20:].to_numpy())
+
+
+class RateLimiterTestCase(SimpleTestCase):
+
+    @mock.patch('portfolio.lib.degiro_api.time')
+    def test_spacing(self, clock):
+        clock.monotonic.return_value = 100.0
+        limiter = RateLimiter(4)
+
+        for _ in range(3):
+            limiter.wait()
+
+        # the first call passes, the following ones queue up a quarter second apart
+        self.assertEqual(clock.sleep.call_args_list, [mock.call(0.25), mock.call(0.5)])
+
+        # once the queue has passed, calls go through again
+        clock.sleep.reset_mock()
+        clock.monotonic.return_value = 101.0
+        limiter.wait()
+        clock.sleep.assert_not_called()
+
+    @mock.patch('portfolio.lib.degiro_api.time')
+    def test_unlimited(self, clock):
+        clock.monotonic.return_value = 100.0
+        limiter = RateLimiter(0)
+
+        for _ in range(3):
+            limiter.wait()
+
+        clock.sleep.assert_not_called()
+
+
+@mock.patch.dict('portfolio.lib.degiro_api.DEGIRO', {'RATE_LIMIT': 0})
+class ProductBatchTestCase(SimpleTestCase):
+
+    @staticmethod
+    def _api(max_workers):
+        def request(method, url, data=None, **kwargs):
+            response = mock.Mock()
+            response.json.return_value = {'data': {x: {'id': x} for x in json.loads(data)}}
+            return response
+
+        api = DegiroAPI('user', 'password', max_workers=max_workers)
+        api.user = {'intAccount': 1}
+        api.sess_id = 'session'
+        api.sess = mock.Mock()
+        api.sess.request.side_effect = request
+        return api
+
+    def test_batches(self):
+        product_ids = [str(x) for x in range(25)]
+
+        for max_workers in [1, 4]:
+            with self.subTest(max_workers=max_workers):
+                api = self._api(max_workers)
+                data = api.get_products_by_id(product_ids)
+
+                # three batches of at most ten products, merged in the order of the ids
+                self.assertEqual(api.sess.request.call_count, 3)
+                self.assertEqual(sorted(len(json.loads(x.kwargs['data'])) for x in api.sess.request.call_args_list),
+                                 [5, 10, 10])
+                self.assertEqual(list(data), product_ids)
+                self.assertEqual(data['17'], {'id': '17'})
+
+
+class FramesTestCase(SimpleTestCase):
+
+    def test_typed_frame(self):
+        frame = typed_frame(PRICES, {'symbol': ['AAPL', 'MSFT'], 'date': ['2021-03-01', '2021-03-02'],
+                                     'price': [1, 2]})
+
+        self.assertEqual(list(frame.columns), list(PRICES))
+        self.assertIsInstance(frame['symbol'].dtype, pd.CategoricalDtype)
+        self.assertTrue(pd.api.types.is_datetime64_dtype(frame['date']))
+        self.assertEqual(frame['price'].dtype, np.float64)
+
+        empty = typed_frame(PRICES)
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(empty.dtypes.astype(str).to_dict(), frame.dtypes.astype(str).to_dict())
+
+    def test_category_ids(self):
+        column = pd.Series(['MSFT', 'AAPL', 'MSFT'], name='symbol', dtype='category')
+        np.testing.assert_array_equal(category_ids(column, {'AAPL': 7, 'MSFT': 3}), [3, 7, 3])
+
+        # a missing symbol has no category and must not be mapped to one
+        column = pd.Series(['MSFT', None, 'AAPL'], name='symbol', dtype='category')
+        with self.assertRaises(ValueError):
+            category_ids(column, {'AAPL': 7, 'MSFT': 3})
+
+
+class PriceCacheTestCase(SimpleTestCase):
+    """
+    Only downloads that returned prices, or ranges without business days, are recorded as covered.
+    """
+
+    # Monday to Monday, long settled
+    START = datetime.date(2021, 3, 1)
+    END = datetime.date(2021, 3, 8)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = PriceCache(os.path.join(directory.name, 'prices.sqlite3'))
+
+    def test_prices_are_covered(self):
+        prices = pd.Series([1.0, 2.0], index=[self.START, self.START + datetime.timedelta(days=1)])
+        self.cache.store('MSFT', self.START, self.END, prices)
+
+        self.assertEqual(self.cache.missing_ranges('MSFT', self.START, self.END), [])
+        self.assertEqual(self.cache.load(['MSFT'], self.START, self.END)['MSFT'].tolist(), [1.0, 2.0])
+
+    def test_empty_download_is_not_covered(self):
+        self.cache.store('MSFT', self.START, self.END, pd.Series(dtype=float))
+        self.cache.store('AMZN', self.START, self.END,
+                         pd.Series([np.nan, np.nan], index=[self.START, self.START + datetime.timedelta(days=1)]))
+
+        self.assertEqual(self.cache.missing_ranges('MSFT', self.START, self.END), [(self.START, self.END)])
+        self.assertEqual(self.cache.missing_ranges('AMZN', self.START, self.END), [(self.START, self.END)])
+
+    def test_empty_weekend_is_covered(self):
+        saturday, monday = datetime.date(2021, 3, 6), datetime.date(2021, 3, 8)
+        self.cache.store('MSFT', saturday, monday, pd.Series(dtype=float))
+
+        self.assertEqual(self.cache.missing_ranges('MSFT', saturday, monday), [])
+
+    def test_recent_days_are_not_covered(self):
+        today = datetime.date.today()
+        start = today - datetime.timedelta(days=30)
+        self.cache.store('MSFT', start, today, pd.Series([1.0], index=[start]))
+
+        settled = today - datetime.timedelta(days=3)
+        self.assertEqual(self.cache.missing_ranges('MSFT', start, today), [(settled, today)])
+
+    def test_adjacent_ranges_are_merged(self):
+        middle = datetime.date(2021, 3, 3)
+        self.cache.store('MSFT', self.START, middle, pd.Series([1.0], index=[self.START]))
+        self.cache.store('MSFT', middle, self.END, pd.Series([2.0], index=[middle]))
+
+        self.assertEqual(self.cache.group_missing(['MSFT', 'AMZN'], self.START, self.END),
+                         {(self.START, self.END): ['AMZN']})
+
+
+class CopyUpsertTestCase(TestCase):
+    """
+    The COPY merge inserts new rows, updates changed ones and leaves unchanged ones alone.
+    """
+
+    def test_merge(self):
+        symbols = [Symbol.objects.create(symbol=x) for x in ['MSFT', 'AMZN']]
+        date = datetime.date(2021, 3, 1)
+
+        Price.objects.ensure_partitions([2021])
+        Price.objects.ensure_partitions([2021])
+        Price.objects.create(symbol=symbols[0], date=date, price=1.0)
+        Price.objects.create(symbol=symbols[1], date=date, price=2.0)
+
+        Price.objects.copy_upsert_frame(
+            pd.DataFrame({'symbol_id': [symbols[1].id, symbols[0].id, symbols[0].id],
+                          'date': pd.to_datetime([date, date, date + datetime.timedelta(days=1)]),
+                          'price': [2.0, 1.5, 1.6]}),
+            conflict_fields=['symbol_id', 'date'],
+            update_fields=['price']
+        )
+
+        self.assertEqual(sorted(Price.objects.values_list('symbol__symbol', 'date', 'price')), [
+            ('AMZN', date, 2.0),
+            ('MSFT', date, 1.5),
+            ('MSFT', date + datetime.timedelta(days=1), 1.6),
+        ])
+
+
+class IteratorFileTestCase(SimpleTestCase):
+
+    def test_read(self):
+        file = IteratorFile(csv_lines([[1, 'a'], [2, None], [3, 'c']]))
+
+        self.assertEqual(file.read(3), '1,a')
+        self.assertEqual(file.read(), '\n2,\n3,c\n')
+        self.assertEqual(file.read(), '')
+
+    def test_readline(self):
+        file = IteratorFile(iter(['1,a\n2,', 'b\n', '3,c']))
+
+        self.assertEqual(file.readline(), '1,a\n')
+        self.assertEqual(file.readline(2), '2,')
+        self.assertEqual(file.readline(), 'b\n')
+        self.assertEqual(list(file), ['3,c'])
+
+
+class RollingMeasuresTestCase(SimpleTestCase):
+    """
+    The prefix sum measures agree with pandas rolling windows and with the measures of the sliced series.
+    """
+
+    def setUp(self):
+        index = pd.date_range('2020-06-01', periods=500, freq='D')
+        self.series = pd.Series(1 + np.random.default_rng(2).normal(0, 0.01, size=500).cumsum(), index=index)
+
+    def test_rolling(self):
+        window = 30
+        rolling = RollingMeasures(self.series).rolling(window)
+
+        daily_returns = self.series.pct_change().rolling(window - 1)
+        expected = pd.DataFrame({
+            'returns': self.series / self.series.shift(window - 1) - 1,
+            'std': daily_returns.std() * np.sqrt(252),
+            'var': daily_returns.mean() + daily_returns.std(ddof=0) * norm.ppf(0.01),
+            'drawdown': self.series / self.series.rolling(window, min_periods=1).max() - 1,
+        })
+
+        # the first windows are shorter than the window length
+        pd.testing.assert_frame_equal(rolling[expected.columns].iloc[window:], expected.iloc[window:])
+
+    def test_horizons(self):
+        today = datetime.date(2021, 8, 1)
+        horizons = RollingMeasures(self.series).horizons(today)
+
+        slices = {
+            '30d': self.series.iloc[-30:],
+            '90d': self.series.iloc[-90:],
+            '1y': self.series.iloc[-365:],
+            'ytd': self.series[self.series.index >= '2021-01-01'],
+            'inception': self.series,
+        }
+
+        self.assertEqual(list(horizons), list(slices))
+        for name, series in slices.items():
+            expected = PerformanceMeasures.measure_loop(series)
+            for key in PerformanceMeasures.MEASURES:
+                self.assertAlmostEqual(horizons[name][key], expected[key], places=10, msg=f'{name} {key}')
+
+
+class BuildHoldingsTestCase(SimpleTestCase):
+    """
+    Daily holdings of a small portfolio, computed by hand.
+    """
+
+    def test_holdings(self):
+        day = [datetime.date(2021, 3, d) for d in range(1, 5)]
+
+        holdings = build_holdings(
+            dates=[datetime.date(2021, 2, 28), day[1], day[1], day[1], day[2], day[2], day[3]],
+            symbols=['AAPL', 'MSFT', 'MSFT', None, 'AAPL', 'TSLA', 'AAPL'],
+            # before from_date, a same-day round trip, an unknown product, a buy of each and a closing sell
+            quantities=[10, 5, -5, 7, 1, 1.5, -3],
+            start_portfolio={'AAPL': 2},
+            from_date=day[0],
+            to_date=day[3]
+        )
+
+        self.assertEqual(list(zip(pd.to_datetime(holdings['date']).date, holdings['symbol'], holdings['pieces'])), [
+            (day[0], 'AAPL', 2),
+            (day[1], 'AAPL', 2),
+            (day[2], 'AAPL', 3),
+            (day[2], 'TSLA', 1.5),
+            (day[3], 'TSLA', 1.5),
+        ])
+
+    def test_no_transactions(self):
+        holdings = build_holdings([], [], [], {'AAPL': 2, 'MSFT': 0}, datetime.date(2021, 3, 1),
+                                  datetime.date(2021, 3, 2))
+
+        self.assertEqual(list(holdings['symbol']), ['AAPL', 'AAPL'])
+        self.assertEqual(list(holdings['pieces']), [2, 2])
+
+
+class DownsamplingTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.values = np.random.default_rng(4).normal(0, 1, size=1000).cumsum()
+
+    def test_minmax(self):
+        selected = minmax(self.values, 100)
+
+        self.assertLessEqual(len(selected), 100)
+        self.assertTrue(np.all(np.diff(selected) > 0))
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+        self.assertIn(np.argmin(self.values), selected)
+        self.assertIn(np.argmax(self.values), selected)
+
+    def test_lttb(self):
+        selected = lttb(self.values, 100)
+
+        self.assertEqual(len(selected), 100)
+        self.assertTrue(np.all(np.diff(selected) > 0))
+        self.assertEqual((selected[0], selected[-1]), (0, 999))
+
+    def test_short_series(self):
+        np.testing.assert_array_equal(minmax(self.values[:50], 100), np.arange(50))
+        np.testing.assert_array_equal(lttb(self.values[:50], 100), np.arange(50))
+
+    def test_downsample(self):
+        series = pd.Series(self.values, index=pd.date_range('2020-01-01', periods=1000, freq='D'))
+        downsampled = downsample(series, 100)
+
+        self.assertLessEqual(len(downsampled), 100)
+        pd.testing.assert_series_equal(downsampled, series[downsampled.index])
+
+
+class BatchingDatabaseLogHandlerTestCase(SimpleTestCase):
+    """
+    Batching, dropping and flushing of the queued log records. The records are captured instead of written to
+    the database.
+    """
+
+    def setUp(self):
+        self.written = []
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+        # the record 'block' keeps the listener busy until it is released
+        def write(records):
+            if any(record.msg == 'block' for record in records):
+                self.writing.set()
+                self.release.wait(5)
+            self.written.append([record.msg for record in records])
+
+        patcher = mock.patch.object(BatchingDatabaseListener, '_write', staticmethod(write))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _handler(self, **kwargs) -> BatchingDatabaseLogHandler:
+        handler = BatchingDatabaseLogHandler(**kwargs)
+        self.addCleanup(handler.close)
+        self.addCleanup(self.release.set)
+        return handler
+
+    @staticmethod
+    def _log(handler, msg, level=logging.INFO, args=None):
+        handler.handle(logging.makeLogRecord({'name': 'db', 'msg': msg, 'args': args, 'levelno': level,
+                                              'levelname': logging.getLevelName(level)}))
+
+    def test_batches(self):
+        handler = self._handler(batch_size=3, flush_interval=0.05)
+
+        for i in range(7):
+            self._log(handler, 'record %s', args=(i,))
+        handler.flush()
+
+        self.assertEqual(sum(self.written, []), [f'record {i}' for i in range(7)])
+        self.assertTrue(all(len(batch) <= 3 for batch in self.written))
+
+    def test_drop(self):
+        handler = self._handler(capacity=2, batch_size=1, flush_interval=0.05, block_timeout=0.01)
+
+        self._log(handler, 'block')
+        self.assertTrue(self.writing.wait(5))
+
+        # two records fill the queue, the following ones are dropped
+        for msg in ['queued 1', 'queued 2', 'dropped 1', 'dropped 2']:
+            self._log(handler, msg)
+        self._log(handler, 'dropped 3', level=logging.WARNING)
+        self.assertEqual(handler.dropped, 3)
+
+        self.release.set()
+        handler.flush()
+
+        self._log(handler, 'after')
+        handler.flush()
+
+        self.assertEqual(sum(self.written, []), ['block', 'queued 1', 'queued 2', 'after',
+                                                  '3 log records dropped, the log queue was full'])
+        self.assertEqual(handler.dropped, 0)
+
+    def test_close_flushes(self):
+        handler = self._handler(flush_interval=60)
+
+        self._log(handler, 'pending')
+        handler.close()
+
+        self.assertEqual(self.written, [['pending']])
+
+    @skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_fork(self):
+        handler = self._handler(flush_interval=0.05)
+
+        # a record still queued in the parent when forking
+        self._log(handler, 'block')
+        self.assertTrue(self.writing.wait(5))
+        self._log(handler, 'parent')
+
+        read, write = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            # the child starts its own listener with an empty queue and writes its records when it closes
+            try:
+                self.written.clear()
+                self._log(handler, 'child')
+                handler.close()
+                os.write(write, repr(self.written).encode())
+            finally:
+                os._exit(0)
+
+        os.close(write)
+        with os.fdopen(read) as pipe:
+            child_written = pipe.read()
+        os.waitpid(pid, 0)
+
+        self.assertEqual(child_written, repr([['child']]))
+
+        self.release.set()
+        handler.flush()
+        self.assertEqual(sum(self.written, []), ['block', 'parent'])
+
+
+class TimeseriesIOTestCase(TestCase):
+    """
+    Round trip of the time series through a Parquet export into an emptied database.
+    """
+
+    DATES = [datetime.date(2018, 12, 31), datetime.date(2021, 1, 4), datetime.date(2021, 1, 5)]
+
+    @classmethod
+    def setUpTestData(cls):
+        Depot.objects.ensure_partitions([2018, 2021])
+        Price.objects.ensure_partitions([2018, 2021])
+
+        accounts = [Account.objects.get(name=Account.DEFAULT), Account.objects.create(name='other')]
+        symbols = [Symbol.objects.create(symbol=x) for x in ['AAPL', 'MSFT']]
+
+        for i, date in enumerate(cls.DATES):
+            for symbol, price in zip(symbols, [120.0, 230.0]):
+                Price.objects.create(symbol=symbol, date=date, price=price + i)
+
+            Depot.objects.create(account=accounts[0], symbol=symbols[0], date=date, pieces=2)
+            Depot.objects.create(account=accounts[1], symbol=symbols[1], date=date, pieces=1 + i)
+
+        for account in accounts:
+            Cashflow.objects.create(account=account, date=cls.DATES[0], cashflow=200.0)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    @staticmethod
+    def _rows():
+        return {
+            'price': sorted(Price.objects.values_list('symbol__symbol', 'date', 'price')),
+            'depot': sorted(Depot.objects.values_list('account__name', 'symbol__symbol', 'date', 'pieces')),
+            'cashflow': sorted(Cashflow.objects.values_list('account__name', 'date', 'cashflow')),
+        }
+
+    @staticmethod
+    def _partition_exists(name: str) -> bool:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s)', [name])
+            return cursor.fetchone()[0] is not None
+
+    def test_round_trip(self):
+        expected = self._rows()
+
+        self.assertEqual(export_table('price', self.directory), 6)
+        call_command('export_timeseries', self.directory, '--tables', 'depot', 'cashflow', stdout=io.StringIO())
+
+        # empty the database, including the symbols, the other account and the partitions of 2018
+        Symbol.objects.all().delete()
+        Account.objects.exclude(name=Account.DEFAULT).delete()
+        Cashflow.objects.all().delete()
+        with connection.cursor() as cursor:
+            # fire the deferred foreign key checks of the deletes, tables with pending checks can't be dropped
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            for manager in [Price.objects, Depot.objects]:
+                cursor.execute(f'DROP TABLE {connection.ops.quote_name(manager.partition_name(2018))}')
+        self.assertFalse(self._partition_exists(Price.objects.partition_name(2018)))
+
+        self.assertEqual(import_table('price', self.directory), (6, (self.DATES[0], self.DATES[-1])))
+
+        call_command('import_timeseries', self.directory, stdout=io.StringIO())
+
+        self.assertEqual(self._rows(), expected)
+        self.assertTrue(self._partition_exists(Price.objects.partition_name(2018)))
+        self.assertTrue(self._partition_exists(Depot.objects.partition_name(2018)))
+
+        # derived data of both accounts
+        self.assertEqual(sorted(DailyValue.objects.values_list('account__name', 'date', 'total')), sorted(
+            [(Account.DEFAULT, date, 2 * (120.0 + i)) for i, date in enumerate(self.DATES)]
+            + [('other', date, (1 + i) * (230.0 + i)) for i, date in enumerate(self.DATES)]
+        ))
+        self.assertEqual(sorted(MetricsState.objects.values_list('account__name', 'tail_date')),
+                         [(Account.DEFAULT, self.DATES[-1]), ('other', self.DATES[-1])])
+
+
+class CheckpointTestCase(SimpleTestCase):
+
+    def test_save_load_clear(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = Checkpoint(directory, 1)
+            data = {'prices': pd.DataFrame({'AAPL': [1.0, 2.0]}), 'from_date': datetime.date(2021, 3, 1)}
+
+            checkpoint.save('extraction', data)
+            checkpoint.save('extraction', data)
+
+            loaded = checkpoint.load('extraction')
+            pd.testing.assert_frame_equal(loaded['prices'], data['prices'])
+            self.assertEqual(loaded['from_date'], data['from_date'])
+
+            # the checkpoints of other runs are kept
+            Checkpoint(directory, 2).save('extraction', data)
+            checkpoint.clear()
+
+            self.assertEqual(os.listdir(directory), ['2'])
+            with self.assertRaises(FileNotFoundError):
+                checkpoint.load('extraction')
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class PipelineTestCase(TestCase):
+    """
+    A run whose loading fails is resumed from the checkpoint of its transformation.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint_dir = directory.name
+
+        patcher = mock.patch.dict(ETL, {'CHECKPOINT_DIR': self.checkpoint_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.from_date = datetime.date.today() - datetime.timedelta(days=3)
+
+    def test_resume(self):
+        extract = mock.patch.object(Pipeline, '_extract', return_value=extraction_data(self.from_date))
+        fail = mock.patch.object(Loading, '_load_metrics_state', side_effect=RuntimeError('loading failed'))
+
+        with extract, fail, self.assertRaises(RuntimeError):
+            Pipeline().run()
+
+        run = EtlRun.objects.get()
+        self.assertEqual((run.status, run.stage), (EtlRun.FAILED, 'transformation'))
+
+        # the loading is rolled back as a whole
+        self.assertFalse(Depot.objects.exists())
+        self.assertFalse(Watermark.objects.exists())
+
+        with mock.patch.object(Pipeline, '_extract') as extract, mock.patch.object(Transformation, 'run') as transform:
+            resumed = Pipeline(resume=True).run()
+
+        extract.assert_not_called()
+        transform.assert_not_called()
+
+        run.refresh_from_db()
+        self.assertEqual(resumed.id, run.id)
+        self.assertEqual((run.status, run.stage), (EtlRun.SUCCESS, 'loading'))
+        self.assertIsNotNone(run.finished)
+
+        self.assertEqual(Watermark.objects.get_dates(Account.DEFAULT),
+                         {source: datetime.date.today() for source in ['transactions', 'cash_flows', 'prices']})
+        self.assertEqual(sorted(Depot.objects.filter(date=self.from_date).values_list('symbol__symbol', 'pieces')),
+                         [('AAPL', 2)])
+        self.assertEqual(os.listdir(self.checkpoint_dir), [])
+
+        # nothing left to resume
+        self.assertIsNone(EtlRun.objects.get_resumable(Account.DEFAULT))
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class LoadingTestCase(TestCase):
+    """
+    Loading the same transformation data again gives the same tables.
+    """
+
+    def setUp(self):
+        self.from_date = datetime.date.today() - datetime.timedelta(days=3)
+
+        transformation = Transformation(extraction_data(self.from_date))
+        transformation.run()
+        self.data = transformation.data
+
+    @staticmethod
+    def _counts():
+        return {model.__name__: model.objects.count() for model in [Depot, Price, Cashflow, Transaction, Asset]}
+
+    def test_reload(self):
+        Loading(self.data).run()
+        counts = self._counts()
+
+        # AAPL on the first day and MSFT from the second day on, prices of both on all four days
+        self.assertEqual(counts, {'Depot': 4, 'Price': 8, 'Cashflow': 1, 'Transaction': 3, 'Asset': 2})
+
+        # a position closed in the meantime and a changed deposit
+        tsla = Symbol.objects.create(symbol='TSLA')
+        Depot.objects.create(account=Account.objects.get(name=Account.DEFAULT), symbol=tsla,
+                             date=self.from_date + datetime.timedelta(days=1), pieces=3)
+        self.data['cash_flows'].loc[0, 'cashflow'] = 600.0
+
+        Loading(self.data).run()
+
+        self.assertEqual(self._counts(), counts)
+        self.assertFalse(Depot.objects.filter(symbol=tsla).exists())
+        self.assertEqual(list(Cashflow.objects.values_list('date', 'cashflow')), [(self.from_date, 600.0)])
+
+    def test_cash_flows_only(self):
+        # a run that brings nothing but a deposit still updates the running statistics
+        for key in ['portfolios', 'price_data']:
+            self.data[key] = self.data[key].iloc[0:0]
+
+        with mock.patch('portfolio.lib.etl.update_metrics_state') as update:
+            Loading(self.data).run()
+
+        update.assert_called_once_with(self.from_date, Account.DEFAULT)
@@ -8,4 +8,7 @@ urlpatterns = [
     path('accounts/login/', auth_views.LoginView.as_view(), name='login'),
     path('accounts/logout/', views.logout_view, name='logout'),
     path('contact/', views.ContactView.as_view(), name='portfolio-contact'),
+    path('api/allocation/', views.AllocationApiView.as_view(), name='api-allocation'),
+    path('api/performance/', views.PerformanceApiView.as_view(), name='api-performance'),
+    path('api/measures/', views.MeasuresApiView.as_view(), name='api-measures'),
 ]
\ No newline at end of file
@@ -1,3 +1,4 @@
 from .index import *
 from .account import *
 from .contact import *
+from .api import *
@@ -0,0 +1,151 @@
+import datetime
+import math
+
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from portfolio.lib.aggregation import create_portfolio, create_performance_series
+from portfolio.lib.cache import data_version
+from portfolio.lib.performance_measures import PerformanceMeasures, RollingMeasures
+from portfolio.lib.streaming_measures import get_metrics
+from portfolio.models import Account
+
+__all__ = ['AllocationApiView', 'PerformanceApiView', 'MeasuresApiView']
+
+
+def dashboard_etag(request, *args, **kwargs) -> str:
+    """
+    ETag of the dashboard data. Changes with every ETL run and every day, since some aggregations depend on the
+    current date.
+    """
+    return f'{data_version()}-{datetime.date.today().isoformat()}'
+
+
+def _clean(value):
+    """
+    Replace NaN and infinite values by None, since they are not valid JSON.
+    """
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def _account(request) -> str:
+    """
+    Name of the account requested with ?account=, the default account if none is given. Unknown accounts are
+    answered with 404, so that they are never passed on to the cached aggregations.
+    """
+    account = request.query_params.get('account', Account.DEFAULT)
+
+    if not Account.objects.filter(name=account).exists():
+        raise NotFound({'account': 'Unbekanntes Konto.'})
+
+    return account
+
+
+# clients have to revalidate with the ETag before using a stored response
+conditional = [cache_control(private=True, no_cache=True), condition(etag_func=dashboard_etag)]
+
+
+@method_decorator(conditional, name='get')
+class AllocationApiView(APIView):
+    """
+    Current allocation of the portfolio of an account (?account=, defaults to the default account).
+    """
+
+    def get(self, request, **kwargs):
+        portfolio = create_portfolio(_account(request))
+
+        records = [{key: _clean(value) for key, value in record.items()} for record in portfolio.to_dict('records')]
+
+        return Response({
+            'version': data_version(),
+            'value': round(float(portfolio.subtotal.sum()), 2) if not portfolio.empty else 0,
+            'positions': records,
+        })
+
+
+@method_decorator(conditional, name='get')
+class PerformanceApiView(APIView):
+    """
+    Indexed performance of the portfolio of an account per date. With ?since=YYYY-MM-DD only the dates after
+    `since` are returned, so that clients can fetch the delta to the data they already have.
+    """
+
+    def get(self, request, **kwargs):
+        since = request.query_params.get('since')
+
+        performance_series = create_performance_series(_account(request))
+
+        if since is not None:
+            try:
+                since = datetime.date.fromisoformat(since)
+            except ValueError:
+                raise ValidationError({'since': 'Ungültiges Datum, erwartet wird YYYY-MM-DD.'})
+
+            performance_series = performance_series[[date > since for date in performance_series.index]]
+
+        return Response({
+            'version': data_version(),
+            'since': since.isoformat() if since is not None else None,
+            'dates': [date.isoformat() for date in performance_series.index],
+            'values': [_clean(value) for value in performance_series.values.tolist()],
+        })
+
+
+@method_decorator(conditional, name='get')
+class MeasuresApiView(APIView):
+    """
+    Performance measures of the portfolio of an account, overall and per horizon (30d, 90d, 1y, ytd, inception).
+    With ?rolling=30d (or 90d, 1y) the measures over the rolling window are returned per date as well.
+    """
+
+    def get(self, request, **kwargs):
+        account = _account(request)
+        window = request.query_params.get('rolling')
+
+        if window is not None and window not in RollingMeasures.WINDOWS:
+            raise ValidationError({'rolling': 'Unbekanntes Fenster, erlaubt sind {}.'.format(
+                ', '.join(RollingMeasures.WINDOWS))})
+
+        performance_series = create_performance_series(account)
+        rolling = None
+
+        if performance_series.empty:
+            measures, horizons = None, {}
+
+        else:
+            metrics = get_metrics(account)
+            if metrics is not None:
+                measures = {key: metrics[key] for key in PerformanceMeasures.MEASURES}
+            else:
+                measures = PerformanceMeasures.measure_loop(performance_series)
+
+            measures = {key: _clean(float(value)) for key, value in measures.items()}
+
+            rolling_measures = RollingMeasures(performance_series)
+
+            horizons = {
+                name: {key: _clean(value) for key, value in values.items()}
+                for name, values in rolling_measures.horizons().items()
+            }
+
+            if window is not None:
+                frame = rolling_measures.rolling(RollingMeasures.WINDOWS[window])
+                rolling = {
+                    'window': window,
+                    'dates': [date.isoformat() for date in frame.index],
+                    **{key: [_clean(value) for value in frame[key].tolist()] for key in frame.columns},
+                }
+
+        return Response({
+            'version': data_version(),
+            'measures': measures,
+            'horizons': horizons,
+            'rolling': rolling,
+            'help': PerformanceMeasures.HELP_TEXT,
+        })
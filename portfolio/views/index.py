@@ -1,48 +1,75 @@
 import datetime
 
+from django.conf import settings
+from django.http import Http404
 from django.shortcuts import render
+from django.utils.formats import date_format
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 
 from portfolio.lib.aggregation import create_portfolio, create_performance_series
-from portfolio.lib.performance_measures import PerformanceMeasures
+from portfolio.lib.cache import cached
+from portfolio.lib.downsampling import downsample
+from portfolio.lib.performance_measures import PerformanceMeasures, RollingMeasures
+from portfolio.lib.streaming_measures import get_metrics
+from portfolio.models import Account
 
 
 class IndexView(LoginRequiredMixin, TemplateView):
     template_name = 'portfolio/index.html'
 
+    # zoom levels of the performance chart and the number of days they span (None for the full history)
+    PERFORMANCE_ZOOM = {'all': None, '1y': 365, '90d': 90}
+
     def get(self, request, **kwargs):
+        account = request.GET.get('account', Account.DEFAULT)
+
+        # unknown accounts must not reach the cached aggregations
+        if not Account.objects.filter(name=account).exists():
+            raise Http404('Unbekanntes Konto.')
+
+        return render(request, self.template_name, self.get_dashboard_context(account))
 
-        portfolio = create_portfolio()
+    @staticmethod
+    @cached('index_context')
+    def get_dashboard_context(account: str = Account.DEFAULT) -> dict:
+        """
+        Build the template context of the dashboard. Cached per account until the next ETL run.
+        :param account: name of the account
+        """
 
-        performance_series = create_performance_series()
+        portfolio = create_portfolio(account)
+
+        performance_series = create_performance_series(account)
 
         # ytd performance
         if not performance_series.empty:
-            start_of_year = performance_series.loc[datetime.date(datetime.date.today().year, 1, 1):][0]
-            current = performance_series[-1]
-            ytd_performance_percent = round(((current / start_of_year) - 1) * 100, 2)
+            ytd = RollingMeasures(performance_series).horizons().get('ytd')
+            ytd_performance_percent = round(ytd['returns'] * 100, 2) if ytd else 0
 
         else:
             ytd_performance_percent = 0
 
-        # performance measures
+        # performance measures, from the running statistics if available
         if not performance_series.empty:
-            measure_data = PerformanceMeasures.measure_loop(performance_series)
+            metrics = get_metrics(account)
+            if metrics is not None:
+                measure_data = {key: metrics[key] for key in PerformanceMeasures.MEASURES}
+            else:
+                measure_data = PerformanceMeasures.measure_loop(performance_series)
+
             for key, value in measure_data.items():
                 if key == 'sharpe':
                     measure_data[key] = round(value, 2)
                 else:
                     measure_data[key] = '{:.2%}'.format(value)
 
-            # performance data
-            performance_labels = performance_series.index.tolist()
-            performance_data = [round((x - 1) * 100, 2) for x in performance_series.values.tolist()]
+            # performance data, downsampled per zoom level
+            performance_zoom = IndexView.get_performance_zoom(performance_series)
 
         else:
             measure_data = None
-            performance_labels = []
-            performance_data = []
+            performance_zoom = {zoom: {'labels': [], 'data': []} for zoom in IndexView.PERFORMANCE_ZOOM}
 
         measure_help = PerformanceMeasures.HELP_TEXT
 
@@ -62,14 +89,39 @@ class IndexView(LoginRequiredMixin, TemplateView):
             allocation_labels = []
             allocation_data = []
 
-        return render(request, self.template_name, {
+        return {
+            'account': account,
             'portfolio': portfolio_records,
             'portfolio_value': portfolio_value,
             'ytd_performance': ytd_performance_percent,
             'allocation_labels': allocation_labels,
             'allocation_data': allocation_data,
-            'performance_labels': performance_labels,
-            'performance_data': performance_data,
+            'performance_zoom': performance_zoom,
             'measure_data': measure_data,
             'measure_help': measure_help
-        })
+        }
+
+    @staticmethod
+    def get_performance_zoom(performance_series) -> dict:
+        """
+        Downsample the performance series for every zoom level of the chart, so that the page only ships a
+        bounded number of points regardless of the length of the history.
+        :param performance_series: cumulative performance indexed by date
+        :return: labels and data (performance in percent) per zoom level
+        """
+        last_date = performance_series.index[-1]
+
+        performance_zoom = {}
+        for zoom, days in IndexView.PERFORMANCE_ZOOM.items():
+            series = performance_series
+            if days is not None:
+                series = series[series.index > last_date - datetime.timedelta(days=days)]
+
+            series = downsample(series, settings.PERFORMANCE_CHART_POINTS)
+
+            performance_zoom[zoom] = {
+                'labels': [date_format(x) for x in series.index],
+                'data': [round((x - 1) * 100, 2) for x in series.values.tolist()]
+            }
+
+        return performance_zoom
@@ -1,5 +1,16 @@
+import contextlib
+import copy
+import cProfile
 import logging
+import multiprocessing.util
+import os
+import threading
+import time
+import tracemalloc
 from functools import partial, wraps
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue, Full, Empty
+from typing import List, Dict, Optional
 import traceback
 
 
@@ -7,6 +18,211 @@ class FuncError(Exception):
     pass
 
 
+class StepProfiler:
+    """
+    Collects wall time, CPU time, peak memory (tracemalloc), SQL queries and HTTP requests per step, i.e. per
+    function decorated with @log() and per ETL stage, while it is active (see profile_steps). Nested steps are
+    included in the figures of the enclosing step.
+
+    CPU time and memory are measured for the whole process, so steps that run concurrently on other threads
+    (e.g. a concurrent extraction) are included in each other's figures. SQL queries and HTTP requests are
+    attributed to the steps of the thread that issued them.
+
+    Python < 3.9 cannot reset the peak of tracemalloc (and clearing the traces would drop the memory of the
+    enclosing steps). There, the peak of a step is only exact if it exceeds the peaks before the step, otherwise
+    the memory at the end of the step is reported as a lower bound.
+    """
+
+    COLUMNS = ['Step', 'Calls', 'Wall s', 'CPU s', 'Peak MiB', 'SQL', 'SQL s', 'HTTP', 'HTTP s']
+
+    def __init__(self, dump_dir: str = None):
+        """
+        :param dump_dir: directory to dump the cProfile statistics of every stage to (as <stage>.pstats)
+        """
+        self.dump_dir = dump_dir
+        self.results: Dict[str, Dict] = dict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _frames(self) -> List[Dict]:
+        if not hasattr(self._local, 'frames'):
+            self._local.frames = []
+        return self._local.frames
+
+    def _sql(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record('sql', time.perf_counter() - start)
+
+    def record(self, kind: str, seconds: float) -> None:
+        """
+        Record a SQL query or HTTP request in the active steps of the current thread.
+        :param kind: 'sql' or 'http'
+        :param seconds: duration
+        """
+        for frame in self._frames():
+            frame[kind] += 1
+            frame[kind + '_time'] += seconds
+
+    @staticmethod
+    def _peak(frame: Dict) -> int:
+        """
+        Return the peak memory since the start of the step (or since the last reset of the peak).
+        """
+        current, peak = tracemalloc.get_traced_memory()
+
+        # without reset_peak, a peak that doesn't exceed the one at the start of the step was reached before it
+        if hasattr(tracemalloc, 'reset_peak') or peak > frame['start_peak']:
+            return peak
+
+        return current
+
+    @contextlib.contextmanager
+    def step(self, name: str):
+        """
+        Profile a step.
+        :param name: name of the step
+        """
+        from django.db import connection
+
+        frames = self._frames()
+        if frames:
+            # the peak of the enclosing step so far, before it is reset for this step
+            frames[-1]['peak'] = max(frames[-1]['peak'], self._peak(frames[-1]))
+
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+        base, start_peak = tracemalloc.get_traced_memory()
+        frame = {'sql': 0, 'sql_time': 0.0, 'http': 0, 'http_time': 0.0, 'peak': 0, 'base': base,
+                 'start_peak': start_peak}
+
+        with self._lock:
+            self.results.setdefault(name, {'depth': len(frames), 'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak': 0,
+                                           'sql': 0, 'sql_time': 0.0, 'http': 0, 'http_time': 0.0})
+
+        # the queries are recorded in all active steps of the thread, so only the outermost step wraps them
+        wrapper = connection.execute_wrapper(self._sql) if not frames else contextlib.nullcontext()
+
+        frames.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+
+        try:
+            with wrapper:
+                yield
+
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            frames.pop()
+
+            frame['peak'] = max(frame['peak'], self._peak(frame))
+            if frames:
+                frames[-1]['peak'] = max(frames[-1]['peak'], frame['peak'])
+
+            with self._lock:
+                result = self.results[name]
+                result['calls'] += 1
+                result['wall'] += wall
+                result['cpu'] += cpu
+                result['peak'] = max(result['peak'], frame['peak'] - frame['base'])
+                for key in ['sql', 'sql_time', 'http', 'http_time']:
+                    result[key] += frame[key]
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Profile a stage like a step, additionally dumping its cProfile statistics if a dump directory is set.
+        :param name: name of the stage, also the name of the dump
+        """
+        with self.step(name):
+            if self.dump_dir is None:
+                yield
+                return
+
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                os.makedirs(self.dump_dir, exist_ok=True)
+                profile.dump_stats(os.path.join(self.dump_dir, f'{name}.pstats'))
+
+    def summary(self) -> str:
+        """
+        Return the results as a table, one row per step in the order the steps were first run.
+        """
+        rows = [self.COLUMNS] + [
+            ['  ' * x['depth'] + name, str(x['calls']), f'{x["wall"]:.3f}', f'{x["cpu"]:.3f}',
+             f'{x["peak"] / 2 ** 20:.1f}', str(x['sql']), f'{x["sql_time"]:.3f}', str(x['http']),
+             f'{x["http_time"]:.3f}']
+            for name, x in self.results.items()
+        ]
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(self.COLUMNS))]
+
+        return '\n'.join(
+            '  '.join(value.ljust(width) if i == 0 else value.rjust(width)
+                      for i, (value, width) in enumerate(zip(row, widths)))
+            for row in rows
+        )
+
+
+# profiler of the steps while profile_steps is active
+_profiler: Optional[StepProfiler] = None
+
+
+@contextlib.contextmanager
+def profile_steps(dump_dir: str = None):
+    """
+    Profile the steps (functions decorated with @log()) and stages run within the context. HTTP requests are
+    counted by patching requests' HTTPAdapter.send for the duration of the context.
+    :param dump_dir: directory to dump the cProfile statistics of every stage to
+    :return: the StepProfiler collecting the results
+    """
+    global _profiler
+
+    from requests.adapters import HTTPAdapter
+
+    profiler = StepProfiler(dump_dir)
+    send = HTTPAdapter.send
+
+    @wraps(send)
+    def timed_send(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send(*args, **kwargs)
+        finally:
+            profiler.record('http', time.perf_counter() - start)
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+
+    HTTPAdapter.send = timed_send
+    _profiler = profiler
+
+    try:
+        yield profiler
+
+    finally:
+        _profiler = None
+        HTTPAdapter.send = send
+
+        if not tracing:
+            tracemalloc.stop()
+
+
+def profile_stage(name: str):
+    """
+    Profile a stage (see StepProfiler.stage) if profile_steps is active.
+    :param name: name of the stage
+    """
+    return _profiler.stage(name) if _profiler is not None else contextlib.nullcontext()
+
+
 def log(func=None, break_on_error=True, custom_name=None):
 
     logger = logging.getLogger('db')
@@ -18,6 +234,10 @@ def log(func=None, break_on_error=True, custom_name=None):
     def auto_logger(*args, **kwargs):
 
         try:
+            if _profiler is not None:
+                with _profiler.step(custom_name or func.__qualname__):
+                    return func(*args, **kwargs)
+
             return func(*args, **kwargs)
 
         except BaseException as be:
@@ -28,4 +248,180 @@ def log(func=None, break_on_error=True, custom_name=None):
             if break_on_error:
                 raise be
 
-    return auto_logger
\ No newline at end of file
+    return auto_logger
+
+
+class BatchingDatabaseListener(QueueListener):
+    """
+    Queue listener that writes the queued log records to the StatusLog table of django_db_logger, with one bulk
+    insert per batch instead of one INSERT per record. A batch is written when it is full or when the flush
+    interval has passed since its first record.
+    """
+
+    def __init__(self, queue: Queue, flush_interval: float, batch_size: int):
+        super().__init__(queue)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self):
+        # wait for space instead of failing if the queue is full, the sentinel must not be dropped
+        self.queue.put(self._sentinel)
+
+    def _monitor(self):
+        while True:
+            batch, stop = [], False
+
+            record = self.queue.get()
+            deadline = time.monotonic() + self.flush_interval
+
+            while True:
+                if record is self._sentinel:
+                    stop = True
+                    break
+
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+
+                try:
+                    record = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+
+            for _ in range(len(batch) + stop):
+                self.queue.task_done()
+
+            if stop:
+                return
+
+    @staticmethod
+    def _write(records: List[logging.LogRecord]) -> None:
+        """
+        Write a batch of records. The listener thread uses its own database connection, so the records are
+        committed independently of the transaction of the thread that logged them. The timestamps of the
+        records are the time of the insert (StatusLog.create_datetime is auto_now_add).
+        """
+        from django.db import close_old_connections
+        from django_db_logger.models import StatusLog
+
+        try:
+            close_old_connections()
+            StatusLog.objects.bulk_create([
+                StatusLog(logger_name=record.name, level=record.levelno, msg=record.msg, trace=record.trace)
+                for record in records
+            ])
+        except Exception:
+            # logging must never break the application, report the failure like logging.Handler.handleError
+            traceback.print_exc()
+
+
+class BatchingDatabaseLogHandler(QueueHandler):
+    """
+    Non-blocking replacement of django_db_logger's DatabaseLogHandler. Records are put on a bounded queue and
+    written in batches by a listener thread (see BatchingDatabaseListener), so logging does not add database
+    round-trips to the logging thread.
+
+    If the queue is full, records below WARNING are dropped right away and records of WARNING and above wait up
+    to block_timeout seconds for space before being dropped. The number of dropped records is logged with the
+    next record that fits. The queue is flushed when the handler is closed (by logging.shutdown at exit) and
+    at the exit of multiprocessing workers.
+    """
+
+    def __init__(self, capacity: int = 10000, flush_interval: float = 2.0, batch_size: int = 500,
+                 block_timeout: float = 0.1):
+        """
+        :param capacity: maximum number of queued records
+        :param flush_interval: maximum number of seconds a record is queued before it is written
+        :param batch_size: maximum number of records written with one insert
+        :param block_timeout: number of seconds records of WARNING and above wait for space in a full queue
+        """
+        super().__init__(Queue(maxsize=capacity))
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self) -> None:
+        """
+        Start the listener on the first record of the process. Forked processes (e.g. the ETL workers) start
+        their own listener with an empty queue, the records queued in the parent are written by the parent.
+        """
+        if self._pid == os.getpid() and self._listener is not None:
+            return
+
+        with self._start_lock:
+            if self._pid == os.getpid() and self._listener is not None:
+                return
+
+            if self._pid is not None and self._pid != os.getpid():
+                self.queue = Queue(maxsize=self.capacity)
+                self.dropped = 0
+
+            # multiprocessing workers exit without running the atexit hooks of logging, but with its finalizers
+            multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+            self._listener = BatchingDatabaseListener(self.queue, self.flush_interval, self.batch_size)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Merge the arguments into the message and format the traceback on the logging thread, since the
+        arguments and the exception may change or be gone by the time the record is written.
+        """
+        trace = None
+        if record.exc_info:
+            trace = logging.Formatter().formatException(record.exc_info)
+
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.trace = trace
+
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self._ensure_listener()
+
+        try:
+            if record.levelno >= logging.WARNING:
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+            return
+
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self.enqueue(self.prepare(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f'{dropped} log records dropped, the log queue was full'
+            })))
+
+    def flush(self) -> None:
+        """
+        Block until all queued records are written.
+        """
+        if self._listener is not None and self._pid == os.getpid():
+            self.queue.join()
+
+    def close(self) -> None:
+        """
+        Write the queued records and stop the listener.
+        """
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+        super().close()
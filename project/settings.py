@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 import datetime
+import json
 import os
 from dotenv import load_dotenv
 
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'django_db_logger',
+    'rest_framework',
 ]
 
 MIDDLEWARE = [
@@ -90,6 +92,30 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# The file based backend is shared by the web server and the ETL process, which invalidates the cached
+# dashboard data.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, '.cache', 'django')),
+    }
+}
+
+# seconds the dashboard data stays cached (keys are versioned by ETL run anyway)
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', 60 * 60 * 24))
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework.authentication.SessionAuthentication'],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
+}
+
+# maximum number of points per zoom level of the performance chart
+PERFORMANCE_CHART_POINTS = int(os.getenv('PERFORMANCE_CHART_POINTS', 500))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -147,9 +173,13 @@ LOGGING = {
         },
     },
     'handlers': {
+        # queued and written in batches by a background thread (see project.logger.BatchingDatabaseLogHandler)
         'db_log': {
             'level': 'DEBUG',
-            'class': 'django_db_logger.db_log_handler.DatabaseLogHandler'
+            'class': 'project.logger.BatchingDatabaseLogHandler',
+            'capacity': int(os.getenv('DB_LOG_CAPACITY', 10000)),
+            'flush_interval': float(os.getenv('DB_LOG_FLUSH_INTERVAL', 2.0)),
+            'batch_size': int(os.getenv('DB_LOG_BATCH_SIZE', 500)),
         },
     },
     'loggers': {
@@ -170,5 +200,33 @@ MAIL = {
 # DegiroAPI credentials
 DEGIRO = {
     'USERNAME': os.getenv('DEGIRO_USERNAME'),
-    'PASSWORD': os.getenv('DEGIRO_PASSWORD')
+    'PASSWORD': os.getenv('DEGIRO_PASSWORD'),
+    # concurrent requests during extraction (1 extracts serially)
+    'MAX_WORKERS': int(os.getenv('DEGIRO_MAX_WORKERS', 4)),
+    'RETRIES': int(os.getenv('DEGIRO_RETRIES', 3)),
+    'BACKOFF_FACTOR': float(os.getenv('DEGIRO_BACKOFF_FACTOR', 0.5)),
+    # maximum requests per second per endpoint
+    'RATE_LIMIT': float(os.getenv('DEGIRO_RATE_LIMIT', 5)),
+}
+
+# Degiro accounts loaded by the ETL process, by account name. Further accounts are configured as JSON, e.g.
+# DEGIRO_ACCOUNTS='{"savings": {"USERNAME": "...", "PASSWORD": "..."}}'
+DEGIRO['ACCOUNTS'] = {
+    'default': {'USERNAME': DEGIRO['USERNAME'], 'PASSWORD': DEGIRO['PASSWORD']},
+    **json.loads(os.getenv('DEGIRO_ACCOUNTS', '{}')),
+}
+
+# Local cache of downloaded prices
+PRICE_CACHE = {
+    'ENABLED': os.getenv('PRICE_CACHE_ENABLED', 'true').lower() == 'true',
+    'PATH': os.getenv('PRICE_CACHE_PATH', os.path.join(BASE_DIR, '.cache', 'prices.sqlite3')),
+    'SETTLE_DAYS': int(os.getenv('PRICE_CACHE_SETTLE_DAYS', 3)),
+}
+
+# ETL process
+ETL = {
+    # persisted stage outputs of runs, used to resume failed runs
+    'CHECKPOINT_DIR': os.getenv('ETL_CHECKPOINT_DIR', os.path.join(BASE_DIR, '.cache', 'etl')),
+    # accounts run concurrently in separate processes
+    'PROCESSES': int(os.getenv('ETL_PROCESSES', 4)),
 }